@@ -279,7 +279,10 @@ export function VoiceChatPage({
 
   const handleAgentChange = async (agentId: string) => {
     setCurrentAgentId(agentId);
-    // 重新连接语音服务
+    // 已连接时在当前会话内切换（保留对话历史），否则重新连接语音服务
+    if (voiceServiceRef.current?.switchAgent(agentId)) {
+      return;
+    }
     if (voiceServiceRef.current) {
       try {
         // 先断开连接
@@ -41,6 +41,22 @@ export interface UserMemory {
 }
 
 const MEMORY_KEY = 'smart-qa-user-memory';
+const USER_ID_KEY = 'smart-qa-user-id';
+
+// 本浏览器的用户 ID：首次使用时随机生成并持久保存（语音服务端按它区分每个用户的长期记忆）
+export function getUserId(): string {
+  try {
+    let userId = localStorage.getItem(USER_ID_KEY);
+    if (!userId) {
+      userId = `u-${crypto.randomUUID()}`;
+      localStorage.setItem(USER_ID_KEY, userId);
+    }
+    return userId;
+  } catch (e) {
+    // 无法持久保存时不给 ID，服务端按匿名用户处理（不记忆）
+    return 'default';
+  }
+}
 
 // 默认记忆
 const defaultMemory: UserMemory = {
@@ -69,12 +85,12 @@ export function loadUserMemory(): UserMemory {
     const stored = localStorage.getItem(MEMORY_KEY);
     if (stored) {
       const memory = JSON.parse(stored);
-      return { ...defaultMemory, ...memory, lastUpdated: new Date(memory.lastUpdated) };
+      return { ...defaultMemory, ...memory, userId: getUserId(), lastUpdated: new Date(memory.lastUpdated) };
     }
   } catch (e) {
     console.error('Failed to load user memory:', e);
   }
-  return { ...defaultMemory };
+  return { ...defaultMemory, userId: getUserId() };
 }
 
 // 保存用户记忆
@@ -227,6 +243,27 @@ export function generateMemoryPrompt(memory: UserMemory): string {
   return `\n【用户画像 - 根据历史对话学习】\n${parts.join('\n')}\n\n请根据以上用户特征，提供更个性化的回答。`;
 }
 
+// 交给语音服务端长期记忆的条目（服务端按问题检索，只挑相关的几条放进上下文）
+export function getMemoryFacts(memory: UserMemory): string[] {
+  const facts: string[] = [];
+  if (memory.focusMetrics.length > 0) {
+    facts.push(`我关注这些指标：${memory.focusMetrics.join('、')}`);
+  }
+  if (memory.focusAreas.length > 0) {
+    facts.push(`我主要关注的业务领域：${memory.focusAreas.join('、')}`);
+  }
+  if (memory.preferredDimensions.length > 0) {
+    facts.push(`我喜欢按这些维度分析：${memory.preferredDimensions.join('、')}`);
+  }
+  if (memory.traits.preferQuickAnswer) {
+    facts.push('我喜欢简洁的回答，先给结论再展开');
+  }
+  if (memory.traits.preferDetailedAnalysis) {
+    facts.push('我喜欢详细深入的分析');
+  }
+  return facts;
+}
+
 // 获取推荐问题
 export function getRecommendedQuestions(memory: UserMemory): string[] {
   const recommendations: string[] = [];
@@ -1,6 +1,8 @@
 // DataAgent 语音服务 - WebSocket 客户端
 // 连接 Pipecat 后端，实现语音输入/输出
 
+import { getMemoryFacts, loadUserMemory } from './userMemory';
+
 export interface VoiceServiceConfig {
   wsUrl?: string;
   agentId?: string;
@@ -9,6 +11,9 @@ export interface VoiceServiceConfig {
   onError?: (error: Error) => void;
   onConnected?: () => void;
   onDisconnected?: () => void;
+  onAgentSwitched?: (agentId: string) => void;
+  onTextDelta?: (id: string, text: string) => void;
+  onTextDone?: (id: string, text: string, interrupted: boolean) => void;
 }
 
 export class VoiceService {
@@ -30,6 +35,11 @@ export class VoiceService {
   private recordingAudioContext: AudioContext | null = null; // 录音专用的 AudioContext
   private scriptProcessor: ScriptProcessorNode | null = null; // ScriptProcessorNode 引用
   private audioSource: MediaStreamAudioSourceNode | null = null; // 音频源引用
+  private resumeToken: string | null = null; // 服务端重启前下发的会话恢复令牌
+  private busyRetryAfterMs: number | null = null; // 服务端繁忙时建议的重试间隔
+  private busyRetries = 0; // 因繁忙已自动重连的次数
+  private maxBusyRetries = 3;
+  private busyRetryTimer: ReturnType<typeof setTimeout> | null = null;
 
   constructor(config: VoiceServiceConfig = {}) {
     this.config = {
@@ -44,6 +54,7 @@ export class VoiceService {
     this.connectionAttempts = 0;
     this.shouldRetry = true;
     this.lastErrorTime = 0;
+    this.busyRetries = 0;
   }
 
   // 初始化 AudioContext（在用户交互时调用）
@@ -134,6 +145,17 @@ export class VoiceService {
       this.lastErrorTime = 0;
       this.shouldRetry = true;
       console.log('[VoiceService] WebSocket connected');
+      // 先报上用户，服务端载入该用户的长期记忆
+      const memory = loadUserMemory();
+      this.ws?.send(JSON.stringify({ type: 'identify', user_id: memory.userId, facts: getMemoryFacts(memory) }));
+      if (this.resumeToken) {
+        // 服务端重启后重连：恢复对话历史和 Agent
+        this.ws?.send(JSON.stringify({ type: 'resume', token: this.resumeToken }));
+        this.resumeToken = null;
+      } else {
+        // 服务端启动时绑定的 Agent 可能与当前选择不同，连接后先同步一次
+        this.switchAgent(this.config.agentId || 'alisa');
+      }
       // 不在 onopen 时初始化 AudioContext，需要在用户交互后初始化
       // AudioContext 会在 startRecording 时由用户手势触发初始化
       this.config.onConnected?.();
@@ -161,6 +183,28 @@ export class VoiceService {
       if (event.code === 1000 || event.code === 1001) {
         console.log('[VoiceService] WebSocket disconnected', event.code, event.reason);
       }
+      // 服务端平滑重启（1012）：新进程已接管端口，带上令牌自动重连
+      if (event.code === 1012 && this.resumeToken) {
+        console.log('[VoiceService] Server restarting, reconnecting...');
+        setTimeout(() => {
+          this.connect().catch(() => this.config.onDisconnected?.());
+        }, 200);
+        return;
+      }
+      // 服务端繁忙（1013）：按服务端给的 retry_after 自动重连，超过次数后交给用户手动重试
+      if (event.code === 1013 && this.busyRetryAfterMs !== null) {
+        const delay = this.busyRetryAfterMs;
+        this.busyRetryAfterMs = null;
+        if (this.busyRetries < this.maxBusyRetries) {
+          this.busyRetries++;
+          console.log(`[VoiceService] Server busy, retrying in ${delay / 1000}s...`);
+          this.busyRetryTimer = setTimeout(() => {
+            this.busyRetryTimer = null;
+            this.connect().catch(() => this.config.onDisconnected?.());
+          }, delay);
+          return;
+        }
+      }
       this.config.onDisconnected?.();
       // 如果不是正常关闭，不在这里重连，让用户手动触发
     };
@@ -183,6 +227,49 @@ export class VoiceService {
     }
   }
 
+  // 服务端容量已满，连接会被关闭（1013），记下建议的重试间隔，关闭后按它自动重连
+  private handleBusy(data: { message?: string; retry_after?: number }) {
+    this.busyRetryAfterMs = Math.max(data.retry_after ?? 10, 1) * 1000;
+    this.config.onError?.(new Error(data.message || '语音服务繁忙，请稍后再试'));
+  }
+
+  // 处理服务端发来的控制消息，返回是否已处理
+  private handleControlMessage(data: { type?: string; [key: string]: any }): boolean {
+    if (data.type === 'busy') {
+      this.handleBusy(data);
+    } else if (data.type === 'agent_switched') {
+      this.config.onAgentSwitched?.(data.agent_id);
+    } else if (data.type === 'server_restart') {
+      this.resumeToken = data.token || null;
+    } else if (data.type === 'text_delta') {
+      this.config.onTextDelta?.(data.id, data.text);
+    } else if (data.type === 'text_done') {
+      this.config.onTextDone?.(data.id, data.text, !!data.interrupted);
+    } else if (data.type === 'session_resumed') {
+      // 令牌过期或已被使用时，退回到重新同步 Agent（对话历史丢失）
+      if (!data.ok) {
+        this.switchAgent(this.config.agentId || 'alisa');
+      }
+    } else {
+      return false;
+    }
+    return true;
+  }
+
+  // 处理一条 JSON 消息；服务端把同一 tick 内的控制消息合成 JSON 数组发送
+  private handleJsonMessage(data: any) {
+    if (Array.isArray(data)) {
+      data.forEach((item) => this.handleJsonMessage(item));
+    } else if (data?.type === 'transcript') {
+      this.config.onTranscript?.(data.text);
+    } else if (data && this.handleControlMessage(data)) {
+      // 已处理
+    } else if (import.meta.env.DEV) {
+      // 只在开发环境记录其他文本消息（RTVI 事件、指标等）
+      console.log('[VoiceService] Received text message:', data);
+    }
+  }
+
   // 处理 WebSocket 消息
   private handleMessage(event: MessageEvent) {
     if (event.data instanceof ArrayBuffer) {
@@ -200,13 +287,7 @@ export class VoiceService {
         // 尝试解析为 JSON 文本消息（转录结果等）
         try {
           const text = new TextDecoder().decode(event.data);
-          const data = JSON.parse(text);
-          if (data.type === 'transcript') {
-            this.config.onTranscript?.(data.text);
-          } else if (import.meta.env.DEV) {
-            // 只在开发环境记录其他文本消息
-            console.log('[VoiceService] Received text message:', data);
-          }
+          this.handleJsonMessage(JSON.parse(text));
         } catch (e) {
           // 不是文本，可能是 Protobuf 编码的非音频帧（metrics, RTVI 等）
           // 这些帧不需要处理，静默忽略
@@ -218,17 +299,15 @@ export class VoiceService {
       }
     } else if (typeof event.data === 'string') {
       // 文本数据（转录结果等）
+      let data;
       try {
-        const data = JSON.parse(event.data);
-        if (data.type === 'transcript') {
-          this.config.onTranscript?.(data.text);
-        } else if (import.meta.env.DEV) {
-          console.log('[VoiceService] Received text message:', data);
-        }
+        data = JSON.parse(event.data);
       } catch (e) {
         // 普通文本消息
         this.config.onTranscript?.(event.data);
+        return;
       }
+      this.handleJsonMessage(data);
     } else if (event.data instanceof Blob) {
       // 处理 Blob 类型的音频数据
       event.data.arrayBuffer().then((buffer) => {
@@ -516,6 +595,13 @@ export class VoiceService {
     this.audioQueue = [];
     this.isPlaying = false;
     this.nextPlayTime = 0;
+    this.resumeToken = null;
+    this.busyRetryAfterMs = null;
+    this.busyRetries = 0;
+    if (this.busyRetryTimer) {
+      clearTimeout(this.busyRetryTimer);
+      this.busyRetryTimer = null;
+    }
 
     if (this.ws) {
       this.ws.close();
@@ -530,6 +616,27 @@ export class VoiceService {
     }
   }
 
+  // 会话内切换 Agent（保留对话历史，不重连）
+  switchAgent(agentId: string): boolean {
+    this.config.agentId = agentId;
+    if (this.ws?.readyState !== WebSocket.OPEN) {
+      return false;
+    }
+    this.ws.send(JSON.stringify({ type: 'switch_agent', agent_id: agentId }));
+    return true;
+  }
+
+  // 打字输入：走同一条连接进入当前会话上下文，回答通过 onTextDelta / onTextDone 流式返回
+  // speak 为 true 时同时朗读回答；返回请求 ID，未连接时返回 null
+  sendText(text: string, speak = false): string | null {
+    if (this.ws?.readyState !== WebSocket.OPEN || !text.trim()) {
+      return null;
+    }
+    const id = `t${Date.now().toString(36)}`;
+    this.ws.send(JSON.stringify({ type: 'text_input', text, id, speak }));
+    return id;
+  }
+
   // 检查是否已连接
   isConnected(): boolean {
     return this.ws?.readyState === WebSocket.OPEN;
@@ -0,0 +1,243 @@
+#
+# DataAgent 语音服务 - 预合成应答语（"好的，我看一下"）
+# 启动时用当前 TTS 音色合成一次并常驻内存，用户说完后 LLM 迟迟没有出声时立即播放，
+# 掩盖 Smart Turn → STT → LLM 首 token → TTS 首字节之间的空白
+#
+
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+import aiohttp
+import numpy as np
+from loguru import logger
+
+from pipecat.frames.frames import (
+    CancelFrame,
+    EndFrame,
+    Frame,
+    InterruptionFrame,
+    LLMFullResponseStartFrame,
+    StartFrame,
+    TTSAudioRawFrame,
+    UserStartedSpeakingFrame,
+    UserStoppedSpeakingFrame,
+)
+from pipecat.processors.frame_processor import FrameDirection, FrameProcessor
+from pipecat.services.tts_service import TTSService
+
+from governor import Priority, request_priority
+
+# 每次推送给输出传输层的音频长度，越短取消越及时
+CHUNK_SECS = 0.04
+# 取消时对下一段音频做淡出，避免截断产生爆音
+FADE_SECS = 0.02
+
+
+@dataclass
+class AckClip:
+    phrase: str
+    audio: bytes
+    sample_rate: int
+
+    @property
+    def duration(self) -> float:
+        return len(self.audio) / 2 / self.sample_rate
+
+
+class AckFillerLibrary:
+    """一个 Agent + 音色 + 采样率对应的一组预合成应答语"""
+
+    def __init__(self, phrases: list[str]):
+        self.phrases = phrases
+        self.clips: list[AckClip] = []
+        self._next = 0
+        self._warm_lock = asyncio.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return bool(self.clips)
+
+    @property
+    def warming(self) -> bool:
+        return self._warm_lock.locked()
+
+    def next_clip(self) -> AckClip | None:
+        """轮流使用各条应答语，避免每轮都说同一句"""
+        if not self.clips:
+            return None
+        clip = self.clips[self._next % len(self.clips)]
+        self._next += 1
+        return clip
+
+    async def warm(self, tts: TTSService, sample_rate: int):
+        """用给定的 TTS 服务逐条合成应答语（只在启动时调用一次）"""
+        async with self._warm_lock:
+            if self.clips:
+                return
+            for phrase in self.phrases:
+                audio = bytearray()
+                async for frame in tts.run_tts(phrase):
+                    if isinstance(frame, TTSAudioRawFrame):
+                        audio.extend(frame.audio)
+                if audio:
+                    self.clips.append(AckClip(phrase, bytes(audio), sample_rate))
+                else:
+                    logger.warning(f"⚠️ 应答语合成失败，已跳过: {phrase}")
+
+
+# 进程内缓存：同一 Agent / 音色 / 采样率只合成一次，断线重连后直接复用
+_LIBRARIES: dict[tuple, AckFillerLibrary] = {}
+
+
+def get_library(agent_id: str, voice_key: str, sample_rate: int, phrases: list[str]) -> AckFillerLibrary:
+    key = (agent_id, voice_key, sample_rate)
+    library = _LIBRARIES.get(key)
+    if library is None:
+        library = AckFillerLibrary(phrases)
+        _LIBRARIES[key] = library
+    return library
+
+
+class AckFillerPlayer(FrameProcessor):
+    """在 TTS 之后播放预合成应答语
+
+    用户停止说话后，如果 LLM 已开始生成但在 delay_secs 内还没有真实 TTS 音频，
+    就按实时节奏推送一条应答语；真实音频一到、用户重新开口或被打断时立即停止。
+    每轮最多播放一次，不产生任何额外的服务商调用。
+
+    Args:
+        agent_id: Agent ID，用于选择应答语
+        phrases: 应答语列表
+        voice_key: 音色标识，作为缓存键的一部分
+        http_tts_factory: (aiohttp 会话, 采样率, 音色) -> 独立的 HTTP 版 TTS，用它做预合成；
+            不用管线中的 TTS，免得预合成的指标被计入用量和通话存档。为 None 时禁用应答语
+        delay_secs: 用户说完后等待多久仍无音频才播放
+    """
+
+    def __init__(
+        self,
+        agent_id: str,
+        phrases: list[str],
+        voice_key: str,
+        http_tts_factory: Callable[[aiohttp.ClientSession, int, str | None], TTSService] | None = None,
+        delay_secs: float = 0.8,
+    ):
+        super().__init__()
+        self._agent_id = agent_id
+        self._phrases = phrases
+        self._voice_key = voice_key
+        self._http_tts_factory = http_tts_factory
+        self._delay_secs = delay_secs
+        self._voice: str | None = None
+        self._sample_rate: int | None = None
+        self._library: AckFillerLibrary | None = None
+        self._warm_tasks: list[asyncio.Task] = []
+        self._play_task: asyncio.Task | None = None
+        self._user_stopped_at: float | None = None
+        self._turn_armed = False
+        # 正在播放的应答语及播放位置（字节），用于取消时淡出
+        self._clip: AckClip | None = None
+        self._position = 0
+
+    async def process_frame(self, frame: Frame, direction: FrameDirection):
+        await super().process_frame(frame, direction)
+
+        if isinstance(frame, StartFrame):
+            await self.push_frame(frame, direction)
+            self._sample_rate = frame.audio_out_sample_rate
+            self._select_library()
+            return
+
+        if isinstance(frame, (EndFrame, CancelFrame)):
+            await self._stop_filler(fade=False)
+            for task in self._warm_tasks:
+                await self.cancel_task(task)
+            self._warm_tasks.clear()
+        elif isinstance(frame, UserStoppedSpeakingFrame):
+            self._user_stopped_at = time.monotonic()
+            self._turn_armed = True
+        elif isinstance(frame, (UserStartedSpeakingFrame, InterruptionFrame)):
+            self._turn_armed = False
+            await self._stop_filler(fade=False)
+        elif isinstance(frame, LLMFullResponseStartFrame) and direction == FrameDirection.DOWNSTREAM:
+            self._maybe_schedule_filler()
+        elif isinstance(frame, TTSAudioRawFrame) and direction == FrameDirection.DOWNSTREAM:
+            # 真实音频到了：本轮不再需要应答语
+            self._turn_armed = False
+            await self._stop_filler(fade=True)
+
+        await self.push_frame(frame, direction)
+
+    def set_agent(self, agent_id: str, phrases: list[str], voice: str | None = None):
+        """会话中切换 Agent / 音色：换用对应的应答语库，没有合成过的在后台预合成"""
+        self._agent_id = agent_id
+        self._phrases = phrases
+        self._voice = voice or self._voice
+        if self._sample_rate:
+            self._select_library()
+
+    def _select_library(self):
+        voice_key = f"{self._voice_key}:{self._voice}" if self._voice else self._voice_key
+        self._library = get_library(self._agent_id, voice_key, self._sample_rate, self._phrases)
+        if not self._library.ready and not self._library.warming:
+            self._warm_tasks = [task for task in self._warm_tasks if not task.done()]
+            self._warm_tasks.append(self.create_task(self._warm(self._library, self._sample_rate, self._voice)))
+
+    async def _warm(self, library: AckFillerLibrary, sample_rate: int, voice: str | None):
+        # 预合成属于新会话的准备工作，排队时让位给进行中的对话
+        request_priority.set(Priority.SESSION)
+        started = time.monotonic()
+        try:
+            if not self._http_tts_factory:
+                logger.warning("⚠️ 当前 TTS 不支持预合成应答语，已禁用")
+                return
+            async with aiohttp.ClientSession() as session:
+                synthesizer = self._http_tts_factory(session, sample_rate, voice)
+                # 独立实例不在管线里，收不到 StartFrame，直接设定采样率
+                synthesizer._sample_rate = sample_rate
+                await library.warm(synthesizer, sample_rate)
+            logger.info(
+                f"✅ 预合成应答语 {len(library.clips)} 条，耗时 {time.monotonic() - started:.1f}s"
+            )
+        except Exception as e:
+            logger.warning(f"⚠️ 预合成应答语失败，已禁用: {e}")
+
+    def _maybe_schedule_filler(self):
+        if not self._turn_armed or not self._library or not self._library.ready:
+            return
+        if self._play_task and not self._play_task.done():
+            return
+        self._turn_armed = False
+        elapsed = time.monotonic() - (self._user_stopped_at or time.monotonic())
+        self._play_task = self.create_task(self._play(max(self._delay_secs - elapsed, 0.0)))
+
+    async def _play(self, delay: float):
+        await asyncio.sleep(delay)
+        clip = self._library.next_clip()
+        if not clip:
+            return
+        chunk_bytes = int(clip.sample_rate * CHUNK_SECS) * 2
+        self._clip = clip
+        self._position = 0
+        logger.debug(f"Playing ack filler: {clip.phrase}")
+        while self._position < len(clip.audio):
+            chunk = clip.audio[self._position : self._position + chunk_bytes]
+            self._position += len(chunk)
+            await self.push_frame(TTSAudioRawFrame(chunk, clip.sample_rate, 1))
+            # 按实时节奏推送，队列里最多只积压一小段，取消时能马上停
+            await asyncio.sleep(len(chunk) / 2 / clip.sample_rate)
+        self._clip = None
+
+    async def _stop_filler(self, fade: bool):
+        if not self._play_task:
+            return
+        task, self._play_task = self._play_task, None
+        await self.cancel_task(task)
+        clip, self._clip = self._clip, None
+        if fade and clip and self._position < len(clip.audio):
+            tail = clip.audio[self._position : self._position + int(clip.sample_rate * FADE_SECS) * 2]
+            samples = np.frombuffer(tail, dtype=np.int16).astype(np.float32)
+            samples *= np.linspace(1.0, 0.0, num=len(samples), dtype=np.float32)
+            await self.push_frame(TTSAudioRawFrame(samples.astype(np.int16).tobytes(), clip.sample_rate, 1))
@@ -0,0 +1,140 @@
+#
+# DataAgent 语音服务 - 会话内切换 Agent
+# 客户端发送 {"type": "switch_agent", "agent_id": "attributor"} 即可在同一条连接上换人设：
+# 替换 LLMContext 开头的系统提示词、按需切换 TTS 音色和应答语，对话历史、模型和连接全部复用
+#
+
+import json
+import time
+from typing import Callable
+
+from loguru import logger
+
+from pipecat.frames.frames import (
+    Frame,
+    InputTransportMessageFrame,
+    OutputTransportMessageFrame,
+    TTSUpdateSettingsFrame,
+)
+from pipecat.processors.aggregators.llm_context import LLMContext
+from pipecat.processors.frame_processor import FrameDirection, FrameProcessor
+from pipecat.transports.base_transport import BaseTransport
+
+from ack_fillers import AckFillerPlayer
+from prompt_cache import PromptBuilder, PromptCacheMetrics
+from usage import UsageTracker
+
+SWITCH_MESSAGE_TYPE = "switch_agent"
+
+
+class AgentSwitcher(FrameProcessor):
+    """处理客户端的切换 Agent 控制消息
+
+    放在 transport.input() 之后、RTVIProcessor 之前（RTVI 会丢弃非 RTVI 消息）。
+    收到切换消息时：
+    - 用新 Agent 的可缓存前缀和动态内容替换 LLMContext 开头的系统消息，保留历史；
+    - 音色（消息里的 voice 或 voices 配置）有变化时向下游推送 TTSUpdateSettingsFrame；
+    - 更新缓存统计、用量统计和应答语；
+    - 通过传输层回复 {"type": "agent_switched", ...}。
+
+    正在播放的回答不会被打断，新人设从下一轮开始生效。
+
+    Args:
+        agent_id: 初始 Agent
+        context: 会话的 LLMContext
+        prompt_builder: 提示词构建器
+        transport: 用于回复客户端的传输层
+        voices: Agent ID -> TTS 音色，未配置的 Agent 保持当前音色
+        ack_phrases: Agent ID -> 应答语（需包含 "default"）
+        prompt_cache_metrics: 缓存统计处理器（可选）
+        ack_filler: 应答语播放器（可选）
+        usage_tracker: 用量统计（可选），切换后的用量记到新 Agent 上
+        sections: 返回动态内容附加段落的函数（可选），切换时重新生成
+    """
+
+    def __init__(
+        self,
+        agent_id: str,
+        context: LLMContext,
+        prompt_builder: PromptBuilder,
+        transport: BaseTransport,
+        voices: dict[str, str] | None = None,
+        ack_phrases: dict[str, list[str]] | None = None,
+        prompt_cache_metrics: PromptCacheMetrics | None = None,
+        ack_filler: AckFillerPlayer | None = None,
+        usage_tracker: UsageTracker | None = None,
+        sections: Callable[[], dict[str, str]] | None = None,
+    ):
+        super().__init__()
+        self.agent_id = prompt_builder.resolve_agent(agent_id)
+        self._context = context
+        self._prompt_builder = prompt_builder
+        self._transport = transport
+        self._voices = voices or {}
+        self._ack_phrases = ack_phrases or {}
+        self._prompt_cache_metrics = prompt_cache_metrics
+        self._ack_filler = ack_filler
+        self._usage_tracker = usage_tracker
+        self._sections = sections
+        self._voice = self._voices.get(self.agent_id)
+
+    async def process_frame(self, frame: Frame, direction: FrameDirection):
+        await super().process_frame(frame, direction)
+
+        if isinstance(frame, InputTransportMessageFrame) and self._is_switch(frame.message):
+            await self.switch(frame.message.get("agent_id", ""), frame.message.get("voice"))
+            return
+
+        await self.push_frame(frame, direction)
+
+    @staticmethod
+    def _is_switch(message) -> bool:
+        return isinstance(message, dict) and message.get("type") == SWITCH_MESSAGE_TYPE
+
+    async def switch(self, agent_id: str, voice: str | None = None):
+        started = time.perf_counter()
+        previous = self.agent_id
+        self.agent_id = self._prompt_builder.resolve_agent(agent_id)
+
+        sections = self._sections() if self._sections else None
+        self._context.set_messages(
+            self._prompt_builder.rebuild_messages(self._context.get_messages(), self.agent_id, sections)
+        )
+
+        if self._prompt_cache_metrics:
+            self._prompt_cache_metrics.agent_id = self.agent_id
+            self._prompt_cache_metrics.prefix_hash = self._prompt_builder.prefix_hash(self.agent_id)
+        if self._usage_tracker:
+            self._usage_tracker.agent_id = self.agent_id
+
+        voice = voice or self._voices.get(self.agent_id)
+        if voice and voice != self._voice:
+            self._voice = voice
+            await self.push_frame(TTSUpdateSettingsFrame(settings={"voice": voice}))
+
+        if self._ack_filler:
+            phrases = self._ack_phrases.get(self.agent_id) or self._ack_phrases.get("default", [])
+            self._ack_filler.set_agent(self.agent_id, phrases, self._voice)
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        logger.info(
+            f"🔀 Agent switched: {previous} → {self.agent_id} "
+            f"(prefix {self._prompt_builder.prefix_hash(self.agent_id)}, {elapsed_ms:.1f}ms)"
+        )
+        await self.reply(
+            {
+                "type": "agent_switched",
+                "agent_id": self.agent_id,
+                "previous": previous,
+                "voice": self._voice,
+                "elapsed_ms": round(elapsed_ms, 1),
+            }
+        )
+
+    async def reply(self, message: dict):
+        """通过传输层给客户端发一条控制消息"""
+        output_transport = self._transport.output()
+        if hasattr(output_transport, "send_message"):
+            await output_transport.send_message(
+                OutputTransportMessageFrame(message=json.dumps(message, ensure_ascii=False))
+            )
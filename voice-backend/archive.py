@@ -0,0 +1,494 @@
+#
+# DataAgent 语音服务 - 对话归档（追加写入的 zstd 分段文件 + 索引）
+# LLMContext 随会话结束消失，对话内容之前没有留下任何记录。TurnArchiver 作为管线观察者拼出每一轮
+# （用户转写、助手回答、Agent、工具调用、延迟），结束时放进无阻塞队列；后台线程按批压缩成独立的
+# zstd 帧追加到分段文件，并在 SQLite 索引里记下每个帧包含的会话、Agent 和时间范围，
+# archive_query.py 按索引只解压需要的帧。事件循环上只有一次 put_nowait
+#
+
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Callable, Iterator
+
+from loguru import logger
+
+from pipecat.frames.frames import (
+    BotStartedSpeakingFrame,
+    BotStoppedSpeakingFrame,
+    FunctionCallInProgressFrame,
+    LLMFullResponseEndFrame,
+    LLMFullResponseStartFrame,
+    LLMMessagesAppendFrame,
+    LLMTextFrame,
+    MetricsFrame,
+    TranscriptionFrame,
+    UserStartedSpeakingFrame,
+    UserStoppedSpeakingFrame,
+)
+from pipecat.metrics.metrics import TTFBMetricsData
+from pipecat.observers.base_observer import BaseObserver, FramePushed
+from pipecat.processors.frame_processor import FrameDirection
+
+from paths import data_path
+
+SEGMENT_SUFFIX = ".jsonl.zst"
+# 重建索引时每次喂给解压器的字节数
+_SCAN_CHUNK_BYTES = 64 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS frames (
+    segment TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    session_id TEXT NOT NULL,
+    agent_id TEXT NOT NULL,
+    first_ts REAL NOT NULL,
+    last_ts REAL NOT NULL,
+    turns INTEGER NOT NULL,
+    PRIMARY KEY (segment, offset, session_id, agent_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS frames_session ON frames (session_id);
+CREATE INDEX IF NOT EXISTS frames_agent_time ON frames (agent_id, last_ts);
+CREATE INDEX IF NOT EXISTS frames_time ON frames (last_ts);
+"""
+
+_INSERT = "INSERT OR REPLACE INTO frames VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+
+_TURN_FRAMES = (
+    TranscriptionFrame,
+    UserStartedSpeakingFrame,
+    UserStoppedSpeakingFrame,
+    LLMFullResponseStartFrame,
+    LLMTextFrame,
+    LLMFullResponseEndFrame,
+    LLMMessagesAppendFrame,
+    FunctionCallInProgressFrame,
+    BotStartedSpeakingFrame,
+    BotStoppedSpeakingFrame,
+    MetricsFrame,
+)
+
+
+def _connect(root: Path) -> sqlite3.Connection:
+    db = sqlite3.connect(root / "index.db", timeout=5)
+    db.executescript(_SCHEMA)
+    return db
+
+
+def _index_rows(segment: str, offset: int, length: int, records: list[dict]) -> list[tuple]:
+    """一个帧里每个 (会话, Agent) 一行索引"""
+    groups: dict[tuple[str, str], list[float]] = {}
+    for record in records:
+        key = (record["session_id"], record["agent_id"])
+        entry = groups.setdefault(key, [record["ts"], record["ts"], 0])
+        entry[0] = min(entry[0], record["ts"])
+        entry[1] = max(entry[1], record["ts"])
+        entry[2] += 1
+    return [(segment, offset, length, *key, *entry) for key, entry in groups.items()]
+
+
+class ConversationArchive:
+    """对话归档的写入端
+
+    submit() 把一轮记录放进有界队列，满了直接丢弃并计数，不会阻塞调用方；
+    后台线程每 flush_secs 或攒够 batch_size 条写一次：整批编码成 JSON Lines，压缩成一个独立的
+    zstd 帧追加到当前分段文件（整个文件仍可用 zstd -dc 直接解压），再写入这个帧的索引。
+    分段文件超过 segment_mb 后换新文件；文件名带进程号，平滑重启时新旧进程不会写同一个文件。
+
+    Args:
+        root: 归档目录（分段文件和 index.db）
+        segment_mb: 单个分段文件的大小上限（MB）
+        flush_secs: 最长攒批时间
+        batch_size: 每批最多条数
+        max_queue: 队列容量
+        level: zstd 压缩级别
+    """
+
+    def __init__(
+        self,
+        root: str,
+        segment_mb: float = 64,
+        flush_secs: float = 2.0,
+        batch_size: int = 256,
+        max_queue: int = 10000,
+        level: int = 3,
+    ):
+        import zstandard
+
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._segment_bytes = int(segment_mb * 1024 * 1024)
+        self._flush_secs = flush_secs
+        self._batch_size = batch_size
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._segment: Path | None = None
+        self._file = None
+        self.records = 0
+        self.frames = 0
+        self.dropped = 0
+        self.raw_bytes = 0
+        self.written_bytes = 0
+        self._thread = threading.Thread(target=self._run, name="conversation-archive", daemon=True)
+        self._thread.start()
+
+    def submit(self, record: dict) -> bool:
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def close(self, timeout: float = 5.0):
+        """写完队列里剩下的记录后停止后台线程（进程退出时调用）"""
+        if self._thread.is_alive():
+            try:
+                self._queue.put(None, timeout=timeout)
+            except queue.Full:
+                pass
+            self._thread.join(timeout)
+
+    def stats(self) -> dict:
+        return {
+            "records": self.records,
+            "frames": self.frames,
+            "dropped": self.dropped,
+            "queued": self._queue.qsize(),
+            "ratio": round(self.raw_bytes / self.written_bytes, 1) if self.written_bytes else None,
+        }
+
+    # ---- 后台线程 ----
+
+    def _run(self):
+        db = _connect(self.root)
+        try:
+            while True:
+                batch, stop = self._collect()
+                if batch:
+                    try:
+                        self._write(db, batch)
+                    except Exception as e:
+                        logger.error(f"❌ Archive write failed, {len(batch)} turns lost: {e!r}")
+                if stop:
+                    return
+        finally:
+            db.close()
+            if self._file:
+                self._file.close()
+
+    def _collect(self) -> tuple[list[dict], bool]:
+        """等第一条记录，然后在 flush_secs 内继续攒批；返回 (批, 是否收到停止信号)"""
+        item = self._queue.get()
+        if item is None:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + self._flush_secs
+        while len(batch) < self._batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _write(self, db: sqlite3.Connection, batch: list[dict]):
+        raw = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in batch).encode("utf-8")
+        compressed = self._compressor.compress(raw)
+        if self._file is None or self._file.tell() + len(compressed) > self._segment_bytes:
+            self._rotate()
+        offset = self._file.tell()
+        self._file.write(compressed)
+        self._file.flush()
+        # 先落盘数据再写索引：中途崩溃最多留下没有索引的帧，archive_query.py --reindex 可以补上
+        with db:
+            db.executemany(_INSERT, _index_rows(self._segment.name, offset, len(compressed), batch))
+        self.records += len(batch)
+        self.frames += 1
+        self.raw_bytes += len(raw)
+        self.written_bytes += len(compressed)
+
+    def _rotate(self):
+        if self._file:
+            self._file.close()
+        # 每次启动和写满时都开新文件，不会往上次崩溃时写了一半的文件后面追加
+        self._segment = self.root / f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}{SEGMENT_SUFFIX}"
+        self._file = open(self._segment, "ab")
+        logger.debug(f"Archive segment: {self._segment}")
+
+
+class ArchiveReader:
+    """按索引查询对话归档：只读取和解压包含目标会话 / Agent / 时间段的帧"""
+
+    def __init__(self, root: str):
+        import zstandard
+
+        self.root = Path(root)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def _where(self, session_id: str | None, agent_id: str | None, since: float | None, until: float | None):
+        clauses, params = [], []
+        for clause, value in (
+            ("session_id = ?", session_id),
+            ("agent_id = ?", agent_id),
+            ("last_ts >= ?", since),
+            ("first_ts < ?", until),
+        ):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        return (f"WHERE {' AND '.join(clauses)}" if clauses else ""), params
+
+    def sessions(
+        self,
+        agent_id: str | None = None,
+        since: float | None = None,
+        until: float | None = None,
+        limit: int = 50,
+    ) -> list[dict]:
+        """最近的会话：[{session_id, agent_id, first_ts, last_ts, turns}]（切换过 Agent 的会话每个 Agent 一行）"""
+        where, params = self._where(None, agent_id, since, until)
+        with _connect(self.root) as db:
+            rows = db.execute(
+                f"SELECT session_id, agent_id, MIN(first_ts), MAX(last_ts), SUM(turns) FROM frames {where} "
+                f"GROUP BY session_id, agent_id ORDER BY MAX(last_ts) DESC LIMIT ?",
+                [*params, limit],
+            ).fetchall()
+        keys = ["session_id", "agent_id", "first_ts", "last_ts", "turns"]
+        return [dict(zip(keys, row)) for row in rows]
+
+    def turns(
+        self,
+        session_id: str | None = None,
+        agent_id: str | None = None,
+        since: float | None = None,
+        until: float | None = None,
+    ) -> list[dict]:
+        """符合条件的轮次记录，按时间排序"""
+        where, params = self._where(session_id, agent_id, since, until)
+        with _connect(self.root) as db:
+            frames = db.execute(
+                f"SELECT DISTINCT segment, offset, length FROM frames {where} ORDER BY segment, offset", params
+            ).fetchall()
+        result = []
+        for record in self._read_frames(frames):
+            if (
+                (session_id is None or record["session_id"] == session_id)
+                and (agent_id is None or record["agent_id"] == agent_id)
+                and (since is None or record["ts"] >= since)
+                and (until is None or record["ts"] < until)
+            ):
+                result.append(record)
+        return sorted(result, key=lambda record: record["ts"])
+
+    def _read_frames(self, frames: list[tuple[str, int, int]]) -> Iterator[dict]:
+        handle, current = None, None
+        try:
+            for segment, offset, length in frames:
+                if segment != current:
+                    if handle:
+                        handle.close()
+                    handle, current = open(self.root / segment, "rb"), segment
+                handle.seek(offset)
+                for line in self._decompressor.decompress(handle.read(length)).splitlines():
+                    yield json.loads(line)
+        finally:
+            if handle:
+                handle.close()
+
+    def rebuild_index(self) -> int:
+        """逐帧扫描全部分段文件重建索引（帧写入后、索引写入前进程崩溃时使用），返回帧数"""
+        count = 0
+        with _connect(self.root) as db:
+            db.execute("DELETE FROM frames")
+            for path in sorted(self.root.glob(f"*{SEGMENT_SUFFIX}")):
+                data = memoryview(path.read_bytes())
+                offset = 0
+                while offset < len(data):
+                    decompressor = self._decompressor.decompressobj()
+                    parts = []
+                    end = offset
+                    try:
+                        # 分块喂给解压器：unused_data 只是最后一块的剩余部分，不会每帧复制整个文件尾部
+                        while not decompressor.eof and end < len(data):
+                            chunk = data[end : end + _SCAN_CHUNK_BYTES]
+                            parts.append(decompressor.decompress(chunk))
+                            end += len(chunk)
+                    except Exception:
+                        logger.warning(f"⚠️ {path.name}: 偏移 {offset} 之后的数据不完整，已跳过")
+                        break
+                    length = end - offset - len(decompressor.unused_data)
+                    if length <= 0 or not decompressor.eof:
+                        logger.warning(f"⚠️ {path.name}: 偏移 {offset} 之后的帧不完整，已跳过")
+                        break
+                    records = [json.loads(line) for line in b"".join(parts).splitlines()]
+                    db.executemany(_INSERT, _index_rows(path.name, offset, length, records))
+                    offset += length
+                    count += 1
+        return count
+
+
+class TurnArchiver(BaseObserver):
+    """从管线帧里拼出每一轮对话，结束时交给 ConversationArchive
+
+    一轮从用户开口（或最终转写）开始，包含用户转写、助手回答、函数调用和延迟：
+    response（用户停止说话到机器人开口）、llm_ttfb、tts_ttfb（本轮第一次）。
+    LLM 回答结束且机器人说完时归档；回答到一半用户又开口时记为 interrupted 并归档；
+    会话结束时调用 end_session() 归档最后一轮。
+
+    Args:
+        archive: 归档写入端
+        session_id: 返回当前会话 ID 的函数（与用量统计的会话 ID 一致）
+        agent_id: 返回当前 Agent 的函数（会话内可能切换）
+        processors: 处理器名称 -> llm / tts，用于从 MetricsFrame 里取首包延迟
+    """
+
+    def __init__(
+        self,
+        archive: ConversationArchive,
+        session_id: Callable[[], str],
+        agent_id: Callable[[], str],
+        processors: dict[str, str],
+    ):
+        super().__init__()
+        self._archive = archive
+        self._session_id = session_id
+        self._agent_id = agent_id
+        self._processors = processors
+        # 最近见过的帧 ID（有界）：同一帧在每两个处理器之间都会被观察到一次
+        self._seen: set[int] = set()
+        self._seen_order: deque[int] = deque()
+        self._turn: dict | None = None
+        self._turns = 0
+
+    def _current(self) -> dict:
+        if self._turn is None:
+            self._turn = {
+                "ts": time.time(),
+                "user": [],
+                "assistant": [],
+                "tools": [],
+                "latency": {},
+                "marks": {},
+                "llm_done": False,
+                "bot_speaking": False,
+            }
+        return self._turn
+
+    async def on_push_frame(self, data: FramePushed):
+        frame = data.frame
+        if data.direction != FrameDirection.DOWNSTREAM or not isinstance(frame, _TURN_FRAMES):
+            return
+        if frame.id in self._seen:
+            return
+        self._seen.add(frame.id)
+        self._seen_order.append(frame.id)
+        if len(self._seen_order) > 256:
+            self._seen.discard(self._seen_order.popleft())
+        now = time.monotonic()
+
+        if isinstance(frame, UserStartedSpeakingFrame):
+            if self._turn and self._turn["assistant"]:
+                # 用户在回答过程中开口：上一轮被打断
+                self._finish(interrupted=self._turn["bot_speaking"] or not self._turn["llm_done"])
+            self._current()["marks"].setdefault("user_started", now)
+        elif isinstance(frame, TranscriptionFrame):
+            if self._turn and self._turn["assistant"]:
+                self._finish(interrupted=not self._turn["llm_done"])
+            self._current()["user"].append(frame.text)
+        elif isinstance(frame, LLMMessagesAppendFrame):
+            # 文字通道的输入（text_channel.py）
+            text = "".join(
+                m["content"] for m in frame.messages if m.get("role") == "user" and isinstance(m.get("content"), str)
+            )
+            if text:
+                if self._turn and self._turn["assistant"]:
+                    self._finish(interrupted=not self._turn["llm_done"])
+                self._current()["user"].append(text)
+        elif isinstance(frame, UserStoppedSpeakingFrame):
+            self._current()["marks"]["user_stopped"] = now
+        elif isinstance(frame, LLMFullResponseStartFrame):
+            self._current()["llm_done"] = False
+        elif isinstance(frame, LLMTextFrame):
+            self._current()["assistant"].append(frame.text)
+        elif isinstance(frame, FunctionCallInProgressFrame):
+            self._current()["tools"].append(frame.function_name)
+        elif isinstance(frame, LLMFullResponseEndFrame):
+            turn = self._current()
+            turn["llm_done"] = True
+            # 不朗读的回答（skip_tts）没有机器人说话事件，LLM 结束即本轮结束
+            if turn["assistant"] and not turn["bot_speaking"] and ("bot_started" in turn["marks"] or frame.skip_tts):
+                self._finish()
+        elif isinstance(frame, BotStartedSpeakingFrame):
+            turn = self._current()
+            turn["bot_speaking"] = True
+            if "bot_started" not in turn["marks"]:
+                turn["marks"]["bot_started"] = now
+                if "user_stopped" in turn["marks"]:
+                    turn["latency"]["response"] = round((now - turn["marks"]["user_stopped"]) * 1000)
+        elif isinstance(frame, BotStoppedSpeakingFrame):
+            turn = self._current()
+            turn["bot_speaking"] = False
+            if turn["llm_done"] and turn["assistant"]:
+                self._finish()
+        elif isinstance(frame, MetricsFrame):
+            for item in frame.data:
+                kind = self._processors.get(item.processor)
+                if kind and isinstance(item, TTFBMetricsData) and item.value:
+                    self._current()["latency"].setdefault(f"{kind}_ttfb", round(item.value * 1000))
+
+    def _finish(self, interrupted: bool = False):
+        turn, self._turn = self._turn, None
+        if not turn or not (turn["user"] or turn["assistant"]):
+            return
+        self._turns += 1
+        self._archive.submit(
+            {
+                "ts": round(turn["ts"], 3),
+                "session_id": self._session_id(),
+                "agent_id": self._agent_id(),
+                "turn": self._turns,
+                "user": "".join(turn["user"]),
+                "assistant": "".join(turn["assistant"]),
+                "tools": turn["tools"],
+                "interrupted": interrupted,
+                "latency_ms": turn["latency"],
+            }
+        )
+
+    def end_session(self):
+        """客户端断开时调用（在会话 ID 更换之前）：归档最后一轮，轮次编号从头开始"""
+        if self._turn:
+            self._finish(interrupted=self._turn["bot_speaking"] or not self._turn["llm_done"])
+        self._turns = 0
+
+
+_ARCHIVE: ConversationArchive | None = None
+
+
+def get_archive() -> ConversationArchive | None:
+    """进程内唯一的归档写入端（ARCHIVE=1 时按环境变量创建，未安装 zstandard 时不启用）"""
+    global _ARCHIVE
+    if _ARCHIVE is None and os.getenv("ARCHIVE", "0") != "0":
+        try:
+            _ARCHIVE = ConversationArchive(
+                data_path("ARCHIVE_DIR", "archive"),
+                segment_mb=float(os.getenv("ARCHIVE_SEGMENT_MB", "64")),
+                flush_secs=float(os.getenv("ARCHIVE_FLUSH_SECS", "2")),
+            )
+        except ImportError:
+            logger.warning("⚠️ ARCHIVE=1 但未安装 zstandard（pip install zstandard），对话归档未启用")
+            return None
+        atexit.register(_ARCHIVE.close)
+        logger.info(f"✅ 对话归档: {_ARCHIVE.root}")
+    return _ARCHIVE
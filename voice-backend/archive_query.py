@@ -0,0 +1,94 @@
+#
+# DataAgent 语音服务 - 对话归档查询
+# 按会话、Agent 和时间从 archive.py 写入的归档里取出对话轮次
+#
+# 用法:
+#   python archive_query.py                                  # 最近的会话
+#   python archive_query.py --agent nora --since 24h         # 某个 Agent 最近一天的会话
+#   python archive_query.py --session 3f2a9c81d0e4           # 某个会话的全部轮次
+#   python archive_query.py --agent nora --since 7d --turns --json turns.jsonl
+#   python archive_query.py --reindex                        # 重建索引
+#
+
+import argparse
+import json
+import sys
+from datetime import datetime
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from archive import ArchiveReader
+from paths import data_path
+from usage_report import parse_since
+
+
+def _time(ts: float) -> str:
+    return datetime.fromtimestamp(ts).strftime("%m-%d %H:%M:%S")
+
+
+def print_sessions(sessions: list[dict]):
+    print(f"{'session':<14} {'agent':<12} {'first':<15} {'last':<15} {'turns':>5}")
+    for item in sessions:
+        print(
+            f"{item['session_id']:<14} {item['agent_id']:<12} {_time(item['first_ts']):<15} "
+            f"{_time(item['last_ts']):<15} {item['turns']:>5}"
+        )
+
+
+def print_turns(turns: list[dict]):
+    for turn in turns:
+        latency = " ".join(f"{key}={value}ms" for key, value in turn["latency_ms"].items())
+        flags = " [interrupted]" if turn["interrupted"] else ""
+        tools = f" tools={','.join(turn['tools'])}" if turn["tools"] else ""
+        print(f"\n[{_time(turn['ts'])}] {turn['session_id']} #{turn['turn']} {turn['agent_id']}{flags}{tools} {latency}")
+        print(f"  用户: {turn['user']}")
+        print(f"  助手: {turn['assistant']}")
+
+
+def main():
+    load_dotenv(override=True)
+    parser = argparse.ArgumentParser(description="对话归档查询：按会话、Agent、时间查看对话轮次")
+    parser.add_argument("--dir", default=data_path("ARCHIVE_DIR", "archive"), help="归档目录")
+    parser.add_argument("--session", help="会话 ID（与用量统计的会话 ID 一致）")
+    parser.add_argument("--agent", help="Agent ID")
+    parser.add_argument("--since", help="起始时间：30m / 24h / 7d 或 2026-10-01")
+    parser.add_argument("--until", help="结束时间，格式同 --since")
+    parser.add_argument("--turns", action="store_true", help="列出轮次（指定 --session 时默认列出）")
+    parser.add_argument("--limit", type=int, default=50, help="最多列出多少个会话")
+    parser.add_argument("--json", help="把轮次写入 JSON Lines 文件")
+    parser.add_argument("--reindex", action="store_true", help="扫描全部分段文件重建索引")
+    args = parser.parse_args()
+
+    if not (Path(args.dir) / "index.db").exists():
+        print(f"❌ 归档不存在: {args.dir}（ARCHIVE=1 时语音服务自动创建）")
+        return 1
+    reader = ArchiveReader(args.dir)
+    if args.reindex:
+        print(f"✅ 索引已重建：{reader.rebuild_index()} 个帧")
+        return 0
+
+    since, until = parse_since(args.since), parse_since(args.until)
+    if not (args.session or args.turns or args.json):
+        sessions = reader.sessions(agent_id=args.agent, since=since, until=until, limit=args.limit)
+        if not sessions:
+            print("📭 没有符合条件的会话")
+            return 0
+        print_sessions(sessions)
+        return 0
+
+    turns = reader.turns(session_id=args.session, agent_id=args.agent, since=since, until=until)
+    if not turns:
+        print("📭 没有符合条件的轮次")
+        return 0
+    print_turns(turns)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            for turn in turns:
+                f.write(json.dumps(turn, ensure_ascii=False) + "\n")
+        print(f"\n💾 {len(turns)} turns saved to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+#
+# DataAgent 语音服务 - STT 前的输入音频整形与静音抑制
+# 客户端每包大小不固定（浏览器 ScriptProcessor 一次 4096 采样），这里统一切成 20ms 帧，
+# 并借助传输层已有的 VAD 信号，在用户没说话时不再把静音发给 Deepgram
+#
+
+from collections import deque
+
+from loguru import logger
+
+from pipecat.frames.frames import (
+    CancelFrame,
+    EndFrame,
+    Frame,
+    InputAudioRawFrame,
+    VADUserStartedSpeakingFrame,
+    VADUserStoppedSpeakingFrame,
+)
+from pipecat.processors.frame_processor import FrameDirection, FrameProcessor
+
+
+class PCMRingBuffer:
+    """固定容量的 PCM 环形缓冲区，底层 bytearray 只分配一次并反复复用"""
+
+    def __init__(self, capacity: int):
+        self._buffer = bytearray(capacity)
+        self._view = memoryview(self._buffer)
+        self._capacity = capacity
+        self._start = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def free(self) -> int:
+        return self._capacity - self._size
+
+    def write(self, data) -> int:
+        """写入尽可能多的数据，返回实际写入的字节数"""
+        count = min(len(data), self.free)
+        if count == 0:
+            return 0
+        end = (self._start + self._size) % self._capacity
+        first = min(count, self._capacity - end)
+        self._view[end : end + first] = data[:first]
+        if count > first:
+            self._view[: count - first] = data[first:count]
+        self._size += count
+        return count
+
+    def read(self, count: int) -> bytes:
+        """读出 count 字节（调用方保证数据足够）"""
+        first = min(count, self._capacity - self._start)
+        if count > first:
+            # 跨越末尾时一次拼出，不产生中间字节串
+            data = b"".join((self._view[self._start :], self._view[: count - first]))
+        else:
+            data = bytes(self._view[self._start : self._start + first])
+        self._start = (self._start + count) % self._capacity
+        self._size -= count
+        return data
+
+    def clear(self):
+        self._start = 0
+        self._size = 0
+
+
+class SilenceGate(FrameProcessor):
+    """把输入音频切成固定 20ms 帧，并在静音期间拦截发往 STT 的音频
+
+    放在 STT 之前。VADUserStartedSpeakingFrame 到来时先补发最近 preroll_secs 的
+    预录音频（VAD 确认说话本身有延迟，避免吞掉字头），说话期间全部放行；
+    VADUserStoppedSpeakingFrame 之后再放行 hangover_secs，然后进入静音：
+    mode="gate" 完全不发，mode="thin" 每 thin_every 帧只发一帧，mode="off" 只做切帧。
+    Deepgram 在 UserStoppedSpeakingFrame 时会主动 finalize，并由 SDK 发送 KeepAlive，
+    所以拦截静音不影响出结果。
+
+    Args:
+        mode: gate / thin / off
+        frame_ms: 输出帧时长（毫秒）
+        preroll_secs: 说话开始前补发的音频时长
+        hangover_secs: 说话结束后继续放行的时长
+        thin_every: thin 模式下静音期间每多少帧发一帧
+        report_secs: 每累计收到多少秒音频打印一次统计
+    """
+
+    def __init__(
+        self,
+        mode: str = "gate",
+        frame_ms: int = 20,
+        preroll_secs: float = 0.5,
+        hangover_secs: float = 0.3,
+        thin_every: int = 50,
+        report_secs: float = 60.0,
+    ):
+        super().__init__()
+        self._mode = mode
+        self._frame_ms = frame_ms
+        self._preroll_frames = max(int(preroll_secs * 1000 / frame_ms), 1)
+        self._hangover_frames_total = int(hangover_secs * 1000 / frame_ms)
+        self._thin_every = max(thin_every, 1)
+        self._report_secs = report_secs
+        self._ring: PCMRingBuffer | None = None
+        self._frame_bytes = 0
+        self._sample_rate = 0
+        self._num_channels = 1
+        self._bytes_per_sec = 0
+        self._preroll: deque[bytes] = deque(maxlen=self._preroll_frames)
+        self._speaking = False
+        self._hangover = 0
+        self._silent_count = 0
+        self._received_bytes = 0
+        self._sent_bytes = 0
+        self._next_report = report_secs
+
+    async def process_frame(self, frame: Frame, direction: FrameDirection):
+        await super().process_frame(frame, direction)
+
+        if isinstance(frame, InputAudioRawFrame) and direction == FrameDirection.DOWNSTREAM:
+            await self._ingest(frame)
+            return
+
+        if isinstance(frame, VADUserStartedSpeakingFrame):
+            self._speaking = True
+            await self.push_frame(frame, direction)
+            # 补发预录音频，保证字头完整
+            while self._preroll:
+                await self._send(self._preroll.popleft())
+            return
+        elif isinstance(frame, VADUserStoppedSpeakingFrame):
+            self._speaking = False
+            self._hangover = self._hangover_frames_total
+        elif isinstance(frame, (EndFrame, CancelFrame)):
+            self._report()
+
+        await self.push_frame(frame, direction)
+
+    def _configure(self, frame: InputAudioRawFrame):
+        self._sample_rate = frame.sample_rate
+        self._num_channels = frame.num_channels
+        self._bytes_per_sec = frame.sample_rate * frame.num_channels * 2
+        self._frame_bytes = self._bytes_per_sec * self._frame_ms // 1000
+        # 容量留足一个浏览器大包（4096 采样）外加若干帧余量
+        self._ring = PCMRingBuffer(max(self._bytes_per_sec, 16 * self._frame_bytes))
+
+    async def _ingest(self, frame: InputAudioRawFrame):
+        if self._ring is None or frame.sample_rate != self._sample_rate:
+            self._configure(frame)
+        data = memoryview(frame.audio)
+        self._received_bytes += len(data)
+        while data:
+            written = self._ring.write(data)
+            data = data[written:]
+            while len(self._ring) >= self._frame_bytes:
+                await self._route(self._ring.read(self._frame_bytes))
+
+        if self._received_bytes / self._bytes_per_sec >= self._next_report:
+            self._report()
+            self._next_report += self._report_secs
+
+    async def _route(self, chunk: bytes):
+        if self._mode == "off" or self._speaking:
+            await self._send(chunk)
+        elif self._hangover > 0:
+            self._hangover -= 1
+            await self._send(chunk)
+        else:
+            self._preroll.append(chunk)
+            self._silent_count += 1
+            if self._mode == "thin" and self._silent_count % self._thin_every == 0:
+                await self._send(chunk)
+
+    async def _send(self, chunk: bytes):
+        self._sent_bytes += len(chunk)
+        await self.push_frame(
+            InputAudioRawFrame(audio=chunk, sample_rate=self._sample_rate, num_channels=self._num_channels)
+        )
+
+    def stats(self) -> dict:
+        """收到 / 发给 STT 的音频秒数"""
+        if not self._bytes_per_sec:
+            return {"received_secs": 0.0, "sent_secs": 0.0, "sent_ratio": 0.0}
+        received = self._received_bytes / self._bytes_per_sec
+        sent = self._sent_bytes / self._bytes_per_sec
+        return {
+            "received_secs": round(received, 2),
+            "sent_secs": round(sent, 2),
+            "sent_ratio": round(sent / received, 3) if received else 0.0,
+        }
+
+    def _report(self):
+        stats = self.stats()
+        if stats["received_secs"]:
+            logger.info(
+                f"🎙️ STT audio: received {stats['received_secs']}s, "
+                f"sent {stats['sent_secs']}s ({stats['sent_ratio']:.0%}, mode={self._mode})"
+            )
@@ -0,0 +1,120 @@
+#
+# DataAgent 语音服务 - 发给浏览器的音频帧和控制消息
+# Pipecat 的 WebSocket 输出传输层每发一帧音频都要新建两个 OutputAudioRawFrame、
+# 一个 BytesIO 和 wave 写入器，再拷贝出一份带 WAV 头的字节串。
+# 这里改为在序列化器复用的缓冲区里拼好 WAV 头和 PCM 直接发送；控制消息按 tick 合批发送
+#
+
+import asyncio
+
+from loguru import logger
+
+from pipecat.frames.frames import (
+    CancelFrame,
+    EndFrame,
+    Frame,
+    InterruptionFrame,
+    OutputAudioRawFrame,
+    OutputTransportMessageFrame,
+    OutputTransportMessageUrgentFrame,
+    StartFrame,
+)
+from pipecat.processors.frame_processor import FrameDirection
+from pipecat.transports.websocket.server import WebsocketServerOutputTransport, WebsocketServerParams
+
+from control_channel import ControlMessageBatcher
+from serializer import HybridAudioSerializer
+
+
+class PooledWebsocketOutputTransport(WebsocketServerOutputTransport):
+    """用 HybridAudioSerializer.serialize_pcm() 发送音频帧的 WebSocket 输出传输层
+
+    每帧只有一次 PCM 拷贝（进复用缓冲区），不再分配帧对象和中间字节串；
+    没有开启 add_wav_header 或使用其他序列化器时沿用默认实现。
+
+    control_tick_secs > 0 时控制消息（RTVI 事件、指标、转写等）经 ControlMessageBatcher
+    按 tick 合成一条发送，最终转写和打断信号立即发出。
+
+    Args:
+        transport: 所属传输层
+        params: WebSocket 服务器参数
+        control_tick_secs: 控制消息合批窗口，0 表示逐条发送
+    """
+
+    def __init__(self, transport, params: WebsocketServerParams, control_tick_secs: float = 0.0, **kwargs):
+        super().__init__(transport, params, **kwargs)
+        self._control: ControlMessageBatcher | None = None
+        self._control_task: asyncio.Task | None = None
+        if control_tick_secs > 0 and isinstance(params.serializer, HybridAudioSerializer):
+            self._control = ControlMessageBatcher(
+                self._send_control, tick_secs=control_tick_secs, buffered_bytes=self._buffered_bytes
+            )
+
+    @property
+    def control(self) -> ControlMessageBatcher | None:
+        return self._control
+
+    async def start(self, frame: StartFrame):
+        await super().start(frame)
+        if self._control and not self._control_task:
+            self._control_task = self.create_task(self._control.run())
+
+    async def stop(self, frame: EndFrame):
+        if self._control:
+            await self._control.flush()
+        await self._stop_control()
+        await super().stop(frame)
+
+    async def cancel(self, frame: CancelFrame):
+        await self._stop_control()
+        await super().cancel(frame)
+
+    async def _stop_control(self):
+        if self._control_task:
+            await self.cancel_task(self._control_task)
+            self._control_task = None
+
+    async def process_frame(self, frame: Frame, direction: FrameDirection):
+        await super().process_frame(frame, direction)
+        # 打断时把攒下的消息马上发出，前端尽快看到被打断这一轮的最后状态
+        if isinstance(frame, InterruptionFrame) and self._control:
+            await self._control.flush()
+
+    async def set_client_connection(self, websocket):
+        if self._control:
+            self._control.discard()
+        await super().set_client_connection(websocket)
+
+    async def send_message(self, frame: OutputTransportMessageFrame | OutputTransportMessageUrgentFrame):
+        if not self._control:
+            return await super().send_message(frame)
+        await self._control.submit(frame.message)
+
+    async def _send_control(self, batch: list[str]):
+        if not self._websocket:
+            return
+        try:
+            await self._websocket.send(self._params.serializer.serialize_messages(batch))
+        except Exception as e:
+            logger.error(f"{self} exception sending data: {e.__class__.__name__} ({e})")
+
+    def _buffered_bytes(self) -> int:
+        transport = getattr(self._websocket, "transport", None)
+        return transport.get_write_buffer_size() if transport else 0
+
+    async def write_audio_frame(self, frame: OutputAudioRawFrame) -> bool:
+        serializer = self._params.serializer
+        if not self._params.add_wav_header or not isinstance(serializer, HybridAudioSerializer):
+            return await super().write_audio_frame(frame)
+        if not self._websocket:
+            return False
+
+        try:
+            payload = serializer.serialize_pcm(frame.audio, self.sample_rate, self._params.audio_out_channels)
+            await self._websocket.send(payload)
+        except Exception as e:
+            logger.error(f"{self} exception sending data: {e.__class__.__name__} ({e})")
+
+        # 按播放速度限速（与默认实现一致）
+        await self._write_audio_sleep()
+        return True
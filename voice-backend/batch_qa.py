@@ -0,0 +1,468 @@
+#
+# DataAgent 语音服务 - 批量离线问答评测
+# 把一批录好的问题（WAV）逐个当作一次通话，通过和线上完全相同的管线（run_voice_bot）跑一遍，
+# 记录转写、回答文本、回答音频和各阶段耗时；多个文件并发执行，中断后可以接着跑
+#
+# 用法:
+#   python batch_qa.py questions/ --out results.jsonl
+#   python batch_qa.py questions/ --out results.jsonl --agent alisa,nora --concurrency 8
+#   python batch_qa.py questions/ --out results.jsonl --providers local --speed 4 --parquet results.parquet
+#
+# questions/ 下的每个 .wav 是一个问题（可以有子目录），同名 .txt 为参考文本（可选）：
+# 结果里记为 reference，--providers local 时作为替身 STT 的转写结果。
+# --providers local 使用 standins.py 中的本地替身（不联网、不计费），用于 CI 和回归冒烟。
+#
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+import wave
+from dataclasses import dataclass
+from pathlib import Path
+
+from loguru import logger
+
+from pipecat.frames.frames import (
+    BotStartedSpeakingFrame,
+    BotStoppedSpeakingFrame,
+    CancelFrame,
+    EndFrame,
+    EndTaskFrame,
+    InputAudioRawFrame,
+    LLMFullResponseEndFrame,
+    LLMFullResponseStartFrame,
+    LLMTextFrame,
+    MetricsFrame,
+    OutputAudioRawFrame,
+    OutputTransportMessageFrame,
+    OutputTransportMessageUrgentFrame,
+    StartFrame,
+    TranscriptionFrame,
+    TTSAudioRawFrame,
+    UserStartedSpeakingFrame,
+    UserStoppedSpeakingFrame,
+    VADUserStoppedSpeakingFrame,
+)
+from pipecat.metrics.metrics import TTFBMetricsData
+from pipecat.observers.base_observer import BaseObserver, FramePushed
+from pipecat.processors.frame_processor import FrameDirection
+from pipecat.runner.types import RunnerArguments
+from pipecat.transports.base_input import BaseInputTransport
+from pipecat.transports.base_output import BaseOutputTransport
+from pipecat.transports.base_transport import BaseTransport, TransportParams
+
+from eval_endpointing import SAMPLE_RATE, load_pcm
+from standins import EchoLLMService, ScriptedSTTService, ToneTTSService
+from voice_bot import VoiceServices, create_turn_analyzers, create_voice_services, run_voice_bot
+from voice_logging import setup_logging
+
+FRAME_SECS = 0.02
+
+
+class FileInputTransport(BaseInputTransport):
+    """把一段 PCM 按 20ms 帧（可加速）推给管线，放完后继续送静音，直到这一问答完成
+
+    done() 返回 True 或超过 timeout_secs 后触发 on_client_disconnected，
+    再向上游推送 EndTaskFrame 结束管线。
+    """
+
+    def __init__(self, transport: "FileTransport", params: TransportParams, pcm: bytes, **kwargs):
+        super().__init__(params, **kwargs)
+        self._transport = transport
+        self._pcm = pcm
+        self._feed_task: asyncio.Task | None = None
+
+    async def start(self, frame: StartFrame):
+        await super().start(frame)
+        await self.set_transport_ready(frame)
+        self._feed_task = self.create_task(self._feed())
+
+    async def stop(self, frame: EndFrame):
+        await super().stop(frame)
+        await self._cancel_feed()
+
+    async def cancel(self, frame: CancelFrame):
+        await super().cancel(frame)
+        await self._cancel_feed()
+
+    async def _cancel_feed(self):
+        if self._feed_task:
+            await self.cancel_task(self._feed_task)
+            self._feed_task = None
+
+    async def _feed(self):
+        transport = self._transport
+        await transport._call_event_handler("on_client_connected", None)
+        frame_bytes = int(SAMPLE_RATE * FRAME_SECS) * 2
+        silence = bytes(frame_bytes)
+        interval = FRAME_SECS / transport.speed
+        started = time.monotonic()
+        index = 0
+        while True:
+            offset = index * frame_bytes
+            if offset < len(self._pcm):
+                chunk = self._pcm[offset : offset + frame_bytes].ljust(frame_bytes, b"\0")
+            else:
+                transport.fed = True
+                if transport.done() or time.monotonic() - started > transport.timeout_secs:
+                    break
+                chunk = silence
+            await self.push_audio_frame(InputAudioRawFrame(audio=chunk, sample_rate=SAMPLE_RATE, num_channels=1))
+            index += 1
+            await asyncio.sleep(max(started + index * interval - time.monotonic(), 0))
+        await transport._call_event_handler("on_client_disconnected", None)
+        await self.push_frame(EndTaskFrame(), FrameDirection.UPSTREAM)
+
+
+class CaptureOutputTransport(BaseOutputTransport):
+    """收集机器人的输出音频和发给客户端的消息（不按播放速度限速）"""
+
+    def __init__(self, params: TransportParams, **kwargs):
+        super().__init__(params, **kwargs)
+        self.audio = bytearray()
+        self.messages: list = []
+
+    async def start(self, frame: StartFrame):
+        await super().start(frame)
+        await self.set_transport_ready(frame)
+
+    async def write_audio_frame(self, frame: OutputAudioRawFrame) -> bool:
+        self.audio.extend(frame.audio)
+        return True
+
+    async def send_message(self, frame: OutputTransportMessageFrame | OutputTransportMessageUrgentFrame):
+        self.messages.append(frame.message)
+
+
+class FileTransport(BaseTransport):
+    """一个音频文件对应一次「通话」的传输层
+
+    Args:
+        pcm: 16kHz 单声道 16-bit PCM
+        params: 传输参数（VAD / Smart Turn）
+        done: 返回这一问答是否已完成的函数
+        speed: 播放倍速
+        timeout_secs: 音频放完后最多再等多久
+    """
+
+    def __init__(self, pcm: bytes, params: TransportParams, done, speed: float = 1.0, timeout_secs: float = 30.0):
+        super().__init__()
+        self.done = done
+        self.speed = speed
+        self.timeout_secs = timeout_secs
+        self.fed = False
+        self._input = FileInputTransport(self, params, pcm)
+        self._output = CaptureOutputTransport(params)
+        self._register_event_handler("on_client_connected")
+        self._register_event_handler("on_client_disconnected")
+
+    def input(self) -> FileInputTransport:
+        return self._input
+
+    def output(self) -> CaptureOutputTransport:
+        return self._output
+
+
+_TRACKED_FRAMES = (
+    VADUserStoppedSpeakingFrame,
+    UserStartedSpeakingFrame,
+    UserStoppedSpeakingFrame,
+    TranscriptionFrame,
+    LLMFullResponseStartFrame,
+    LLMFullResponseEndFrame,
+    LLMTextFrame,
+    TTSAudioRawFrame,
+    BotStartedSpeakingFrame,
+    BotStoppedSpeakingFrame,
+    MetricsFrame,
+)
+
+
+@dataclass
+class _Turn:
+    speech_end: float | None = None
+    transcript: str = ""
+    answer: str = ""
+    transcribed: float | None = None
+    llm_ttfb: float | None = None
+    first_token: float | None = None
+    first_tts_audio: float | None = None
+    bot_started: float | None = None
+
+    def latency_ms(self) -> dict:
+        def since(start, end):
+            return max(round((end - start) * 1000), 0) if start is not None and end is not None else None
+
+        return {
+            "stt_ms": since(self.speech_end, self.transcribed),
+            "llm_ttfb_ms": round(self.llm_ttfb * 1000) if self.llm_ttfb is not None else None,
+            "tts_ttfb_ms": since(self.first_token, self.first_tts_audio),
+            "e2e_ms": since(self.speech_end, self.bot_started),
+        }
+
+
+class TurnRecorder(BaseObserver):
+    """观察管线里的帧，按轮记录转写、回答和各阶段时间点
+
+    - stt_ms：用户停止说话（VAD）到最终转写
+    - llm_ttfb_ms：LLM 首 token 延迟（服务上报的 TTFB）
+    - tts_ttfb_ms：LLM 首 token 到第一段合成音频
+    - e2e_ms：用户停止说话到机器人开始出声（包括应答语）
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.turns: list[_Turn] = []
+        self._open: _Turn | None = None  # 用户正在说的这一轮
+        self._seen: set[int] = set()
+        self._vad_stopped: float | None = None
+        self._user_speaking = False
+        self._llm_running = False
+        self._bot_speaking = False
+        self._last_activity = time.monotonic()
+
+    def idle_secs(self) -> float:
+        if self._user_speaking or self._llm_running or self._bot_speaking:
+            return 0.0
+        return time.monotonic() - self._last_activity
+
+    async def on_push_frame(self, data: FramePushed):
+        frame = data.frame
+        # 同一帧经过每个处理器都会触发一次，只处理第一次；
+        # 说话状态帧会向上下游各广播一份，只看下行的
+        if data.direction != FrameDirection.DOWNSTREAM:
+            return
+        if not isinstance(frame, _TRACKED_FRAMES) or frame.id in self._seen:
+            return
+        self._seen.add(frame.id)
+        now = time.monotonic()
+        turn = self.turns[-1] if self.turns else None
+
+        if isinstance(frame, VADUserStoppedSpeakingFrame):
+            self._vad_stopped = now
+        elif isinstance(frame, UserStartedSpeakingFrame):
+            self._user_speaking = True
+            self._open = self._open or _Turn()
+        elif isinstance(frame, UserStoppedSpeakingFrame):
+            self._user_speaking = False
+            turn, self._open = self._open or _Turn(), None
+            turn.speech_end = self._vad_stopped or now
+            self.turns.append(turn)
+        elif isinstance(frame, TranscriptionFrame):
+            # 流式 STT 的最终结果可能早于 Smart Turn 判定本轮结束，记在正在说的这一轮上
+            target = self._open or turn
+            if target is None:
+                target = self._open = _Turn()
+            target.transcript += frame.text
+            target.transcribed = now
+        elif isinstance(frame, LLMFullResponseStartFrame):
+            self._llm_running = True
+        elif isinstance(frame, LLMFullResponseEndFrame):
+            self._llm_running = False
+        elif isinstance(frame, LLMTextFrame) and turn:
+            turn.answer += frame.text
+            turn.first_token = turn.first_token or now
+        elif isinstance(frame, TTSAudioRawFrame) and turn and turn.first_token:
+            turn.first_tts_audio = turn.first_tts_audio or now
+        elif isinstance(frame, BotStartedSpeakingFrame):
+            self._bot_speaking = True
+            if turn:
+                turn.bot_started = turn.bot_started or now
+        elif isinstance(frame, BotStoppedSpeakingFrame):
+            self._bot_speaking = False
+        elif isinstance(frame, MetricsFrame) and turn:
+            for metrics in frame.data:
+                if isinstance(metrics, TTFBMetricsData) and "LLM" in metrics.processor and metrics.value:
+                    turn.llm_ttfb = turn.llm_ttfb or metrics.value
+        self._last_activity = now
+
+
+def local_services(reference: str | list[str] | None) -> VoiceServices:
+    """本地替身：参考文本作为转写（多轮时按顺序），固定模板回答，正弦音合成"""
+    transcripts = [reference] if isinstance(reference, str) else reference
+    return VoiceServices(
+        stt=ScriptedSTTService(transcripts),
+        llm=EchoLLMService(),
+        tts=ToneTTSService(),
+        tts_name="local",
+        ack_tts_factory=lambda session, rate, voice=None: ToneTTSService(),
+        llm_provider="local-llm",
+        stt_provider="local-stt",
+    )
+
+
+def find_questions(root: Path) -> list[Path]:
+    return sorted(root.rglob("*.wav")) if root.is_dir() else [root]
+
+
+def load_done(path: Path, retry_failed: bool) -> set[tuple[str, str]]:
+    """已有结果里完成的 (文件, Agent)，用于断点续跑"""
+    done = set()
+    if not path.exists():
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # 中断时写了一半的行
+            if not retry_failed or record.get("status") in ("ok", "no_speech"):
+                done.add((record["file"], record["agent_id"]))
+    return done
+
+
+def write_wav(path: Path, audio: bytes, sample_rate: int):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with wave.open(str(path), "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(audio)
+
+
+async def run_question(path: Path, root: Path, agent_id: str, args) -> dict:
+    name = str(path.relative_to(root)) if root.is_dir() else path.name
+    reference_path = path.with_suffix(".txt")
+    reference = reference_path.read_text(encoding="utf-8").strip() if reference_path.exists() else None
+    record = {"file": name, "agent_id": agent_id, "reference": reference, "providers": args.providers}
+    started = time.monotonic()
+    try:
+        pcm = load_pcm(path)
+        vad_analyzer, turn_analyzer = create_turn_analyzers()
+        params = TransportParams(
+            audio_in_enabled=True,
+            audio_out_enabled=True,
+            vad_analyzer=vad_analyzer,
+            turn_analyzer=turn_analyzer if args.smart_turn else None,
+            audio_out_end_silence_secs=0,
+        )
+        recorder = TurnRecorder()
+
+        def done() -> bool:
+            return recorder.idle_secs() >= args.settle_secs
+
+        transport = FileTransport(pcm, params, done, speed=args.speed, timeout_secs=args.turn_timeout)
+        services = local_services(reference) if args.providers == "local" else create_voice_services()
+        runner_args = RunnerArguments()
+        runner_args.handle_sigint = False
+        audio_secs = len(pcm) / 2 / SAMPLE_RATE
+        await asyncio.wait_for(
+            run_voice_bot(transport, runner_args, agent_id, services=services, observers=[recorder]),
+            timeout=audio_secs / args.speed + args.turn_timeout + 30,
+        )
+    except asyncio.TimeoutError:
+        record.update(status="timeout", error="pipeline did not finish")
+        return record
+    except Exception as e:
+        logger.bind(exc=e).error(f"❌ {name} [{agent_id}] failed: {e!r}")
+        record.update(status="error", error=repr(e))
+        return record
+
+    output = transport.output()
+    turns = recorder.turns
+    first = turns[0].latency_ms() if turns else {}
+    record.update(
+        status="ok" if turns else "no_speech",
+        transcript="".join(t.transcript for t in turns),
+        answer="".join(t.answer for t in turns),
+        turns=[{"transcript": t.transcript, "answer": t.answer, **t.latency_ms()} for t in turns],
+        **{key: first.get(key) for key in ("stt_ms", "llm_ttfb_ms", "tts_ttfb_ms", "e2e_ms")},
+        question_secs=round(audio_secs, 2),
+        answer_secs=round(len(output.audio) / 2 / output.sample_rate, 2) if output.sample_rate else 0.0,
+        wall_secs=round(time.monotonic() - started, 2),
+    )
+    if args.audio_dir and output.audio:
+        audio_path = Path(args.audio_dir) / agent_id / Path(name).with_suffix(".wav")
+        write_wav(audio_path, bytes(output.audio), output.sample_rate)
+        record["audio"] = str(audio_path)
+    return record
+
+
+async def run_batch(args) -> int:
+    root = Path(args.questions)
+    out = Path(args.out)
+    agents = [agent.strip() for agent in args.agent.split(",") if agent.strip()]
+    done = load_done(out, args.retry_failed)
+    jobs = [(path, agent) for path in find_questions(root) for agent in agents]
+    name = (lambda p: str(p.relative_to(root))) if root.is_dir() else (lambda p: p.name)
+    pending = [(path, agent) for path, agent in jobs if (name(path), agent) not in done]
+    print(f"📂 {len(jobs)} jobs, {len(jobs) - len(pending)} already done")
+    if args.limit:
+        pending = pending[: args.limit]
+
+    queue: asyncio.Queue = asyncio.Queue()
+    for job in pending:
+        queue.put_nowait(job)
+    counts: dict[str, int] = {}
+    out.parent.mkdir(parents=True, exist_ok=True)
+
+    with open(out, "a", encoding="utf-8") as f:
+
+        async def worker():
+            while not queue.empty():
+                path, agent_id = queue.get_nowait()
+                record = await run_question(path, root, agent_id, args)
+                # 每条结果立即落盘，中断后从这里继续
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+                counts[record["status"]] = counts.get(record["status"], 0) + 1
+                finished = sum(counts.values())
+                print(
+                    f"[{finished}/{len(pending)}] {record['status']:<9} {record['file']} [{agent_id}] "
+                    f"e2e={record.get('e2e_ms')}ms {record.get('answer', '')[:40]}"
+                )
+
+        await asyncio.gather(*(worker() for _ in range(max(args.concurrency, 1))))
+
+    print(f"\n✅ Done: {counts}")
+    if args.parquet:
+        write_parquet(out, Path(args.parquet))
+    return 0 if not counts.get("error") else 1
+
+
+def write_parquet(jsonl: Path, path: Path):
+    """把 JSONL 结果转成 Parquet（同一文件 + Agent 只保留最后一条）"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        print("⚠️ 未安装 pyarrow（pip install pyarrow），跳过 Parquet 输出")
+        return
+    records: dict[tuple[str, str], dict] = {}
+    with open(jsonl, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            records[(record["file"], record["agent_id"])] = record
+    pq.write_table(pa.Table.from_pylist(list(records.values())), path)
+    print(f"💾 Parquet saved to {path} ({len(records)} rows)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量离线问答评测：录音 → STT → LLM → TTS")
+    parser.add_argument("questions", help="问题录音目录（或单个 WAV）")
+    parser.add_argument("--out", default="batch_results.jsonl", help="结果文件（JSONL，追加写入，可断点续跑）")
+    parser.add_argument("--agent", default="alisa", help="Agent ID，逗号分隔时每个问题对每个 Agent 各跑一次")
+    parser.add_argument("--concurrency", type=int, default=4, help="同时进行的问答数")
+    parser.add_argument("--providers", choices=["real", "local"], default="real", help="real=按 .env 配置，local=本地替身")
+    parser.add_argument("--speed", type=float, default=1.0, help="录音播放倍速（真实 STT 需要 1.0，延迟数据也只在 1.0 下有意义）")
+    parser.add_argument("--settle-secs", type=float, default=2.0, help="机器人说完后再静默多久算本题结束")
+    parser.add_argument("--turn-timeout", type=float, default=30.0, help="录音放完后最多等待多久（秒）")
+    parser.add_argument("--no-smart-turn", dest="smart_turn", action="store_false", help="只用 VAD 断句")
+    parser.add_argument("--audio-dir", default="batch_audio", help="回答音频保存目录，留空则不保存")
+    parser.add_argument("--parquet", help="同时输出 Parquet 文件（需要 pyarrow）")
+    parser.add_argument("--retry-failed", action="store_true", help="重跑之前失败或超时的问题")
+    parser.add_argument("--limit", type=int, default=0, help="最多跑多少个（调试用）")
+    parser.add_argument("--log-level", default="WARNING", help="日志级别")
+    args = parser.parse_args()
+
+    setup_logging(level=args.log_level.upper())
+    return asyncio.run(run_batch(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+#
+# DataAgent 语音服务 - 音频帧路径分配基准测试
+# 用 tracemalloc 测量每帧音频在序列化路径上的内存分配：
+#   出方向：Pipecat 默认 WebSocket 输出（每帧新建帧对象 + wave 写 WAV 头）对比复用缓冲区
+#   入方向：每个 PCM 包都先尝试 Protobuf / UTF-8 解码的旧逻辑对比快速判断
+#
+# 用法:
+#   python bench_audio_frames.py
+#   python bench_audio_frames.py --frames 5000 --out-ms 20
+#   python bench_audio_frames.py --max-retained 1 --max-peak 1024   # 超出上限时以非零状态退出（可放进 CI）
+#
+# peak B/frame 为处理一帧期间的瞬时分配峰值，retained B/frame 为跑完后平均每帧留下的内存（应为 0）；
+# baseline 是调用一个空协程本身的开销，低于或接近它即为没有额外分配。
+# 任一路径的 retained 超过 --max-retained，或复用缓冲区 / 快速判断路径的 peak 超过 --max-peak 时检查失败
+#
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+
+from pipecat.frames.frames import InputAudioRawFrame, OutputAudioRawFrame
+from pipecat.serializers.protobuf import ProtobufFrameSerializer
+from pipecat.transports.websocket.server import WebsocketServerOutputTransport, WebsocketServerParams
+
+from audio_output import PooledWebsocketOutputTransport
+from serializer import HybridAudioSerializer
+
+OUT_SAMPLE_RATE = 24000
+IN_SAMPLE_RATE = 16000
+# 优化后的路径：peak 不应随负载大小增长
+CHECKED_PEAK_PATHS = ("out: pooled buffer", "in: fast path")
+
+
+class NullWebsocket:
+    """只统计字节数的 WebSocket 替身（websockets 在 send() 里同步拷贝负载，这里不保留引用）"""
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send(self, payload):
+        self.sent += len(payload)
+
+
+async def _no_sleep():
+    pass
+
+
+def output_transport(cls, serializer: HybridAudioSerializer):
+    params = WebsocketServerParams(audio_out_enabled=True, add_wav_header=True, serializer=serializer)
+    transport = cls(None, params)
+    transport._sample_rate = OUT_SAMPLE_RATE
+    transport._websocket = NullWebsocket()
+    transport._write_audio_sleep = _no_sleep
+    return transport
+
+
+async def legacy_deserialize(protobuf: ProtobufFrameSerializer, data: bytes):
+    """改动前的入方向逻辑：每个包先试 Protobuf，再整体试 UTF-8 解码"""
+    try:
+        frame = await protobuf.deserialize(data)
+        if frame:
+            return frame
+    except Exception:
+        pass
+    try:
+        text = data.decode("utf-8")
+        if text.strip().startswith("{"):
+            return None
+    except Exception:
+        pass
+    return InputAudioRawFrame(audio=data, num_channels=1, sample_rate=IN_SAMPLE_RATE)
+
+
+async def measure(name: str, step, frames: int) -> dict:
+    for _ in range(min(frames, 200)):  # 预热：缓冲区、缓存、惰性导入
+        await step()
+    tracemalloc.start()
+    start_current, _ = tracemalloc.get_traced_memory()
+    peaks = 0
+    started = time.perf_counter()
+    for _ in range(frames):
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        await step()
+        _, peak = tracemalloc.get_traced_memory()
+        peaks += peak - before
+    elapsed = time.perf_counter() - started
+    end_current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # tracemalloc 开启时的耗时偏高，另测一遍纯耗时
+    started = time.perf_counter()
+    for _ in range(frames):
+        await step()
+    plain = time.perf_counter() - started
+    return {
+        "path": name,
+        "peak_bytes_per_frame": round(peaks / frames),
+        "retained_bytes_per_frame": round(max(end_current - start_current, 0) / frames, 2),
+        "us_per_frame": round(plain / frames * 1e6, 2),
+        "traced_us_per_frame": round(elapsed / frames * 1e6, 2),
+    }
+
+
+async def main(args):
+    out_pcm = os.urandom(OUT_SAMPLE_RATE * 2 * args.out_ms // 1000)
+    in_pcm = os.urandom(args.in_bytes)
+    results = [await measure("baseline: await no-op", _no_sleep, args.frames)]
+
+    stock = output_transport(WebsocketServerOutputTransport, HybridAudioSerializer())
+    frame = OutputAudioRawFrame(audio=out_pcm, sample_rate=OUT_SAMPLE_RATE, num_channels=1)
+    results.append(await measure("out: pipecat default", lambda: stock.write_audio_frame(frame), args.frames))
+    pooled = output_transport(PooledWebsocketOutputTransport, HybridAudioSerializer())
+    results.append(await measure("out: pooled buffer", lambda: pooled.write_audio_frame(frame), args.frames))
+    assert stock._websocket.sent == pooled._websocket.sent
+
+    protobuf = ProtobufFrameSerializer()
+    results.append(await measure("in: legacy probe", lambda: legacy_deserialize(protobuf, in_pcm), args.frames))
+    serializer = HybridAudioSerializer()
+    results.append(await measure("in: fast path", lambda: serializer.deserialize(in_pcm), args.frames))
+
+    print(f"\n{args.frames} frames · out {args.out_ms}ms @ {OUT_SAMPLE_RATE}Hz · in {args.in_bytes} bytes\n")
+    print(f"{'path':<22} {'peak B/frame':>13} {'retained B/frame':>17} {'µs/frame':>9}")
+    for r in results:
+        print(
+            f"{r['path']:<22} {r['peak_bytes_per_frame']:>13} {r['retained_bytes_per_frame']:>17} "
+            f"{r['us_per_frame']:>9}"
+        )
+    print("\n出方向复用缓冲区后只剩协程对象本身的分配（与负载大小无关）；")
+    print("入方向的剩余分配是 InputAudioRawFrame 本身：帧要跨队列传给下游处理器，不能复用")
+
+    failures = [
+        f"{r['path']}: retained {r['retained_bytes_per_frame']} B/frame > {args.max_retained}"
+        for r in results
+        if r["retained_bytes_per_frame"] > args.max_retained
+    ]
+    failures += [
+        f"{r['path']}: peak {r['peak_bytes_per_frame']} B/frame > {args.max_peak}"
+        for r in results
+        if r["path"] in CHECKED_PEAK_PATHS and r["peak_bytes_per_frame"] > args.max_peak
+    ]
+    if failures:
+        print("\n❌ 超出分配上限：")
+        for failure in failures:
+            print(f"  {failure}")
+        return 1
+    print(f"\n✅ retained ≤ {args.max_retained} B/frame，复用路径 peak ≤ {args.max_peak} B/frame")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="音频帧路径分配基准测试")
+    parser.add_argument("--frames", type=int, default=2000)
+    parser.add_argument("--out-ms", type=int, default=20, help="出方向每帧时长（毫秒）")
+    parser.add_argument("--in-bytes", type=int, default=8192, help="入方向每包字节数（浏览器 4096 采样）")
+    parser.add_argument("--max-retained", type=float, default=1.0, help="任一路径平均每帧留下的内存上限（字节）")
+    parser.add_argument("--max-peak", type=int, default=1024, help="复用缓冲区 / 快速判断路径每帧分配峰值上限（字节）")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,105 @@
+#
+# DataAgent 语音服务 - 日志开销基准测试
+# 模拟多个会话在事件循环里按 50 帧/秒产生转录日志（含少量异常），
+# 对比同步 loguru、后台线程 sink、后台 sink + 采样三种方式在事件循环上花费的时间
+#
+# 用法:
+#   python bench_logging.py
+#   python bench_logging.py --sessions 40 --seconds 10
+#
+
+import argparse
+import asyncio
+import tempfile
+import time
+import traceback
+
+from loguru import logger
+
+from voice_logging import HotPathLog, setup_logging
+
+TEXT = "华东区上周销售额多少，环比变化是多少"
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+async def session(mode: str, rate: int, seconds: float, spent: list[float], index: int):
+    interim_log = HotPathLog("transcript.interim", sample_every=10, max_per_sec=2.0)
+    error_log = HotPathLog("transport.error", level="ERROR", max_per_sec=1.0)
+    interval = 1 / rate
+    deadline = time.monotonic() + seconds
+    frame = 0
+    while time.monotonic() < deadline:
+        frame += 1
+        text = f"{TEXT}（{index}-{frame}）"
+        started = time.perf_counter()
+        if mode == "async+sampled":
+            interim_log("✅ Sent interim transcript", chars=len(text))
+        else:
+            logger.info(f"✅ Sent transcript to client: {text}")
+        if frame % 200 == 0:
+            try:
+                raise ConnectionError("socket closed")
+            except Exception as e:
+                if mode == "async+sampled":
+                    error_log.error("❌ Failed to send transcript", error=repr(e), exc=e)
+                else:
+                    logger.error(f"❌ Failed to send transcript: {e}")
+                    logger.error(traceback.format_exc())
+        spent.append(time.perf_counter() - started)
+        await asyncio.sleep(interval)
+
+
+async def lag_probe(seconds: float, lags: list[float], tick: float = 0.01):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        started = time.monotonic()
+        await asyncio.sleep(tick)
+        lags.append(time.monotonic() - started - tick)
+
+
+async def run(mode: str, sessions: int, rate: int, seconds: float) -> dict:
+    spent: list[float] = []
+    lags: list[float] = []
+    with tempfile.TemporaryFile("w+", encoding="utf-8") as stream:
+        sink = setup_logging("sync" if mode == "sync" else "async", level="DEBUG", stream=stream)
+        started = time.monotonic()
+        await asyncio.gather(
+            lag_probe(seconds, lags),
+            *(session(mode, rate, seconds, spent, i) for i in range(sessions)),
+        )
+        elapsed = time.monotonic() - started
+        if sink:
+            sink.stop()
+    return {
+        "mode": mode,
+        "events": len(spent),
+        "log_ms_per_sec": round(sum(spent) * 1000 / elapsed, 1),
+        "us_per_event": round(sum(spent) / len(spent) * 1e6, 1),
+        "lag_p50_ms": round(percentile(lags, 0.5) * 1000, 2),
+        "lag_p99_ms": round(percentile(lags, 0.99) * 1000, 2),
+        "lag_max_ms": round(max(lags) * 1000, 2),
+    }
+
+
+async def main(args):
+    results = [await run(mode, args.sessions, args.rate, args.seconds) for mode in ("sync", "async", "async+sampled")]
+    setup_logging("sync")
+    print(f"\n{args.sessions} sessions × {args.rate} events/s × {args.seconds}s\n")
+    print(f"{'mode':<16} {'events':>8} {'log ms/s':>9} {'µs/event':>9} {'lag p50':>8} {'lag p99':>8} {'lag max':>8}")
+    for r in results:
+        print(
+            f"{r['mode']:<16} {r['events']:>8} {r['log_ms_per_sec']:>9} {r['us_per_event']:>9} "
+            f"{r['lag_p50_ms']:>7}ms {r['lag_p99_ms']:>7}ms {r['lag_max_ms']:>7}ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="日志开销基准测试")
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--rate", type=int, default=50, help="每个会话每秒的日志事件数")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,62 @@
+#
+# DataAgent 语音服务 - 用户长期记忆检索基准测试
+# 生成一个用户的合成记忆（不同条数），测量每轮检索的单次耗时和加入一条记忆的耗时
+#
+# 用法:
+#   python bench_memory.py
+#   python bench_memory.py --facts 50,200,500 --repeat 5000
+#
+
+import argparse
+import random
+import time
+
+import numpy as np
+
+from memory import MemoryIndex
+
+SUBJECTS = ["销售额", "GMV", "转化率", "客单价", "复购率", "订单量", "访客数", "退货率", "毛利"]
+SCOPES = ["华东", "华南", "华北", "西南", "线上", "门店", "直播", "手机品类", "家电品类", "新客", "会员"]
+HABITS = ["我负责{}的{}", "我每周一看{}的{}", "我更关注{}的{}环比", "以后{}的{}按周拆开看", "我习惯先看{}的{}结论"]
+QUERIES = [
+    "上周华东的销售额怎么样",
+    "直播渠道的转化率最近有没有下降",
+    "会员的复购率和上个月比呢",
+    "帮我看一下门店的客单价",
+    "手机品类的毛利是多少",
+]
+
+
+def synthetic(facts: int, seed: int = 7) -> MemoryIndex:
+    rng = random.Random(seed)
+    index = MemoryIndex("bench", max_facts=facts)
+    while len(index) < facts:
+        index.add(rng.choice(HABITS).format(rng.choice(SCOPES), rng.choice(SUBJECTS)) + f"（{len(index)}）")
+    return index
+
+
+def main(args):
+    print(f"\n{'facts':>6} {'search p50':>11} {'search p99':>11} {'add':>9}")
+    for facts in (int(n) for n in args.facts.split(",")):
+        index = synthetic(facts)
+        samples = []
+        for i in range(args.repeat):
+            started = time.perf_counter()
+            index.search(QUERIES[i % len(QUERIES)], args.top_k)
+            samples.append(time.perf_counter() - started)
+        samples = np.array(samples) * 1e6
+        started = time.perf_counter()
+        for i in range(50):
+            index.add(f"我关注第{i}个新指标的变化")
+        add_us = (time.perf_counter() - started) / 50 * 1e6
+        print(
+            f"{facts:>6} {np.percentile(samples, 50):>9.0f}µs {np.percentile(samples, 99):>9.0f}µs {add_us:>7.0f}µs"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="用户长期记忆检索基准测试")
+    parser.add_argument("--facts", default="50,200,500", help="每个用户的记忆条数，逗号分隔")
+    parser.add_argument("--top-k", type=int, default=4, help="每次检索取几条")
+    parser.add_argument("--repeat", type=int, default=2000, help="每种条数检索多少次")
+    main(parser.parse_args())
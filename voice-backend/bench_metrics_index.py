@@ -0,0 +1,78 @@
+#
+# DataAgent 语音服务 - 指标索引查询基准测试
+# 生成一张合成明细表（周期 × 地区 × 渠道 × 品类），测量加载预聚合耗时和三种工具查询的单次耗时
+#
+# 用法:
+#   python bench_metrics_index.py
+#   python bench_metrics_index.py --periods 104 --repeat 20000
+#   python bench_metrics_index.py --file metrics.csv      # 测量真实数据文件
+#
+
+import argparse
+import itertools
+import time
+
+import numpy as np
+
+from metrics_tools import MetricsIndex, MetricsTools
+
+REGIONS = ["华东", "华南", "华北", "华中", "西南", "东北", "西北"]
+CHANNELS = ["线上", "门店", "分销", "直播"]
+
+
+def synthetic(periods: int, categories: int, seed: int = 7) -> MetricsIndex:
+    rng = np.random.default_rng(seed)
+    labels = [f"2025-W{w:02d}" if w <= 52 else f"2026-W{w - 52:02d}" for w in range(1, periods + 1)]
+    keys = list(itertools.product(labels, REGIONS, CHANNELS, [f"品类{i:02d}" for i in range(categories)]))
+    rows = len(keys)
+    columns = {
+        "period": [k[0] for k in keys],
+        "地区": [k[1] for k in keys],
+        "渠道": [k[2] for k in keys],
+        "品类": [k[3] for k in keys],
+        "销售额": rng.gamma(2.0, 5000.0, rows).round().tolist(),
+        "订单量": rng.poisson(40, rows).tolist(),
+        "访客数": rng.poisson(900, rows).tolist(),
+    }
+    return MetricsIndex(columns, source="synthetic")
+
+
+def timed(fn, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+def main(args):
+    started = time.perf_counter()
+    index = MetricsIndex.load(args.file) if args.file else synthetic(args.periods, args.categories)
+    load_ms = (time.perf_counter() - started) * 1000
+    metric = index.metrics[0]
+    dimension = index.dimensions[0]
+    member = index.members[dimension][0]
+    print(
+        f"\n{index.rows} rows · {len(index.metrics)} metrics · {len(index.dimensions)} dimensions · "
+        f"{len(index.periods)} periods · built in {load_ms:.0f}ms\n"
+    )
+
+    tools = MetricsTools(index)
+    cases = [
+        ("lookup total", lambda: index.lookup(metric)),
+        ("lookup member", lambda: index.lookup(metric, member=member)),
+        ("rank top 5", lambda: index.rank(metric, dimension)),
+        ("attribute top 3", lambda: index.attribute(metric, dimension)),
+        ("tool call (cached)", lambda: tools.call("attribute_change", {"metric": metric, "dimension": dimension})),
+    ]
+    print(f"{'query':<20} {'µs/call':>9}")
+    for name, fn in cases:
+        print(f"{name:<20} {timed(fn, args.repeat):>9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="指标索引查询基准测试")
+    parser.add_argument("--file", help="真实数据文件（CSV / JSON Lines），不填则生成合成数据")
+    parser.add_argument("--periods", type=int, default=52, help="合成数据的周期数")
+    parser.add_argument("--categories", type=int, default=30, help="合成数据的品类数")
+    parser.add_argument("--repeat", type=int, default=10000)
+    main(parser.parse_args())
@@ -0,0 +1,112 @@
+#
+# DataAgent 语音服务 - 本地 Piper 引擎基准测试
+# 模拟多个会话同时说话（每个会话逐句提交回答），测量不同工作进程数下的实时率、吞吐和首包延迟
+#
+# 用法:
+#   python bench_piper.py --model zh_CN-huayan-medium.onnx
+#   python bench_piper.py --model zh_CN-huayan-medium.onnx --workers 1,2,4 --sessions 16
+#   python bench_piper.py --model zh_CN-huayan-medium.onnx --json piper_bench.json
+#
+# 指标:
+#   RTF        工作进程内合成耗时 / 合成音频时长（单进程的实时率，越小越好）
+#   audio/s    每秒墙钟时间合成出的音频秒数（整个池的吞吐）
+#   per core   吞吐除以占用的核数（工作进程数 × 推理线程数，不超过 CPU 核数）
+#   TTFB       从提交一句到收到第一块音频（包含排队）
+#
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import numpy as np
+
+from piper_pool import PiperEngine
+
+SENTENCES = [
+    "上周全国销售额是一千二百三十万元，环比增长百分之六点二。",
+    "增长主要来自华东地区的线上渠道。",
+    "其中手机品类贡献了大约四成的增量。",
+    "华北地区门店销售额略有下滑，主要受天气影响。",
+    "建议重点关注直播渠道的转化率变化。",
+    "好的，我看一下。",
+]
+
+
+async def run_session(engine: PiperEngine, session_id: str, sentences: int, sample_rate: int, offset: int):
+    ttfb = []
+    audio_bytes = 0
+    for i in range(sentences):
+        text = SENTENCES[(offset + i) % len(SENTENCES)]
+        started = time.perf_counter()
+        first = None
+        async for pcm in engine.synthesize(session_id, text, sample_rate):
+            if first is None:
+                first = time.perf_counter() - started
+            audio_bytes += len(pcm)
+        ttfb.append(first or 0.0)
+    return ttfb, audio_bytes
+
+
+async def bench(args, workers: int) -> dict:
+    engine = PiperEngine(args.model, args.config, workers=workers, threads=args.threads)
+    try:
+        await engine.wait_ready()
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            *(run_session(engine, f"s{i}", args.sentences, args.sample_rate, i) for i in range(args.sessions))
+        )
+        wall = time.perf_counter() - started
+    finally:
+        engine.close()
+    ttfb = np.array([t for session, _ in results for t in session]) * 1000
+    audio_secs = sum(audio for _, audio in results) / 2 / args.sample_rate
+    cores = min(workers * args.threads, os.cpu_count() or 1)
+    return {
+        "workers": workers,
+        "threads": args.threads,
+        "sessions": args.sessions,
+        "sentences": len(ttfb),
+        "audio_secs": round(audio_secs, 1),
+        "wall_secs": round(wall, 2),
+        "rtf": round(engine.synth_secs / engine.audio_secs, 3) if engine.audio_secs else None,
+        "audio_per_sec": round(audio_secs / wall, 2),
+        "per_core": round(audio_secs / wall / cores, 2),
+        "ttfb_p50_ms": round(float(np.percentile(ttfb, 50)), 1),
+        "ttfb_p95_ms": round(float(np.percentile(ttfb, 95)), 1),
+    }
+
+
+async def main(args):
+    rows = [await bench(args, int(n)) for n in args.workers.split(",")]
+    print(
+        f"\n{args.sessions} sessions × {args.sentences} sentences · {args.threads} threads/worker · "
+        f"{os.cpu_count()} CPUs · {args.sample_rate}Hz\n"
+    )
+    print(f"{'workers':>7} {'RTF':>6} {'audio/s':>8} {'per core':>9} {'TTFB p50':>9} {'TTFB p95':>9} {'wall':>7}")
+    for row in rows:
+        print(
+            f"{row['workers']:>7} {row['rtf']:>6} {row['audio_per_sec']:>8} {row['per_core']:>9} "
+            f"{row['ttfb_p50_ms']:>7}ms {row['ttfb_p95_ms']:>7}ms {row['wall_secs']:>6}s"
+        )
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入 {args.json}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地 Piper 引擎基准测试")
+    parser.add_argument("--model", default=os.getenv("PIPER_MODEL"), help="Piper 声音模型（.onnx），默认取 PIPER_MODEL")
+    parser.add_argument("--config", help="模型配置，默认为模型路径 + .json")
+    parser.add_argument("--workers", default=f"1,{os.cpu_count() or 1}", help="要测试的工作进程数，逗号分隔")
+    parser.add_argument("--threads", type=int, default=1, help="每个工作进程的推理线程数")
+    parser.add_argument("--sessions", type=int, default=8, help="同时说话的会话数")
+    parser.add_argument("--sentences", type=int, default=5, help="每个会话合成的句数")
+    parser.add_argument("--sample-rate", type=int, default=24000, help="输出采样率（与管线一致）")
+    parser.add_argument("--json", help="同时把结果写入 JSON 文件")
+    args = parser.parse_args()
+    if not args.model:
+        parser.error("需要 --model 或环境变量 PIPER_MODEL")
+    asyncio.run(main(args))
@@ -0,0 +1,276 @@
+#
+# DataAgent 语音服务 - 会话录制（内存映射环形文件）
+# 用户反馈某一轮很慢或答错时，日志之外什么都没留下。开启录制后，每个会话把收到的原始消息
+# （PCM / 控制消息）、发出的 TTS 音频和关键帧的时间点写进固定大小的内存映射环形文件：
+# 写入只是一次内存拷贝，磁盘占用有上限，replay_capture.py 可以按原时序回放
+#
+
+import json
+import mmap
+import os
+import shutil
+import struct
+import time
+from collections import deque
+from pathlib import Path
+from typing import Iterator
+
+from loguru import logger
+
+from pipecat.frames.frames import (
+    BotStartedSpeakingFrame,
+    BotStoppedSpeakingFrame,
+    InterruptionFrame,
+    LLMFullResponseEndFrame,
+    LLMFullResponseStartFrame,
+    TranscriptionFrame,
+    UserStartedSpeakingFrame,
+    UserStoppedSpeakingFrame,
+    VADUserStartedSpeakingFrame,
+    VADUserStoppedSpeakingFrame,
+)
+from pipecat.observers.base_observer import BaseObserver, FramePushed
+from pipecat.processors.frame_processor import FrameDirection
+
+from paths import data_path
+
+MAGIC = b"DACAP001"
+# 文件头：magic、容量、写入位置、最旧记录位置（后两者是累计字节数，对容量取模得到偏移）、创建时间
+_HEADER = struct.Struct("<8sQQQQ")
+HEADER_SIZE = 64
+# 记录头：相对录制开始的纳秒数、负载长度、类型
+_RECORD = struct.Struct("<QIB3x")
+
+# 记录类型
+IN_BINARY = 1  # 收到的二进制消息（PCM 或以二进制发送的控制消息）
+IN_TEXT = 2  # 收到的文本消息（UTF-8）
+EVENT = 3  # 管线事件（JSON）
+OUT_AUDIO = 4  # 发出的音频（带 WAV 头）
+OUT_MESSAGE = 5  # 发出的其他消息
+
+# 记录事件的帧：断句、转写、LLM 起止、机器人说话起止、打断
+_EVENT_FRAMES = (
+    VADUserStartedSpeakingFrame,
+    VADUserStoppedSpeakingFrame,
+    UserStartedSpeakingFrame,
+    UserStoppedSpeakingFrame,
+    TranscriptionFrame,
+    LLMFullResponseStartFrame,
+    LLMFullResponseEndFrame,
+    BotStartedSpeakingFrame,
+    BotStoppedSpeakingFrame,
+    InterruptionFrame,
+)
+
+
+class RingFile:
+    """固定容量的内存映射环形记录文件
+
+    写满后覆盖最旧的记录。写入位置和最旧记录位置保存在文件头里，
+    进程崩溃后文件仍然可读。单写者，读取用 read_ring()。
+    """
+
+    def __init__(self, path: Path, capacity: int, created_ns: int):
+        self.path = path
+        self.capacity = capacity
+        self._file = open(path, "w+b")
+        self._file.truncate(HEADER_SIZE + capacity)
+        self._mm = mmap.mmap(self._file.fileno(), HEADER_SIZE + capacity)
+        self._created_ns = created_ns
+        self._head = 0
+        self._tail = 0
+        self.dropped = 0
+        self._sync_header()
+
+    def _sync_header(self):
+        _HEADER.pack_into(self._mm, 0, MAGIC, self.capacity, self._head, self._tail, self._created_ns)
+
+    def _write_at(self, position: int, data):
+        offset = position % self.capacity
+        first = min(len(data), self.capacity - offset)
+        self._mm[HEADER_SIZE + offset : HEADER_SIZE + offset + first] = data[:first]
+        if first < len(data):
+            self._mm[HEADER_SIZE : HEADER_SIZE + len(data) - first] = data[first:]
+
+    def _read_at(self, position: int, size: int) -> bytes:
+        return _read_wrapped(self._mm, self.capacity, position, size)
+
+    def append(self, kind: int, payload, ts_ns: int):
+        size = _RECORD.size + len(payload)
+        if size > self.capacity:
+            self.dropped += 1
+            return
+        # 腾出空间：从最旧的记录开始丢
+        while self._head + size - self._tail > self.capacity:
+            _, length, _ = _RECORD.unpack(self._read_at(self._tail, _RECORD.size))
+            self._tail += _RECORD.size + length
+        offset = self._head % self.capacity
+        if offset + _RECORD.size <= self.capacity:
+            _RECORD.pack_into(self._mm, HEADER_SIZE + offset, ts_ns, len(payload), kind)
+        else:
+            self._write_at(self._head, _RECORD.pack(ts_ns, len(payload), kind))
+        self._write_at(self._head + _RECORD.size, memoryview(payload))
+        self._head += size
+        self._sync_header()
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+
+def _read_wrapped(buffer, capacity: int, position: int, size: int) -> bytes:
+    offset = position % capacity
+    first = min(size, capacity - offset)
+    data = bytes(buffer[HEADER_SIZE + offset : HEADER_SIZE + offset + first])
+    if first < size:
+        data += bytes(buffer[HEADER_SIZE : HEADER_SIZE + size - first])
+    return data
+
+
+def read_ring(path: Path) -> tuple[int, list[tuple[int, int, bytes]]]:
+    """读取环形文件，返回 (创建时间 ns, [(相对时间 ns, 类型, 负载), ...])，按写入顺序"""
+    with open(path, "rb") as f:
+        buffer = f.read()
+    magic, capacity, head, tail, created_ns = _HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError(f"{path}: 不是录制文件")
+    records = []
+    position = tail
+    while position < head:
+        ts_ns, length, kind = _RECORD.unpack(_read_wrapped(buffer, capacity, position, _RECORD.size))
+        records.append((ts_ns, kind, _read_wrapped(buffer, capacity, position + _RECORD.size, length)))
+        position += _RECORD.size + length
+    return created_ns, records
+
+
+class SessionCapture:
+    """一个会话的录制：inbound.ring 记录收到的消息和管线事件，outbound.ring 记录发出的音频和消息
+
+    两个方向分开存放，回答音频量大时不会挤掉用户的录音。
+
+    Args:
+        directory: 会话目录
+        capacity: 每个环形文件的容量（字节）
+    """
+
+    def __init__(self, directory: Path, capacity: int):
+        directory.mkdir(parents=True, exist_ok=True)
+        self.directory = directory
+        self._started = time.monotonic_ns()
+        created_ns = time.time_ns()
+        self._inbound = RingFile(directory / "inbound.ring", capacity, created_ns)
+        self._outbound = RingFile(directory / "outbound.ring", capacity, created_ns)
+        self._closed = False
+
+    def _now(self) -> int:
+        return time.monotonic_ns() - self._started
+
+    def inbound(self, data: bytes | str):
+        if self._closed:
+            return
+        if isinstance(data, str):
+            self._inbound.append(IN_TEXT, data.encode("utf-8"), self._now())
+        else:
+            self._inbound.append(IN_BINARY, data, self._now())
+
+    def outbound(self, data: bytes, audio: bool):
+        if not self._closed:
+            self._outbound.append(OUT_AUDIO if audio else OUT_MESSAGE, data, self._now())
+
+    def event(self, name: str, **fields):
+        if not self._closed:
+            payload = json.dumps({"event": name, **fields}, ensure_ascii=False).encode("utf-8")
+            self._inbound.append(EVENT, payload, self._now())
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._inbound.close()
+        self._outbound.close()
+        logger.info(f"📼 Capture saved to {self.directory}")
+
+
+class CaptureObserver(BaseObserver):
+    """把断句、转写、LLM、机器人说话等关键帧的时间点写进当前会话的录制
+
+    get_capture 返回当前会话的 SessionCapture（没有在录制时返回 None）。
+    """
+
+    def __init__(self, get_capture):
+        super().__init__()
+        self._get_capture = get_capture
+        # 最近见过的帧 ID（有界）：同一帧在每两个处理器之间都会被观察到一次
+        self._seen: set[int] = set()
+        self._seen_order: deque[int] = deque()
+
+    async def on_push_frame(self, data: FramePushed):
+        frame = data.frame
+        if data.direction != FrameDirection.DOWNSTREAM or not isinstance(frame, _EVENT_FRAMES):
+            return
+        capture = self._get_capture()
+        if capture is None or frame.id in self._seen:
+            return
+        self._seen.add(frame.id)
+        self._seen_order.append(frame.id)
+        if len(self._seen_order) > 256:
+            self._seen.discard(self._seen_order.popleft())
+        if isinstance(frame, TranscriptionFrame):
+            capture.event(frame.name.split("#")[0], text=frame.text)
+        else:
+            capture.event(frame.name.split("#")[0])
+
+
+class CaptureManager:
+    """按连接创建会话录制，并只保留最近 keep 个会话的目录
+
+    Args:
+        root: 录制根目录
+        capacity_mb: 每个环形文件的容量（MB）
+        keep: 保留的会话数
+    """
+
+    def __init__(self, root: str, capacity_mb: float = 16, keep: int = 50):
+        self.root = Path(root)
+        self.capacity = int(capacity_mb * 1024 * 1024)
+        self.keep = keep
+        self.current: SessionCapture | None = None
+
+    @classmethod
+    def from_env(cls) -> "CaptureManager | None":
+        if os.getenv("CAPTURE", "0") == "0":
+            return None
+        return cls(
+            data_path("CAPTURE_DIR", "captures"),
+            capacity_mb=float(os.getenv("CAPTURE_MAX_MB", "16")),
+            keep=int(os.getenv("CAPTURE_KEEP", "50")),
+        )
+
+    def start(self, label: str = "") -> SessionCapture:
+        self.stop()
+        name = time.strftime("%Y%m%d-%H%M%S") + (f"-{label}" if label else "")
+        self.current = SessionCapture(self.root / name, self.capacity)
+        self._prune()
+        return self.current
+
+    def stop(self):
+        if self.current:
+            self.current.close()
+            self.current = None
+
+    def _prune(self):
+        sessions = sorted(path for path in self.root.iterdir() if path.is_dir())
+        for path in sessions[: max(len(sessions) - self.keep, 0)]:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def iter_session(directory: Path) -> Iterator[tuple[int, str, int, bytes]]:
+    """按时间顺序合并一个会话两个方向的记录：(相对时间 ns, 方向, 类型, 负载)"""
+    records = []
+    for direction in ("inbound", "outbound"):
+        path = directory / f"{direction}.ring"
+        if path.exists():
+            _, items = read_ring(path)
+            records.extend((ts, direction, kind, payload) for ts, kind, payload in items)
+    records.sort(key=lambda record: record[0])
+    return iter(records)
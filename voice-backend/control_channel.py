@@ -0,0 +1,128 @@
+#
+# DataAgent 语音服务 - 控制消息合批
+# 音频之外，连接上还有大量小消息：RTVIObserver 每个 LLM / TTS 文本片段、每个说话事件、每组指标都是一条，
+# TranscriptSender 每个中间转写也是一条。这里把一个 tick（默认 30ms）内产生的控制消息合成一条 WebSocket 消息，
+# 最终转写、打断和回复客户端请求的消息立即发出（连同已经攒下的一起），网络拥塞时让音频先走
+#
+
+import asyncio
+import json
+import time
+from typing import Awaitable, Callable
+
+from loguru import logger
+
+RTVI_LABEL = "rtvi-ai"
+
+# 立即发送的 RTVI 消息：用户开口（前端据此停止播放）、错误、对客户端请求的回复
+RTVI_IMMEDIATE_TYPES = frozenset(
+    {"user-started-speaking", "error", "error-response", "server-response", "action-response", "bot-ready"}
+)
+
+
+def is_immediate(message: dict | str) -> bool:
+    """是否需要立即发送：最终转写、打断信号和应用层控制消息不等 tick
+
+    应用层消息（busy、agent_switched、server_restart 等）都是低频的请求回复，
+    只有中间转写（{"type": "transcript", "final": false}）和文字回答的增量（text_delta）参与合批。
+    """
+    if not isinstance(message, dict):
+        return True
+    kind = message.get("type")
+    if message.get("label") == RTVI_LABEL:
+        if kind == "user-transcription":
+            return bool((message.get("data") or {}).get("final"))
+        return kind in RTVI_IMMEDIATE_TYPES
+    if kind == "text_delta":
+        return False
+    return kind != "transcript" or message.get("final", True)
+
+
+class ControlMessageBatcher:
+    """把一个会话在 tick 内产生的控制消息合成一条发送
+
+    多条消息以 JSON 数组发送，只有一条时仍是单个 JSON 对象（与不合批时相同）。
+    需要立即发送的消息会连同已经攒下的消息马上发出，保证顺序不变。
+
+    音频优先：到点时如果连接的发送缓冲区里积压超过 backlog_bytes（网络慢，音频在排队），
+    控制消息继续等待，最多等 max_delay_secs，避免在音频前面插队。
+
+    Args:
+        send: 发送一批消息的协程函数（已编码的 JSON 文本列表）
+        tick_secs: 合批窗口
+        max_messages: 攒到这么多条时不等 tick 直接发送
+        max_delay_secs: 因音频积压推迟发送的上限
+        backlog_bytes: 发送缓冲区积压阈值
+        buffered_bytes: 返回连接发送缓冲区当前字节数的函数（可选）
+    """
+
+    def __init__(
+        self,
+        send: Callable[[list[str]], Awaitable[None]],
+        tick_secs: float = 0.03,
+        max_messages: int = 64,
+        max_delay_secs: float = 0.25,
+        backlog_bytes: int = 64 * 1024,
+        buffered_bytes: Callable[[], int] | None = None,
+    ):
+        self._send = send
+        self.tick_secs = tick_secs
+        self._max_messages = max_messages
+        self._max_delay_secs = max_delay_secs
+        self._backlog_bytes = backlog_bytes
+        self._buffered_bytes = buffered_bytes
+        self._pending: list[str] = []
+        self._oldest = 0.0
+        self._wake = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self.messages = 0
+        self.sends = 0
+
+    async def submit(self, message: dict | str):
+        encoded = message if isinstance(message, str) else json.dumps(message, ensure_ascii=False)
+        if is_immediate(message):
+            self._pending.append(encoded)
+            await self.flush()
+            return
+        if not self._pending:
+            self._oldest = time.monotonic()
+            self._wake.set()
+        self._pending.append(encoded)
+        if len(self._pending) >= self._max_messages:
+            await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+            self.messages += len(batch)
+            self.sends += 1
+            await self._send(batch)
+
+    def discard(self):
+        """连接断开时丢弃未发送的消息"""
+        self._pending = []
+
+    async def run(self):
+        """后台合批循环，随输出传输层启动和取消"""
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            await asyncio.sleep(self.tick_secs)
+            while self._audio_backlogged() and time.monotonic() - self._oldest < self._max_delay_secs:
+                await asyncio.sleep(self.tick_secs)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Failed to send control messages: {e.__class__.__name__} ({e})")
+
+    def _audio_backlogged(self) -> bool:
+        return bool(self._pending) and self._buffered_bytes is not None and self._buffered_bytes() > self._backlog_bytes
+
+    def stats(self) -> dict:
+        return {
+            "messages": self.messages,
+            "sends": self.sends,
+            "per_send": round(self.messages / self.sends, 1) if self.sends else None,
+        }
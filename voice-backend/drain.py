@@ -0,0 +1,401 @@
+#
+# DataAgent 语音服务 - 排空与平滑重启
+# 部署新版本时不再直接杀掉进程：收到 SIGTERM 后先拉起新进程并把监听 socket 交给它，
+# 新进程加载完模型、连上服务商后才报告就绪；旧进程随即停止接入，等正在进行的这一轮说完，
+# 保存会话状态，通知客户端重连到新进程并恢复对话
+#
+
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from collections import deque
+from pathlib import Path
+
+from loguru import logger
+
+from pipecat.frames.frames import (
+    BotStartedSpeakingFrame,
+    BotStoppedSpeakingFrame,
+    EndFrame,
+    Frame,
+    InputTransportMessageFrame,
+    LLMFullResponseEndFrame,
+    LLMFullResponseStartFrame,
+    UserStartedSpeakingFrame,
+    UserStoppedSpeakingFrame,
+)
+from pipecat.observers.base_observer import BaseObserver, FramePushed
+from pipecat.pipeline.task import PipelineTask
+from pipecat.processors.aggregators.llm_context import LLMContext
+from pipecat.processors.frame_processor import FrameDirection, FrameProcessor
+
+from agent_switch import AgentSwitcher
+from governor import AdmissionWebsocketServerTransport
+from paths import data_path
+
+RESTART_CLOSE_CODE = 1012  # Service Restart
+RESUME_MESSAGE_TYPE = "resume"
+
+# 新旧进程之间的约定：监听 socket 和就绪管道的文件描述符
+LISTEN_FD_ENV = "VOICE_LISTEN_FD"
+READY_FD_ENV = "VOICE_READY_FD"
+
+_ACTIVITY_FRAMES = (
+    UserStartedSpeakingFrame,
+    UserStoppedSpeakingFrame,
+    LLMFullResponseStartFrame,
+    LLMFullResponseEndFrame,
+    BotStartedSpeakingFrame,
+    BotStoppedSpeakingFrame,
+)
+
+
+def inherited_socket() -> socket.socket | None:
+    """上一个进程交接过来的监听 socket（没有时返回 None）"""
+    fd = os.environ.pop(LISTEN_FD_ENV, "")
+    if not fd:
+        return None
+    sock = socket.socket(fileno=int(fd))
+    sock.setblocking(False)
+    return sock
+
+
+def under_systemd() -> bool:
+    return bool(os.getenv("NOTIFY_SOCKET")) and hasattr(socket, "AF_UNIX")
+
+
+def sd_notify(message: str) -> bool:
+    """给 systemd 发一条通知（不在 systemd 下时什么也不做），返回是否发出"""
+    address = os.getenv("NOTIFY_SOCKET", "")
+    if not under_systemd():
+        return False
+    if address.startswith("@"):
+        address = "\0" + address[1:]
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        try:
+            sock.sendto(message.encode(), address)
+            return True
+        except OSError as e:
+            logger.warning(f"⚠️ sd_notify({message}) failed: {e}")
+            return False
+
+
+def notify_ready():
+    """报告就绪：写入上一个进程的就绪管道；在 systemd（Type=notify）下同时发送 READY=1
+
+    交接出来的新进程不是 systemd 记录的主进程，它的 READY=1 只在 NotifyAccess=all 时被接受；
+    真正让 systemd 认它做主进程的是旧进程发的 MAINPID=（见 DrainController._spawn_replacement）。
+    """
+    fd = os.environ.pop(READY_FD_ENV, "")
+    if fd:
+        try:
+            os.write(int(fd), b"ready\n")
+            os.close(int(fd))
+        except OSError as e:
+            logger.warning(f"⚠️ Failed to report readiness to the previous process: {e}")
+    sd_notify("READY=1")
+
+
+class SessionStateStore:
+    """排空时保存的会话状态（Agent 和对话历史），每个文件只能恢复一次，过期自动忽略
+
+    Args:
+        directory: 状态文件目录（新旧进程共用）
+        ttl_secs: 状态的有效期
+    """
+
+    def __init__(self, directory: str, ttl_secs: float = 600):
+        self.directory = Path(directory)
+        self.ttl_secs = ttl_secs
+
+    def save(self, agent_id: str, messages: list) -> str:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        token = uuid.uuid4().hex
+        history = [m for m in messages if isinstance(m, dict) and m.get("role") != "system"]
+        state = {"agent_id": agent_id, "messages": history, "saved_at": time.time()}
+        path = self.directory / f"{token}.json"
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(state, ensure_ascii=False, default=str), encoding="utf-8")
+        tmp.replace(path)
+        return token
+
+    def load(self, token: str) -> dict | None:
+        if not token.isalnum():
+            return None
+        path = self.directory / f"{token}.json"
+        try:
+            state = json.loads(path.read_text(encoding="utf-8"))
+            path.unlink()
+        except (OSError, ValueError):
+            return None
+        if time.time() - state.get("saved_at", 0) > self.ttl_secs:
+            return None
+        return state
+
+    def prune(self):
+        if not self.directory.exists():
+            return
+        for path in self.directory.glob("*.json"):
+            if time.time() - path.stat().st_mtime > self.ttl_secs:
+                path.unlink(missing_ok=True)
+
+
+class SessionResumer(FrameProcessor):
+    """处理重连后客户端发来的 {"type": "resume", "token": ...}：恢复 Agent 和对话历史
+
+    放在 AgentSwitcher 之前（RTVI 会丢弃非 RTVI 消息）。恢复后由 AgentSwitcher 按原来的
+    Agent 重建系统提示词并回复 agent_switched，再回复 {"type": "session_resumed", ...}。
+    """
+
+    def __init__(self, store: SessionStateStore, context: LLMContext, agent_switcher: AgentSwitcher):
+        super().__init__()
+        self._store = store
+        self._context = context
+        self._agent_switcher = agent_switcher
+
+    async def process_frame(self, frame: Frame, direction: FrameDirection):
+        await super().process_frame(frame, direction)
+
+        message = frame.message if isinstance(frame, InputTransportMessageFrame) else None
+        if isinstance(message, dict) and message.get("type") == RESUME_MESSAGE_TYPE:
+            await self._resume(str(message.get("token", "")))
+            return
+
+        await self.push_frame(frame, direction)
+
+    async def _resume(self, token: str):
+        state = self._store.load(token)
+        if not state:
+            logger.warning("⚠️ Resume requested with an unknown or expired token")
+            await self._agent_switcher.reply({"type": "session_resumed", "ok": False})
+            return
+        system = [m for m in self._context.get_messages() if isinstance(m, dict) and m.get("role") == "system"]
+        self._context.set_messages([*system, *state["messages"]])
+        await self._agent_switcher.switch(state["agent_id"])
+        logger.info(f"♻️ Session resumed: {state['agent_id']}, {len(state['messages'])} messages")
+        await self._agent_switcher.reply(
+            {"type": "session_resumed", "ok": True, "agent_id": state["agent_id"], "messages": len(state["messages"])}
+        )
+
+
+class ActivityTracker(BaseObserver):
+    """跟踪用户说话、LLM 生成、机器人说话，判断当前这一轮是否已经结束"""
+
+    def __init__(self):
+        super().__init__()
+        # 最近见过的帧 ID（有界）：同一帧在每两个处理器之间都会被观察到一次
+        self._seen: set[int] = set()
+        self._seen_order: deque[int] = deque()
+        self._user_speaking = False
+        self._llm_running = False
+        self._bot_speaking = False
+        self._last_activity = time.monotonic()
+
+    def idle_secs(self) -> float:
+        if self._user_speaking or self._llm_running or self._bot_speaking:
+            return 0.0
+        return time.monotonic() - self._last_activity
+
+    async def on_push_frame(self, data: FramePushed):
+        frame = data.frame
+        # 说话状态帧会向上下游各广播一份，只看下行的；同一帧经过每个处理器都会触发一次
+        if data.direction != FrameDirection.DOWNSTREAM or not isinstance(frame, _ACTIVITY_FRAMES):
+            return
+        if frame.id in self._seen:
+            return
+        self._seen.add(frame.id)
+        self._seen_order.append(frame.id)
+        if len(self._seen_order) > 256:
+            self._seen.discard(self._seen_order.popleft())
+        if isinstance(frame, (UserStartedSpeakingFrame, UserStoppedSpeakingFrame)):
+            self._user_speaking = isinstance(frame, UserStartedSpeakingFrame)
+        elif isinstance(frame, (LLMFullResponseStartFrame, LLMFullResponseEndFrame)):
+            self._llm_running = isinstance(frame, LLMFullResponseStartFrame)
+        else:
+            self._bot_speaking = isinstance(frame, BotStartedSpeakingFrame)
+        self._last_activity = time.monotonic()
+
+
+class DrainController:
+    """SIGTERM / SIGHUP 时排空本进程，并（可选）把监听 socket 交给预热好的新进程
+
+    1. handoff 时用同样的命令行拉起新进程，监听 socket 通过文件描述符继承，
+       等新进程加载完模型、连上服务商后通过管道报告就绪（最多 handoff_timeout_secs）；
+    2. 关闭本进程的监听 socket，新连接全部由新进程接入；
+    3. 有通话时等这一轮说完（静默 settle_secs，最多 timeout_secs），保存会话状态，
+       给客户端发送 {"type": "server_restart", "token": ...} 后以 1012 关闭，客户端重连后用 token 恢复；
+    4. 结束管线，进程退出。
+
+    新进程启动失败或超时时退化为只排空（期间有短暂的不可用）。
+
+    在 systemd 下（设置了 NOTIFY_SOCKET）：新进程与旧进程在同一个 cgroup 里，stop / restart 时
+    systemd 会在主进程退出后杀掉整个 cgroup，拉起新进程没有意义，所以 SIGTERM 只排空；
+    交接改由 SIGHUP（systemctl reload）触发，新进程就绪后旧进程发送 MAINPID=<新进程>，
+    systemd 改认新进程为主进程，旧进程退出时不再停掉服务。
+
+    Args:
+        transport: WebSocket 服务器传输
+        store: 会话状态存储
+        handoff: 是否拉起新进程并交接监听 socket（仅 POSIX）
+        timeout_secs: 等待当前这一轮结束的最长时间
+        settle_secs: 静默多久算这一轮结束
+        handoff_timeout_secs: 等待新进程就绪的最长时间
+    """
+
+    def __init__(
+        self,
+        transport: AdmissionWebsocketServerTransport,
+        store: SessionStateStore,
+        handoff: bool = True,
+        timeout_secs: float = 30.0,
+        settle_secs: float = 1.0,
+        handoff_timeout_secs: float = 90.0,
+    ):
+        self._transport = transport
+        self.store = store
+        self._handoff = handoff and os.name == "posix"
+        self._timeout_secs = timeout_secs
+        self._settle_secs = settle_secs
+        self._handoff_timeout_secs = handoff_timeout_secs
+        self.activity = ActivityTracker()
+        self._task: PipelineTask | None = None
+        self._context: LLMContext | None = None
+        self._agent_switcher: AgentSwitcher | None = None
+        self._llm: FrameProcessor | None = None
+        self._drain_task: asyncio.Task | None = None
+        self.replacement: subprocess.Popen | None = None
+
+    @classmethod
+    def from_env(cls, transport: AdmissionWebsocketServerTransport) -> "DrainController":
+        return cls(
+            transport,
+            SessionStateStore(data_path("DRAIN_STATE_DIR", "session_state")),
+            handoff=os.getenv("DRAIN_HANDOFF", "1") != "0",
+            timeout_secs=float(os.getenv("DRAIN_TIMEOUT_SECS", "30")),
+            handoff_timeout_secs=float(os.getenv("DRAIN_HANDOFF_TIMEOUT_SECS", "90")),
+        )
+
+    @property
+    def draining(self) -> bool:
+        return self._drain_task is not None
+
+    def resumer(self, context: LLMContext, agent_switcher: AgentSwitcher) -> SessionResumer:
+        return SessionResumer(self.store, context, agent_switcher)
+
+    def attach(self, task: PipelineTask, context: LLMContext, agent_switcher: AgentSwitcher, llm: FrameProcessor):
+        """管线创建后调用：管线启动（服务商连接建立）后预热 LLM 并报告就绪，注册 SIGTERM"""
+        self._task = task
+        self._context = context
+        self._agent_switcher = agent_switcher
+        self._llm = llm
+        self.store.prune()
+
+        @task.event_handler("on_pipeline_started")
+        async def on_pipeline_started(task, frame):
+            await self._warm_llm()
+            notify_ready()
+            logger.info("✅ Voice server ready")
+
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGTERM, self.request_drain, not under_systemd())
+            if hasattr(signal, "SIGHUP"):
+                loop.add_signal_handler(signal.SIGHUP, self.request_drain, True)
+        except (NotImplementedError, RuntimeError):
+            signal.signal(signal.SIGTERM, lambda s, f: loop.call_soon_threadsafe(self.request_drain))
+
+    def request_drain(self, handoff: bool = True):
+        """开始排空；handoff 为 False 时不拉起新进程（systemd stop / restart 会自己重启或停掉服务）"""
+        if self._drain_task is None:
+            self._drain_task = asyncio.get_running_loop().create_task(
+                self._drain(handoff and self._handoff), name="DrainController::_drain"
+            )
+
+    async def _warm_llm(self):
+        """建立到 LLM 服务商的 HTTPS 连接（STT / TTS 的连接在管线启动时已经建立）"""
+        # OpenAI 兼容服务（DeepSeek）的 AsyncOpenAI 客户端，本地替身没有网络连接可预热
+        client = getattr(self._llm, "_client", None)
+        if client is None or not hasattr(client, "models"):
+            return
+        try:
+            await asyncio.wait_for(client.models.list(), timeout=5)
+        except Exception as e:
+            logger.debug(f"LLM warm-up skipped: {e!r}")
+
+    async def _drain(self, handoff: bool):
+        input_transport = self._transport.input()
+        logger.info(f"🛑 Draining voice server ({'handing off to a replacement' if handoff else 'no replacement'})")
+
+        if handoff:
+            await self._spawn_replacement(input_transport.sockets())
+        input_transport.stop_accepting()
+
+        if input_transport.has_client:
+            await self._wait_turn_end(input_transport)
+        if input_transport.has_client and self._context and self._agent_switcher:
+            token = self.store.save(self._agent_switcher.agent_id, self._context.get_messages())
+            logger.info(f"💾 Session state saved for resume ({self._agent_switcher.agent_id})")
+            await input_transport.close_client(
+                {"type": "server_restart", "token": token, "message": "语音服务正在更新，正在为你重新连接"},
+                code=RESTART_CLOSE_CODE,
+                reason="restart",
+            )
+
+        logger.info("👋 Drained, stopping pipeline")
+        if self._task:
+            await self._task.queue_frame(EndFrame())
+
+    async def _wait_turn_end(self, input_transport):
+        deadline = time.monotonic() + self._timeout_secs
+        while input_transport.has_client and time.monotonic() < deadline:
+            if self.activity.idle_secs() >= self._settle_secs:
+                return
+            await asyncio.sleep(0.1)
+        if input_transport.has_client:
+            logger.warning(f"⚠️ Turn still active after {self._timeout_secs}s, closing the call anyway")
+
+    async def _spawn_replacement(self, sockets: list[socket.socket]):
+        if not sockets:
+            logger.warning("⚠️ No listening socket to hand off, draining without a replacement")
+            return
+        listen_fd = sockets[0].fileno()
+        ready_r, ready_w = os.pipe()
+        env = {**os.environ, LISTEN_FD_ENV: str(listen_fd), READY_FD_ENV: str(ready_w)}
+        started = time.monotonic()
+        try:
+            self.replacement = subprocess.Popen(
+                [sys.executable, *sys.argv], env=env, pass_fds=(listen_fd, ready_w), start_new_session=True
+            )
+        except OSError as e:
+            logger.error(f"❌ Failed to start replacement process: {e}")
+            os.close(ready_r)
+            os.close(ready_w)
+            return
+        os.close(ready_w)
+        logger.info(f"🚀 Replacement process {self.replacement.pid} started, waiting for it to warm up")
+        # 新进程写入 ready 或提前退出（管道 EOF）时可读
+        loop = asyncio.get_running_loop()
+        readable = loop.create_future()
+        loop.add_reader(ready_r, lambda: readable.done() or readable.set_result(None))
+        try:
+            await asyncio.wait_for(readable, self._handoff_timeout_secs)
+            ready = os.read(ready_r, 64)
+        except asyncio.TimeoutError:
+            ready = b""
+        finally:
+            loop.remove_reader(ready_r)
+            os.close(ready_r)
+        if ready.startswith(b"ready"):
+            logger.info(f"🤝 Replacement ready after {time.monotonic() - started:.1f}s, handing off")
+            if sd_notify(f"MAINPID={self.replacement.pid}"):
+                logger.info(f"systemd main PID handed to {self.replacement.pid}")
+            return
+        logger.error("❌ Replacement did not become ready, draining without it")
+        self.replacement.terminate()
+        self.replacement = None
@@ -0,0 +1,224 @@
+#
+# DataAgent 语音服务 - 自适应断句（End-of-Turn）
+# 固定的 VAD stop_secs 对说话犹豫的用户太激进、对简短提问又太慢；
+# 这里按会话观察用户句中停顿的分布，动态调整 VAD 停止时间和 Smart Turn 兜底静音时长
+#
+
+import time
+from collections import deque
+
+from loguru import logger
+
+from pipecat.audio.turn.smart_turn.base_smart_turn import BaseSmartTurn
+from pipecat.audio.vad.vad_analyzer import VADAnalyzer
+from pipecat.frames.frames import (
+    Frame,
+    UserStartedSpeakingFrame,
+    UserStoppedSpeakingFrame,
+    VADParamsUpdateFrame,
+    VADUserStartedSpeakingFrame,
+    VADUserStoppedSpeakingFrame,
+)
+from pipecat.processors.frame_processor import FrameDirection, FrameProcessor
+
+
+def percentile(values: list[float], q: float) -> float:
+    """线性插值分位数（q 取 0~1），values 不能为空"""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def clamp(value: float, low: float, high: float) -> float:
+    return max(low, min(high, value))
+
+
+class EndpointingPolicy:
+    """根据句中停顿统计给出断句参数（纯计算，不依赖管线，离线评估也用它）
+
+    - 句中停顿：同一轮里 VAD 判定停止后用户又继续说话，这段静音没有结束本轮。
+    - VAD stop_secs 取停顿中位数的 vad_ratio 倍：停顿长的用户少触发几次 Smart Turn
+      推理，降低在犹豫处被模型误判为说完的概率。
+    - Smart Turn stop_secs（模型判定未说完时的兜底静音）取停顿 p90 的 turn_margin 倍，
+      覆盖绝大多数犹豫停顿；说话干脆的用户兜底时间随之缩短。
+    - 每次误切（用户在断句后 resume_secs 内又接着说）把两个值整体放大 cutoff_boost 倍。
+
+    样本不足 min_samples 时使用基准值。
+
+    Args:
+        vad_stop_secs: VAD 停止时间基准值
+        turn_stop_secs: Smart Turn 兜底静音基准值
+        vad_bounds: VAD 停止时间上下限
+        turn_bounds: Smart Turn 兜底静音上下限
+        window: 参与统计的最近停顿数
+        min_samples: 开始调整所需的最少停顿数
+        vad_ratio: VAD 停止时间相对停顿中位数的比例
+        turn_margin: 兜底静音相对停顿 p90 的倍数
+        cutoff_boost: 每次误切的放大倍数
+        max_boost: 累计放大倍数上限
+    """
+
+    def __init__(
+        self,
+        vad_stop_secs: float = 0.2,
+        turn_stop_secs: float = 3.0,
+        vad_bounds: tuple[float, float] = (0.15, 0.8),
+        turn_bounds: tuple[float, float] = (1.2, 4.0),
+        window: int = 20,
+        min_samples: int = 3,
+        vad_ratio: float = 0.5,
+        turn_margin: float = 1.3,
+        cutoff_boost: float = 1.25,
+        max_boost: float = 2.0,
+    ):
+        self.vad_stop_secs = vad_stop_secs
+        self.turn_stop_secs = turn_stop_secs
+        self.vad_bounds = vad_bounds
+        self.turn_bounds = turn_bounds
+        self.min_samples = min_samples
+        self.vad_ratio = vad_ratio
+        self.turn_margin = turn_margin
+        self.cutoff_boost = cutoff_boost
+        self.max_boost = max_boost
+        self.pauses: deque[float] = deque(maxlen=window)
+        self.cutoffs = 0
+
+    def reset(self):
+        self.pauses.clear()
+        self.cutoffs = 0
+
+    def observe_pause(self, secs: float):
+        """记录一次句中停顿（完整静音时长，秒）"""
+        if secs > 0:
+            self.pauses.append(secs)
+
+    def observe_cutoff(self):
+        """记录一次误切：断句后用户很快又接着说"""
+        self.cutoffs += 1
+
+    def recommend(self) -> tuple[float, float]:
+        """返回 (vad_stop_secs, turn_stop_secs)"""
+        boost = min(self.cutoff_boost**self.cutoffs, self.max_boost)
+        if len(self.pauses) < self.min_samples:
+            vad_stop, turn_stop = self.vad_stop_secs, self.turn_stop_secs
+        else:
+            pauses = list(self.pauses)
+            vad_stop = percentile(pauses, 0.5) * self.vad_ratio
+            turn_stop = percentile(pauses, 0.9) * self.turn_margin
+        return (
+            round(clamp(vad_stop * boost, *self.vad_bounds), 2),
+            round(clamp(turn_stop * boost, *self.turn_bounds), 2),
+        )
+
+
+class AdaptiveEndpointing(FrameProcessor):
+    """紧跟在 transport.input() 之后，按会话调整断句参数
+
+    只观察 VAD / 用户说话事件，所有帧原样透传。新的 VAD 参数通过上行的
+    VADParamsUpdateFrame 交给输入传输层生效；Smart Turn 没有对应的更新帧，
+    直接替换分析器上的参数。mode="fixed" 时只透传，不做任何调整。
+
+    Args:
+        vad_analyzer: 传输层使用的 VAD 分析器
+        turn_analyzer: 传输层使用的 Smart Turn 分析器（可选）
+        policy: 断句策略
+        mode: adaptive / fixed
+        resume_secs: 断句后多久内用户又开口算误切
+        min_change_secs: 参数变化小于该值时不下发，避免频繁抖动
+    """
+
+    def __init__(
+        self,
+        vad_analyzer: VADAnalyzer,
+        turn_analyzer: BaseSmartTurn | None = None,
+        policy: EndpointingPolicy | None = None,
+        mode: str = "adaptive",
+        resume_secs: float = 1.0,
+        min_change_secs: float = 0.05,
+    ):
+        super().__init__()
+        self._vad_analyzer = vad_analyzer
+        self._turn_analyzer = turn_analyzer
+        self._policy = policy or EndpointingPolicy()
+        self._mode = mode
+        self._resume_secs = resume_secs
+        self._min_change_secs = min_change_secs
+        self._in_turn = False
+        self._vad_stopped_at: float | None = None
+        self._turn_ended_at: float | None = None
+        self._applied = (self._policy.vad_stop_secs, self._policy.turn_stop_secs)
+
+    @property
+    def current(self) -> dict:
+        return {"mode": self._mode, "vad_stop_secs": self._applied[0], "turn_stop_secs": self._applied[1]}
+
+    async def process_frame(self, frame: Frame, direction: FrameDirection):
+        await super().process_frame(frame, direction)
+
+        if self._mode == "adaptive" and direction == FrameDirection.DOWNSTREAM:
+            await self._observe(frame)
+
+        await self.push_frame(frame, direction)
+
+    async def _observe(self, frame: Frame):
+        now = time.monotonic()
+        if isinstance(frame, UserStartedSpeakingFrame):
+            self._in_turn = True
+            self._vad_stopped_at = None
+        elif isinstance(frame, UserStoppedSpeakingFrame):
+            self._in_turn = False
+            self._turn_ended_at = now
+            await self._maybe_apply()
+        elif isinstance(frame, VADUserStoppedSpeakingFrame):
+            self._vad_stopped_at = now
+        elif isinstance(frame, VADUserStartedSpeakingFrame):
+            if self._in_turn and self._vad_stopped_at is not None:
+                # VAD 在静音满 stop_secs 后才报告停止，完整停顿要加回这段时间
+                self._policy.observe_pause(now - self._vad_stopped_at + self._applied[0])
+            elif self._turn_ended_at is not None and now - self._turn_ended_at < self._resume_secs:
+                self._policy.observe_cutoff()
+                logger.debug(f"Endpointing cut-off: user resumed {now - self._turn_ended_at:.2f}s after turn end")
+            self._vad_stopped_at = None
+            self._turn_ended_at = None
+
+    async def _maybe_apply(self):
+        vad_stop, turn_stop = self._policy.recommend()
+        if (
+            abs(vad_stop - self._applied[0]) < self._min_change_secs
+            and abs(turn_stop - self._applied[1]) < self._min_change_secs
+        ):
+            return
+        await self._apply(vad_stop, turn_stop)
+
+    async def _apply(self, vad_stop: float, turn_stop: float):
+        self._applied = (vad_stop, turn_stop)
+        params = self._vad_analyzer.params.model_copy(update={"stop_secs": vad_stop})
+        await self.push_frame(VADParamsUpdateFrame(params=params), FrameDirection.UPSTREAM)
+        if self._turn_analyzer:
+            set_turn_stop_secs(self._turn_analyzer, turn_stop)
+        logger.info(
+            f"🎚️ Endpointing: vad_stop={vad_stop:.2f}s turn_stop={turn_stop:.2f}s "
+            f"(pauses={len(self._policy.pauses)}, cutoffs={self._policy.cutoffs})"
+        )
+
+    async def reset(self):
+        """会话结束时恢复基准参数，下一位用户重新统计"""
+        self._policy.reset()
+        self._in_turn = False
+        self._vad_stopped_at = None
+        self._turn_ended_at = None
+        if self._applied != (self._policy.vad_stop_secs, self._policy.turn_stop_secs):
+            await self._apply(self._policy.vad_stop_secs, self._policy.turn_stop_secs)
+
+
+def set_turn_stop_secs(turn_analyzer: BaseSmartTurn, stop_secs: float):
+    """更新 Smart Turn 的兜底静音时长（BaseSmartTurn 没有公开的更新接口）"""
+    turn_analyzer._params = turn_analyzer.params.model_copy(update={"stop_secs": stop_secs})
+    turn_analyzer._stop_ms = stop_secs * 1000
+
+
+def apply_vad_stop_secs(vad_analyzer: VADAnalyzer, stop_secs: float):
+    """直接更新 VAD 停止时间（离线评估用，管线中走 VADParamsUpdateFrame）"""
+    vad_analyzer.set_params(vad_analyzer.params.model_copy(update={"stop_secs": stop_secs}))
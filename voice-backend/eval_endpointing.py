@@ -0,0 +1,238 @@
+#
+# DataAgent 语音服务 - 断句参数离线评估
+# 把标注好的录音按 20ms 帧回放给 Silero VAD（+ 可选 Smart Turn），
+# 对每组参数统计断句延迟和误切次数，用数据选参数
+#
+# 用法:
+#   python eval_endpointing.py manifest.jsonl
+#   python eval_endpointing.py manifest.jsonl --vad-stop 0.2,0.4,0.6 --turn-stop 1.5,3 --adaptive
+#   python eval_endpointing.py manifest.jsonl --no-smart-turn --json results.json
+#
+# manifest.jsonl 每行一条录音，路径相对 manifest 所在目录，turn_ends 是每轮真实说完的时间（秒）:
+#   {"audio": "recordings/q001.wav", "turn_ends": [2.8, 9.4]}
+#
+
+import argparse
+import asyncio
+import itertools
+import json
+import sys
+import wave
+from pathlib import Path
+
+import numpy as np
+
+from pipecat.audio.turn.base_turn_analyzer import EndOfTurnState
+from pipecat.audio.vad.vad_analyzer import VADParams, VADState
+
+from endpointing import EndpointingPolicy, apply_vad_stop_secs, percentile, set_turn_stop_secs
+
+SAMPLE_RATE = 16000
+FRAME_MS = 20
+
+
+def load_pcm(path: Path) -> bytes:
+    """读取 WAV 为 16kHz 单声道 16-bit PCM"""
+    with wave.open(str(path), "rb") as wav:
+        if wav.getsampwidth() != 2:
+            raise ValueError(f"{path}: 只支持 16-bit PCM WAV")
+        rate = wav.getframerate()
+        samples = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+        if wav.getnchannels() > 1:
+            samples = samples.reshape(-1, wav.getnchannels()).mean(axis=1).astype(np.int16)
+    if rate != SAMPLE_RATE:
+        positions = np.arange(0, len(samples), rate / SAMPLE_RATE)
+        samples = np.interp(positions, np.arange(len(samples)), samples).astype(np.int16)
+    return samples.tobytes()
+
+
+def load_manifest(path: Path) -> list[dict]:
+    items = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                item["audio"] = str(path.parent / item["audio"])
+                item["turn_ends"] = sorted(item["turn_ends"])
+                items.append(item)
+    return items
+
+
+async def simulate(
+    pcm: bytes,
+    vad_analyzer,
+    turn_analyzer,
+    policy: EndpointingPolicy | None = None,
+    resume_secs: float = 1.0,
+) -> list[float]:
+    """按 BaseInputTransport 的逻辑回放一段录音，返回每次断句的时间点（秒）
+
+    policy 不为空时模拟自适应模式：和 AdaptiveEndpointing 一样统计句中停顿、
+    误切，并在每次断句后更新参数。
+    """
+    frame_bytes = SAMPLE_RATE * FRAME_MS // 1000 * 2
+    vad_state = VADState.QUIET
+    in_turn = False
+    vad_stopped_at = None
+    turn_ended_at = None
+    end_times = []
+
+    for index in range(0, len(pcm) - frame_bytes + 1, frame_bytes):
+        chunk = pcm[index : index + frame_bytes]
+        now = (index + frame_bytes) / 2 / SAMPLE_RATE
+        previous = vad_state
+        state = await vad_analyzer.analyze_audio(chunk)
+        turn_complete = False
+
+        if state != vad_state and state in (VADState.SPEAKING, VADState.QUIET):
+            if state == VADState.SPEAKING:
+                if in_turn and vad_stopped_at is not None and policy:
+                    policy.observe_pause(now - vad_stopped_at + vad_analyzer.params.stop_secs)
+                elif turn_ended_at is not None and now - turn_ended_at < resume_secs and policy:
+                    policy.observe_cutoff()
+                in_turn = True
+                vad_stopped_at = turn_ended_at = None
+            else:
+                vad_stopped_at = now
+                turn_complete = turn_analyzer is None
+            vad_state = state
+
+        if turn_analyzer:
+            is_speech = vad_state in (VADState.SPEAKING, VADState.STARTING)
+            if turn_analyzer.append_audio(chunk, is_speech) == EndOfTurnState.COMPLETE:
+                turn_complete = True
+            elif vad_state == VADState.QUIET and previous != VADState.QUIET:
+                result, _ = await turn_analyzer.analyze_end_of_turn()
+                turn_complete = result == EndOfTurnState.COMPLETE
+
+        if turn_complete and in_turn:
+            in_turn = False
+            turn_ended_at = now
+            end_times.append(now)
+            if policy:
+                vad_stop, turn_stop = policy.recommend()
+                apply_vad_stop_secs(vad_analyzer, vad_stop)
+                if turn_analyzer:
+                    set_turn_stop_secs(turn_analyzer, turn_stop)
+
+    return end_times
+
+
+def score(end_times: list[float], turn_ends: list[float], max_latency: float, tolerance: float) -> dict:
+    """把检测到的断句与标注对齐
+
+    标注 e 之后 max_latency 内的第一次断句算命中（延迟 = t - e），
+    在下一个标注之前、又不是命中的断句都算误切，没有命中的标注算漏检。
+    """
+    latencies = []
+    false_cutoffs = 0
+    label = 0
+    for t in end_times:
+        while label < len(turn_ends) and t > turn_ends[label] + max_latency:
+            label += 1
+        if label < len(turn_ends) and t >= turn_ends[label] - tolerance:
+            latencies.append(max(t - turn_ends[label], 0.0))
+            label += 1
+        else:
+            false_cutoffs += 1
+    return {"latencies": latencies, "false_cutoffs": false_cutoffs, "turns": len(turn_ends)}
+
+
+def summarize(name: str, scores: list[dict]) -> dict:
+    latencies = [v for s in scores for v in s["latencies"]]
+    turns = sum(s["turns"] for s in scores)
+    false_cutoffs = sum(s["false_cutoffs"] for s in scores)
+    return {
+        "params": name,
+        "turns": turns,
+        "detected": len(latencies),
+        "missed": turns - len(latencies),
+        "false_cutoffs": false_cutoffs,
+        "false_cutoff_rate": round(false_cutoffs / turns, 3) if turns else 0.0,
+        "latency_p50_ms": round(percentile(latencies, 0.5) * 1000) if latencies else None,
+        "latency_p90_ms": round(percentile(latencies, 0.9) * 1000) if latencies else None,
+    }
+
+
+async def evaluate(args) -> list[dict]:
+    from pipecat.audio.vad.silero import SileroVADAnalyzer
+
+    items = load_manifest(Path(args.manifest))
+    recordings = [(load_pcm(Path(item["audio"])), item["turn_ends"]) for item in items]
+    print(f"📂 {len(recordings)} recordings, {sum(len(r[1]) for r in recordings)} labeled turns")
+
+    turn_analyzer = None
+    if args.smart_turn:
+        from pipecat.audio.turn.smart_turn.base_smart_turn import SmartTurnParams
+        from pipecat.audio.turn.smart_turn.local_smart_turn_v3 import LocalSmartTurnAnalyzerV3
+
+        turn_analyzer = LocalSmartTurnAnalyzerV3(params=SmartTurnParams())
+        turn_analyzer.set_sample_rate(SAMPLE_RATE)
+
+    configs = [
+        (f"vad_stop={vad_stop} turn_stop={turn_stop}", vad_stop, turn_stop, False)
+        for vad_stop, turn_stop in itertools.product(args.vad_stop, args.turn_stop)
+    ]
+    if args.adaptive:
+        configs.append((f"adaptive (base vad_stop={args.vad_stop[0]} turn_stop={args.turn_stop[0]})",
+                        args.vad_stop[0], args.turn_stop[0], True))
+
+    results = []
+    for name, vad_stop, turn_stop, adaptive in configs:
+        scores = []
+        for pcm, turn_ends in recordings:
+            # 每段录音视为一个新会话，分析器状态和自适应统计都重新开始
+            vad_analyzer = SileroVADAnalyzer(
+                sample_rate=SAMPLE_RATE, params=VADParams(confidence=args.confidence, stop_secs=vad_stop)
+            )
+            vad_analyzer.set_sample_rate(SAMPLE_RATE)
+            if turn_analyzer:
+                turn_analyzer.clear()
+                set_turn_stop_secs(turn_analyzer, turn_stop)
+            policy = EndpointingPolicy(vad_stop_secs=vad_stop, turn_stop_secs=turn_stop) if adaptive else None
+            end_times = await simulate(pcm, vad_analyzer, turn_analyzer, policy)
+            scores.append(score(end_times, turn_ends, args.max_latency, args.tolerance))
+        results.append(summarize(name, scores))
+    return results
+
+
+def print_table(results: list[dict]):
+    header = f"{'params':<52} {'turns':>6} {'missed':>7} {'cutoffs':>8} {'rate':>6} {'p50':>7} {'p90':>7}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        p50 = f"{r['latency_p50_ms']}ms" if r["latency_p50_ms"] is not None else "-"
+        p90 = f"{r['latency_p90_ms']}ms" if r["latency_p90_ms"] is not None else "-"
+        print(
+            f"{r['params']:<52} {r['turns']:>6} {r['missed']:>7} {r['false_cutoffs']:>8} "
+            f"{r['false_cutoff_rate']:>6.1%} {p50:>7} {p90:>7}"
+        )
+
+
+def float_list(value: str) -> list[float]:
+    return [float(v) for v in value.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="断句参数离线评估：延迟 vs 误切")
+    parser.add_argument("manifest", help="标注文件（JSONL）")
+    parser.add_argument("--vad-stop", type=float_list, default=[0.2, 0.4, 0.6], help="VAD stop_secs 候选，逗号分隔")
+    parser.add_argument("--turn-stop", type=float_list, default=[3.0], help="Smart Turn stop_secs 候选，逗号分隔")
+    parser.add_argument("--confidence", type=float, default=0.7, help="VAD 置信度阈值")
+    parser.add_argument("--adaptive", action="store_true", help="同时评估自适应模式（以第一组候选为基准）")
+    parser.add_argument("--no-smart-turn", dest="smart_turn", action="store_false", help="只用 VAD 断句")
+    parser.add_argument("--max-latency", type=float, default=5.0, help="标注后多久内的断句算命中（秒）")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="标注时间的允许误差（秒）")
+    parser.add_argument("--json", help="把结果另存为 JSON")
+    args = parser.parse_args()
+
+    results = asyncio.run(evaluate(args))
+    print()
+    print_table(results)
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"\n💾 Results saved to {args.json}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
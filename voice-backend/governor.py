@@ -0,0 +1,455 @@
+#
+# DataAgent 语音服务 - 服务商限流与接入控制
+# 本进程对 Deepgram / DeepSeek / TTS 的请求都经过这里：
+# 按「服务商 + API Key」做令牌桶限速和并发上限，排队时进行中的对话优先，
+# 排队超时或容量耗尽时给出明确的「繁忙」提示，而不是让服务商统一返回 429。
+# 限流器不跨进程共享：每个进程只服务一个会话，多进程部署时用 GOVERNOR_PROCESSES 把配额按进程数分摊
+#
+
+import asyncio
+import contextvars
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import socket
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from enum import IntEnum
+
+from loguru import logger
+
+from pipecat.services.deepgram.stt import DeepgramSTTService
+from pipecat.services.tts_service import TTSService
+from pipecat.transports.websocket.server import WebsocketServerInputTransport, WebsocketServerTransport
+from websockets.asyncio.server import serve as websocket_serve
+
+from audio_output import PooledWebsocketOutputTransport
+
+
+class Priority(IntEnum):
+    """排队优先级，数值越小越优先"""
+
+    TURN = 0  # 进行中的对话（LLM 回复、TTS 合成）
+    SESSION = 1  # 新会话的准备工作（建立 STT 连接、预合成应答语）
+
+
+# 当前任务的请求优先级；预热等新会话工作在自己的任务里设置为 SESSION
+request_priority: contextvars.ContextVar[Priority] = contextvars.ContextVar(
+    "request_priority", default=Priority.TURN
+)
+
+
+class GovernorBusy(Exception):
+    """排队超过截止时间仍未拿到名额"""
+
+
+@dataclass
+class ProviderLimits:
+    rate: float  # 每秒请求数
+    burst: int  # 令牌桶容量
+    concurrency: int  # 同时进行的请求数
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self) -> float:
+        """距离下一个令牌可用还要等多久（秒），rate <= 0 表示不限速"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def take(self):
+        self._tokens -= 1
+
+
+class ProviderLimiter:
+    """一个服务商 + API Key 的令牌桶、并发名额和优先级等待队列"""
+
+    def __init__(self, name: str, limits: ProviderLimits):
+        self.name = name
+        self.limits = limits
+        self._bucket = TokenBucket(limits.rate, limits.burst)
+        self._active = 0
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._timer: asyncio.TimerHandle | None = None
+        self.granted = 0
+        self.rejected = 0
+        self.max_wait = 0.0
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    async def acquire(self, priority: Priority, timeout: float):
+        started = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (int(priority), next(self._seq), future))
+        self._dispatch()
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise GovernorBusy(f"{self.name} 排队超过 {timeout:.1f}s（并发 {self._active}，排队 {self.queued}）")
+        except asyncio.CancelledError:
+            # 名额已分配但调用方被取消（如用户打断），把名额还回去
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        self.max_wait = max(self.max_wait, time.monotonic() - started)
+
+    def release(self):
+        self._active -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._waiters and self._active < self.limits.concurrency:
+            if self._waiters[0][2].done():
+                heapq.heappop(self._waiters)
+                continue
+            delay = self._bucket.delay()
+            if delay > 0:
+                if not self._timer:
+                    self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+                return
+            _, _, future = heapq.heappop(self._waiters)
+            self._bucket.take()
+            self._active += 1
+            self.granted += 1
+            future.set_result(None)
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    def stats(self) -> dict:
+        return {
+            "active": self._active,
+            "queued": self.queued,
+            "granted": self.granted,
+            "rejected": self.rejected,
+            "max_wait_secs": round(self.max_wait, 3),
+        }
+
+
+class ProviderGovernor:
+    """进程内的限流器，本进程所有服务商请求都经过它（不跨进程共享）
+
+    Args:
+        limits: 服务商名称 -> 限额，未配置的服务商使用 default
+        default: 默认限额
+        turn_timeout: 进行中的对话最多排队多久
+        session_timeout: 新会话的准备工作最多排队多久
+        max_queue: 任一服务商排队数超过该值时拒绝新连接
+    """
+
+    def __init__(
+        self,
+        limits: dict[str, ProviderLimits] | None = None,
+        default: ProviderLimits | None = None,
+        turn_timeout: float = 8.0,
+        session_timeout: float = 3.0,
+        max_queue: int = 16,
+    ):
+        self._limits = limits or {}
+        self._default = default or ProviderLimits(rate=10, burst=10, concurrency=8)
+        self._timeouts = {Priority.TURN: turn_timeout, Priority.SESSION: session_timeout}
+        self._max_queue = max_queue
+        self._limiters: dict[tuple[str, str], ProviderLimiter] = {}
+
+    @classmethod
+    def from_env(cls) -> "ProviderGovernor":
+        # 配置的是整台机器的配额，多个进程（每个进程一个会话）时按进程数分摊
+        processes = max(int(os.getenv("GOVERNOR_PROCESSES", "1")), 1)
+
+        def limits(prefix: str, rate: str, concurrency: str) -> ProviderLimits:
+            rate_value = max(float(os.getenv(f"GOVERNOR_{prefix}_RPS", rate)), 0.0) / processes
+            return ProviderLimits(
+                rate=rate_value,
+                burst=max(int(rate_value), 1),
+                concurrency=max(int(os.getenv(f"GOVERNOR_{prefix}_CONCURRENCY", concurrency)) // processes, 1),
+            )
+
+        tts = limits("TTS", "10", os.getenv("TTS_MAX_CONCURRENCY", "4"))
+        return cls(
+            limits={
+                "deepseek-llm": limits("LLM", "5", "8"),
+                "deepgram-stt": limits("STT", "2", "10"),
+                **{f"{name}-tts": tts for name in ("deepgram", "cartesia", "elevenlabs", "openai", "piper")},
+            },
+            turn_timeout=float(os.getenv("GOVERNOR_TURN_TIMEOUT_SECS", "8")),
+            session_timeout=float(os.getenv("GOVERNOR_SESSION_TIMEOUT_SECS", "3")),
+            max_queue=int(os.getenv("GOVERNOR_MAX_QUEUE", "16")),
+        )
+
+    def limiter(self, provider: str, api_key: str | None = None) -> ProviderLimiter:
+        # 日志和统计里只出现 Key 的短哈希
+        key_id = hashlib.sha1((api_key or "").encode("utf-8")).hexdigest()[:8]
+        limiter = self._limiters.get((provider, key_id))
+        if limiter is None:
+            limiter = ProviderLimiter(f"{provider}/{key_id}", self._limits.get(provider, self._default))
+            self._limiters[(provider, key_id)] = limiter
+        return limiter
+
+    async def acquire(self, provider: str, api_key: str | None = None, priority: Priority | None = None):
+        priority = request_priority.get() if priority is None else priority
+        limiter = self.limiter(provider, api_key)
+        try:
+            await limiter.acquire(priority, self._timeouts[priority])
+        except GovernorBusy as e:
+            logger.warning(f"⏳ Provider busy: {e}")
+            raise
+        return limiter
+
+    @asynccontextmanager
+    async def slot(self, provider: str, api_key: str | None = None, priority: Priority | None = None):
+        """占用一个请求名额，退出时归还"""
+        limiter = await self.acquire(provider, api_key, priority)
+        try:
+            yield
+        finally:
+            limiter.release()
+
+    def admission_check(self) -> str | None:
+        """接入新会话前检查容量，容量耗尽时返回原因"""
+        for limiter in self._limiters.values():
+            if limiter.queued >= self._max_queue:
+                return f"{limiter.name} 排队 {limiter.queued} 个请求"
+        return None
+
+    def stats(self) -> dict:
+        return {limiter.name: limiter.stats() for limiter in self._limiters.values()}
+
+
+_GOVERNOR: ProviderGovernor | None = None
+
+
+def get_governor() -> ProviderGovernor:
+    """进程内唯一的限流器（首次使用时按环境变量创建，此时 .env 已加载）"""
+    global _GOVERNOR
+    if _GOVERNOR is None:
+        _GOVERNOR = ProviderGovernor.from_env()
+    return _GOVERNOR
+
+
+def govern_tts(tts: TTSService, provider: str, api_key: str | None = None, governor: ProviderGovernor | None = None):
+    """让 TTS 服务的每次合成都经过限流器（包括并行合成和应答语预合成）"""
+    governor = governor or get_governor()
+    run_tts = tts.run_tts
+
+    async def governed_run_tts(text: str):
+        async with governor.slot(f"{provider}-tts", api_key):
+            async for frame in run_tts(text):
+                yield frame
+
+    tts.run_tts = governed_run_tts
+    return tts
+
+
+class GovernedDeepgramSTTService(DeepgramSTTService):
+    """建立 Deepgram 流式连接前先拿名额，连接存续期间一直占用（对应并发连接数上限）
+
+    排队超时不让管道启动失败：上报一个非致命错误，在后台继续排队，拿到名额后再连接，
+    在此之前收到的音频直接丢弃。
+    """
+
+    def __init__(self, *, api_key: str, governor: ProviderGovernor | None = None, **kwargs):
+        super().__init__(api_key=api_key, **kwargs)
+        self._governor = governor or get_governor()
+        self._governor_key = api_key
+        self._lease: ProviderLimiter | None = None
+        self._retry_task: asyncio.Task | None = None
+
+    async def _connect(self):
+        if not self._lease:
+            try:
+                self._lease = await self._governor.acquire("deepgram-stt", self._governor_key, Priority.SESSION)
+            except GovernorBusy as e:
+                await self.push_error(error_msg=f"Deepgram STT busy, retrying in background: {e}")
+                if not self._retry_task:
+                    self._retry_task = self.create_task(self._connect_when_free())
+                return
+        await super()._connect()
+
+    async def _connect_when_free(self):
+        while not self._lease:
+            try:
+                self._lease = await self._governor.acquire("deepgram-stt", self._governor_key, Priority.SESSION)
+            except GovernorBusy:
+                continue
+        self._retry_task = None
+        logger.info("Deepgram STT slot acquired, connecting")
+        await super()._connect()
+
+    async def run_stt(self, audio: bytes):
+        if not self._lease:
+            yield None  # 还在排队，丢弃这段音频
+            return
+        async for frame in super().run_stt(audio):
+            yield frame
+
+    async def _disconnect(self):
+        if self._retry_task:
+            await self.cancel_task(self._retry_task)
+            self._retry_task = None
+        try:
+            if hasattr(self, "_connection"):
+                await super()._disconnect()
+        finally:
+            if self._lease:
+                self._lease.release()
+                self._lease = None
+
+
+BUSY_CLOSE_CODE = 1013  # Try Again Later
+
+
+class AdmissionInputTransport(WebsocketServerInputTransport):
+    """已有用户在通话或服务商容量耗尽时拒绝新连接
+
+    默认实现会直接断开正在通话的用户、改用新连接；这里先 ping 现有连接：
+    stale_ping_secs 内回了 pong 说明用户还在通话，保留现有会话，给新连接发送
+    {"type": "busy"} 消息后以 1013 关闭；没有回应（切换网络、刷新页面后留下的半开连接）
+    则断开旧连接、等它的会话清理完，再接入新连接。
+    平滑重启时可以改用上一个进程交接过来的监听 socket，排空时停止接入（见 drain.py）。
+    """
+
+    def __init__(
+        self,
+        *args,
+        governor: ProviderGovernor | None = None,
+        retry_after_secs: int = 10,
+        stale_ping_secs: float = 2.0,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self._governor = governor or get_governor()
+        self._retry_after_secs = retry_after_secs
+        self._stale_ping_secs = stale_ping_secs
+        self.listen_socket: socket.socket | None = None  # 继承自上一个进程的监听 socket（平滑重启）
+        self._server = None
+        self._client_done: asyncio.Event | None = None
+
+    @property
+    def has_client(self) -> bool:
+        return self._websocket is not None
+
+    def sockets(self) -> list[socket.socket]:
+        return list(self._server.sockets) if self._server else []
+
+    def stop_accepting(self):
+        """关闭本进程的监听 socket，已建立的连接不受影响（交给新进程的 socket 副本继续接入）"""
+        if self._server:
+            self._server.close(close_connections=False)
+
+    async def close_client(self, message: dict, code: int, reason: str):
+        """给当前客户端发一条 JSON 文本消息后关闭连接"""
+        websocket = self._websocket
+        if not websocket:
+            return
+        control = self._transport.output().control
+        try:
+            if control:
+                await control.flush()  # 先发出合批中的消息，保证顺序
+            await websocket.send(json.dumps(message, ensure_ascii=False))
+            await websocket.close(code=code, reason=reason)
+        except Exception:
+            pass
+
+    async def _server_task_handler(self):
+        if self.listen_socket:
+            logger.info(f"Starting websocket server on inherited socket {self.listen_socket.getsockname()}")
+            listen = {"sock": self.listen_socket}
+        else:
+            logger.info(f"Starting websocket server on {self._host}:{self._port}")
+            listen = {"host": self._host, "port": self._port}
+        async with websocket_serve(self._client_handler, **listen) as server:
+            self._server = server
+            await self._callbacks.on_websocket_ready()
+            await self._stop_server_event.wait()
+
+    async def _client_alive(self, websocket) -> bool:
+        try:
+            pong = await websocket.ping()
+            await asyncio.wait_for(pong, self._stale_ping_secs)
+            return True
+        except Exception:
+            return False
+
+    async def _replace_stale_client(self, websocket):
+        """断开没有回应的旧连接，等它的断开回调（会话清理）跑完"""
+        logger.warning(f"Client {websocket.remote_address} did not answer ping, replacing it")
+        websocket.transport.abort()
+        if self._client_done:
+            try:
+                await asyncio.wait_for(self._client_done.wait(), self._stale_ping_secs)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _client_handler(self, websocket):
+        reason = self._governor.admission_check()
+        current = self._websocket
+        if not reason and current:
+            if await self._client_alive(current):
+                reason = "另一位用户正在通话"
+            elif self._websocket is current:
+                await self._replace_stale_client(current)
+        if not reason:
+            done = self._client_done = asyncio.Event()
+            try:
+                await super()._client_handler(websocket)
+            finally:
+                done.set()
+            return
+        logger.warning(f"🚫 Rejected connection from {websocket.remote_address}: {reason}")
+        try:
+            await websocket.send(
+                json.dumps(
+                    {"type": "busy", "message": "语音服务繁忙，请稍后再试", "retry_after": self._retry_after_secs},
+                    ensure_ascii=False,
+                )
+            )
+            await websocket.close(code=BUSY_CLOSE_CODE, reason="busy")
+        except Exception:
+            pass
+
+
+class AdmissionWebsocketServerTransport(WebsocketServerTransport):
+    """使用 AdmissionInputTransport 的 WebSocket 服务器传输，音频输出走复用缓冲区
+
+    Args:
+        control_tick_secs: 控制消息合批窗口（见 PooledWebsocketOutputTransport），0 表示逐条发送
+        **kwargs: WebsocketServerTransport 的参数
+    """
+
+    def __init__(self, *, control_tick_secs: float = 0.0, **kwargs):
+        super().__init__(**kwargs)
+        self._control_tick_secs = control_tick_secs
+
+    def input(self) -> AdmissionInputTransport:
+        if not self._input:
+            self._input = AdmissionInputTransport(
+                self, self._host, self._port, self._params, self._callbacks, name=self._input_name
+            )
+        return self._input
+
+    def output(self) -> PooledWebsocketOutputTransport:
+        if not self._output:
+            self._output = PooledWebsocketOutputTransport(
+                self, self._params, control_tick_secs=self._control_tick_secs, name=self._output_name
+            )
+        return self._output
@@ -0,0 +1,288 @@
+#
+# DataAgent 语音服务 - 事件循环健康监控
+# 实时音频里一次 50ms 的事件循环阻塞就是一次可听见的卡顿。
+# 这里定时采样调度延迟，并把耗时过长的任务步骤归到对应的 FrameProcessor 上，
+# 结果随其他指标一起以 MetricsFrame 输出；可选切换到 uvloop
+#
+
+import asyncio
+import collections.abc
+import os
+import time
+from collections import deque
+
+from loguru import logger
+
+from pipecat.frames.frames import CancelFrame, EndFrame, Frame, MetricsFrame, StartFrame
+from pipecat.metrics.metrics import MetricsData
+from pipecat.processors.frame_processor import FrameDirection, FrameProcessor
+
+from endpointing import percentile
+
+
+class LoopLagMetricsData(MetricsData):
+    """一个上报周期内的事件循环调度延迟（毫秒）"""
+
+    lag_p50_ms: float
+    lag_p99_ms: float
+    lag_max_ms: float
+    stalls: int
+
+
+class LoopStallMetricsData(MetricsData):
+    """一个上报周期内某个处理器造成的阻塞：processor 为造成阻塞的处理器"""
+
+    task: str
+    count: int
+    total_ms: float
+    max_ms: float
+
+
+def install_loop_policy(policy: str) -> str:
+    """按名称设置事件循环策略，需在 asyncio.run 之前调用，返回实际生效的策略
+
+    policy="uvloop" 时尝试使用 uvloop，未安装（或在 Windows 上）时退回默认循环。
+    """
+    if policy != "uvloop":
+        return "asyncio"
+    try:
+        import uvloop
+    except ImportError:
+        logger.warning("⚠️ LOOP_POLICY=uvloop 但未安装 uvloop（pip install uvloop，Windows 不支持），使用默认事件循环")
+        return "asyncio"
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    logger.info(f"✅ 使用 uvloop {uvloop.__version__} 事件循环")
+    return "uvloop"
+
+
+class _TimedCoroutine(collections.abc.Coroutine):
+    """包装任务的协程，给每一步 send / throw 计时"""
+
+    __slots__ = ("_coro", "_monitor")
+
+    def __init__(self, coro, monitor: "LoopLagMonitor"):
+        self._coro = coro
+        self._monitor = monitor
+
+    def send(self, value):
+        started = time.perf_counter()
+        try:
+            return self._coro.send(value)
+        finally:
+            self._monitor._step_finished(started)
+
+    def throw(self, *args):
+        started = time.perf_counter()
+        try:
+            return self._coro.throw(*args)
+        finally:
+            self._monitor._step_finished(started)
+
+    def close(self):
+        return self._coro.close()
+
+    def __await__(self):
+        return self
+
+    def __next__(self):
+        return self.send(None)
+
+    def __iter__(self):
+        return self
+
+    def __repr__(self):
+        return repr(self._coro)
+
+
+def split_task_name(name: str) -> tuple[str, str]:
+    """Pipecat 的任务名形如 "DeepgramSTTService#0::_receive_task_handler"，拆成 (处理器, 函数)"""
+    processor, sep, function = name.partition("::")
+    return (processor, function) if sep else (name, "")
+
+
+class LoopLagMonitor:
+    """事件循环延迟采样 + 阻塞归因（进程内共享）
+
+    - 采样：每 interval_secs 睡一次，实际醒来时间比预期晚多少就是调度延迟。
+    - 归因（attribute=True）：安装任务工厂，给每个任务的每一步计时；超过
+      stall_ms 的步骤按任务名记到对应的处理器上（序列化器在输出传输层的任务里运行，
+      会记到 transport 上）。普通回调（非任务）造成的阻塞只体现在延迟采样里。
+      任务工厂安装后一直保留，下一位用户的会话无需重新安装。
+
+    Args:
+        interval_secs: 采样间隔
+        stall_ms: 超过该值的延迟 / 单步耗时视为一次阻塞
+        window: 参与统计的最近采样数
+        attribute: 是否安装任务工厂做阻塞归因
+    """
+
+    def __init__(self, interval_secs: float = 0.02, stall_ms: float = 50.0, window: int = 3000, attribute: bool = True):
+        self.interval_secs = interval_secs
+        self.stall_ms = stall_ms
+        self.attribute = attribute
+        self._stall_secs = stall_ms / 1000
+        self._lags: deque[float] = deque(maxlen=window)
+        self._stalls = 0
+        self._sources: dict[str, list[float]] = {}
+        self._task: asyncio.Task | None = None
+        self._users = 0
+        self._previous_factory = None
+
+    def install(self):
+        """在当前事件循环上安装计时任务工厂（只对之后创建的任务生效，应在建管线之前调用）"""
+        loop = asyncio.get_running_loop()
+        if not self.attribute or loop.get_task_factory() == self._task_factory:
+            return
+        self._previous_factory = loop.get_task_factory()
+        loop.set_task_factory(self._task_factory)
+
+    def start(self):
+        """开始采样（可被多个会话重复调用，按引用计数管理）"""
+        self._users += 1
+        if self._task:
+            return
+        self.install()
+        self._task = asyncio.get_running_loop().create_task(self._sample(), name="LoopLagMonitor::_sample")
+
+    async def stop(self):
+        self._users = max(self._users - 1, 0)
+        if self._users or not self._task:
+            return
+        task, self._task = self._task, None
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    def _task_factory(self, loop, coro, **kwargs):
+        if self._previous_factory:
+            return self._previous_factory(loop, _TimedCoroutine(coro, self), **kwargs)
+        return asyncio.Task(_TimedCoroutine(coro, self), loop=loop, **kwargs)
+
+    def _step_finished(self, started: float):
+        elapsed = time.perf_counter() - started
+        if elapsed < self._stall_secs:
+            return
+        task = asyncio.current_task()
+        name = task.get_name() if task else "<unknown>"
+        self._sources.setdefault(name, []).append(elapsed * 1000)
+
+    async def _sample(self):
+        loop = asyncio.get_running_loop()
+        interval = self.interval_secs
+        while True:
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            lag = max(loop.time() - expected, 0.0)
+            self._lags.append(lag * 1000)
+            if lag >= self._stall_secs:
+                self._stalls += 1
+
+    def snapshot(self, reset: bool = True) -> dict:
+        """当前窗口的延迟统计和阻塞来源，reset=True 时清空，开始下一个上报周期"""
+        lags = list(self._lags)
+        sources = {
+            name: {"count": len(durations), "total_ms": round(sum(durations), 1), "max_ms": round(max(durations), 1)}
+            for name, durations in sorted(self._sources.items(), key=lambda item: -sum(item[1]))
+        }
+        result = {
+            "samples": len(lags),
+            "lag_p50_ms": round(percentile(lags, 0.5), 2) if lags else 0.0,
+            "lag_p99_ms": round(percentile(lags, 0.99), 2) if lags else 0.0,
+            "lag_max_ms": round(max(lags), 2) if lags else 0.0,
+            "stalls": self._stalls,
+            "sources": sources,
+        }
+        if reset:
+            self._lags.clear()
+            self._stalls = 0
+            self._sources = {}
+        return result
+
+
+_MONITOR: LoopLagMonitor | None = None
+
+
+def get_loop_monitor() -> LoopLagMonitor:
+    """进程内唯一的监控器（首次使用时按环境变量创建）"""
+    global _MONITOR
+    if _MONITOR is None:
+        _MONITOR = LoopLagMonitor(
+            interval_secs=float(os.getenv("LOOP_SAMPLE_MS", "20")) / 1000,
+            stall_ms=float(os.getenv("LOOP_STALL_MS", "50")),
+            attribute=os.getenv("LOOP_ATTRIBUTION", "1") != "0",
+        )
+    return _MONITOR
+
+
+class LoopHealthReporter(FrameProcessor):
+    """管线开始时启动监控，每 report_secs 把统计作为 MetricsFrame 推送并记日志
+
+    所有帧原样透传。延迟统计为 LoopLagMetricsData，每个造成阻塞的处理器
+    一条 LoopStallMetricsData（processor 字段就是它的名字）。
+
+    Args:
+        monitor: 监控器，默认使用进程内共享的实例
+        report_secs: 上报周期
+    """
+
+    def __init__(self, monitor: LoopLagMonitor | None = None, report_secs: float = 10.0):
+        super().__init__()
+        self._monitor = monitor or get_loop_monitor()
+        self._report_secs = report_secs
+        self._report_task: asyncio.Task | None = None
+
+    async def process_frame(self, frame: Frame, direction: FrameDirection):
+        await super().process_frame(frame, direction)
+
+        if isinstance(frame, StartFrame):
+            await self.push_frame(frame, direction)
+            self._monitor.start()
+            self._report_task = self.create_task(self._report_loop())
+            return
+        if isinstance(frame, (EndFrame, CancelFrame)):
+            await self._stop()
+
+        await self.push_frame(frame, direction)
+
+    async def _stop(self):
+        if self._report_task:
+            await self.cancel_task(self._report_task)
+            self._report_task = None
+            await self._monitor.stop()
+
+    async def cleanup(self):
+        await super().cleanup()
+        await self._stop()
+
+    async def _report_loop(self):
+        while True:
+            await asyncio.sleep(self._report_secs)
+            await self.report()
+
+    async def report(self) -> dict:
+        stats = self._monitor.snapshot()
+        data = [
+            LoopLagMetricsData(
+                processor=self.name,
+                lag_p50_ms=stats["lag_p50_ms"],
+                lag_p99_ms=stats["lag_p99_ms"],
+                lag_max_ms=stats["lag_max_ms"],
+                stalls=stats["stalls"],
+            )
+        ]
+        for name, source in stats["sources"].items():
+            processor, function = split_task_name(name)
+            data.append(LoopStallMetricsData(processor=processor, task=function or name, **source))
+        await self.push_frame(MetricsFrame(data=data))
+
+        if stats["stalls"] or stats["sources"]:
+            top = ", ".join(f"{name} ×{s['count']} max {s['max_ms']}ms" for name, s in stats["sources"].items())
+            logger.warning(
+                f"🐢 Event loop stalls: {stats['stalls']} (p99 {stats['lag_p99_ms']}ms, max {stats['lag_max_ms']}ms)"
+                + (f" ← {top}" if top else "")
+            )
+        else:
+            logger.debug(f"Event loop lag: p50 {stats['lag_p50_ms']}ms, p99 {stats['lag_p99_ms']}ms")
+        return stats
@@ -0,0 +1,461 @@
+#
+# DataAgent 语音服务 - 本地指标索引与函数调用
+# 人设里说"销售额120万，比上周增长10%"，但 LLM 手里没有数据，要么编数字，要么把数据塞进提示词。
+# 这里从文件加载预先算好的指标明细，在内存里按 周期 × 维度成员 预聚合成列式数组，
+# 查数、环比和 Top-N 归因都只是字典查找加数组下标（微秒级），通过函数调用交给 LLM，结果按会话缓存
+#
+
+import csv
+import json
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+from loguru import logger
+
+from pipecat.adapters.schemas.function_schema import FunctionSchema
+from pipecat.adapters.schemas.tools_schema import ToolsSchema
+from pipecat.services.llm_service import FunctionCallParams, LLMService
+
+PERIOD_COLUMN = "period"
+
+
+class MetricsQueryError(ValueError):
+    """查询参数不合法（指标、维度、成员或周期不存在），错误信息原样交给 LLM"""
+
+
+_TRUE = frozenset({"true", "1", "yes", "y", "是", "对"})
+_FALSE = frozenset({"false", "0", "no", "n", "否", "不"})
+
+
+def _as_bool(name: str, value) -> bool:
+    """LLM 给的布尔参数常常是字符串（"false"），不能直接当真值用"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.strip().lower() in _TRUE | _FALSE:
+        return value.strip().lower() in _TRUE
+    raise MetricsQueryError(f"参数 {name} 应为 true 或 false，收到 {value!r}")
+
+
+def _as_int(name: str, value) -> int:
+    if isinstance(value, bool):
+        raise MetricsQueryError(f"参数 {name} 应为整数，收到 {value!r}")
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise MetricsQueryError(f"参数 {name} 应为整数，收到 {value!r}") from None
+    if not number.is_integer():
+        raise MetricsQueryError(f"参数 {name} 应为整数，收到 {value!r}")
+    return int(number)
+
+
+def _number(value: float) -> float | int:
+    value = round(float(value), 2)
+    return int(value) if value.is_integer() else value
+
+
+def _pct(part: float, whole: float) -> float | None:
+    return round(float(part / whole) * 100, 1) if whole else None
+
+
+def _change_pct(value: float, baseline: float) -> float | None:
+    return _pct(value - baseline, abs(baseline))
+
+
+class MetricsIndex:
+    """内存中的列式指标表，加载时按周期和每个维度的成员预聚合（求和）
+
+    源文件是一张明细表（CSV 或 JSON Lines）：period 列是周期标签（如 2025-W42、2025-10），
+    按字符串排序即时间顺序；其余列中全部是数值的为指标，其他为维度。预聚合后
+    totals[指标] 形状为 (周期数,)，breakdowns[维度][指标] 形状为 (成员数, 周期数)。
+    比率类指标不能求和，请拆成分子、分母两列。
+
+    Args:
+        columns: 列名 -> 各行的值
+        source: 来源文件（用于日志和错误信息）
+    """
+
+    def __init__(self, columns: dict[str, list], source: str = ""):
+        if PERIOD_COLUMN not in columns:
+            raise ValueError(f"{source or '指标数据'}: 缺少 {PERIOD_COLUMN} 列")
+        self.source = source
+        self.rows = len(columns[PERIOD_COLUMN])
+        periods, period_codes = np.unique(np.asarray(columns[PERIOD_COLUMN], dtype=str), return_inverse=True)
+        self.periods: list[str] = periods.tolist()
+        self._period_pos = {period: i for i, period in enumerate(self.periods)}
+        n_periods = len(self.periods)
+
+        values: dict[str, np.ndarray] = {}
+        labels: dict[str, list] = {}
+        for name, column in columns.items():
+            if name == PERIOD_COLUMN:
+                continue
+            try:
+                values[name] = np.asarray(column, dtype=np.float64)
+            except (TypeError, ValueError):
+                labels[name] = column
+        self.metrics: list[str] = list(values)
+        self.dimensions: list[str] = list(labels)
+
+        self.totals = {
+            metric: np.bincount(period_codes, weights=column, minlength=n_periods) for metric, column in values.items()
+        }
+        self.members: dict[str, list[str]] = {}
+        self.breakdowns: dict[str, dict[str, np.ndarray]] = {}
+        self._member_pos: dict[str, dict[str, int]] = {}
+        self._member_dimension: dict[str, str] = {}
+        for dimension, column in labels.items():
+            members, codes = np.unique(np.asarray(column, dtype=str), return_inverse=True)
+            flat = codes * n_periods + period_codes
+            shape = (len(members), n_periods)
+            self.members[dimension] = members.tolist()
+            self.breakdowns[dimension] = {
+                metric: np.bincount(flat, weights=column, minlength=shape[0] * shape[1]).reshape(shape)
+                for metric, column in values.items()
+            }
+            self._member_pos[dimension] = {member: i for i, member in enumerate(self.members[dimension])}
+            for member in self.members[dimension]:
+                self._member_dimension.setdefault(member, dimension)
+
+    @classmethod
+    def load(cls, path: str | Path) -> "MetricsIndex":
+        """读取 CSV（.csv）或 JSON Lines（其他后缀）明细表"""
+        path = Path(path)
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            if path.suffix.lower() == ".csv":
+                rows = list(csv.DictReader(f))
+            else:
+                rows = [json.loads(line) for line in f if line.strip()]
+        names = list(rows[0]) if rows else [PERIOD_COLUMN]
+        return cls({name: [row.get(name) for row in rows] for name in names}, source=str(path))
+
+    # ---- 参数解析 ----
+
+    def _metric(self, metric: str) -> str:
+        if metric not in self.totals:
+            raise MetricsQueryError(f"没有指标「{metric}」，可用指标：{'、'.join(self.metrics)}")
+        return metric
+
+    def _dimension(self, dimension: str) -> str:
+        if dimension not in self.breakdowns:
+            raise MetricsQueryError(f"没有维度「{dimension}」，可用维度：{'、'.join(self.dimensions)}")
+        return dimension
+
+    def _period(self, period: str | None) -> int:
+        if not period:
+            return len(self.periods) - 1
+        position = self._period_pos.get(period)
+        if position is None:
+            raise MetricsQueryError(f"没有周期「{period}」的数据，最近的周期：{'、'.join(self.periods[-4:])}")
+        return position
+
+    def _baseline(self, position: int, compare_period: str | None) -> int | None:
+        if compare_period:
+            return self._period(compare_period)
+        return position - 1 if position > 0 else None
+
+    def _series(self, metric: str, member: str | None, dimension: str | None) -> tuple[np.ndarray, str | None]:
+        metric = self._metric(metric)
+        if not member:
+            return self.totals[metric], None
+        dimension = self._dimension(dimension) if dimension else self._member_dimension.get(member)
+        position = self._member_pos.get(dimension or "", {}).get(member)
+        if position is None:
+            scope = f"维度「{dimension}」" if dimension else "任何维度"
+            raise MetricsQueryError(f"{scope}里没有「{member}」")
+        return self.breakdowns[dimension][metric][position], dimension
+
+    # ---- 查询 ----
+
+    def lookup(
+        self,
+        metric: str,
+        period: str | None = None,
+        compare_period: str | None = None,
+        member: str | None = None,
+        dimension: str | None = None,
+    ) -> dict:
+        """某个周期的指标值（可限定一个维度成员），并与对比周期（默认上一周期）比较"""
+        series, dimension = self._series(metric, member, dimension)
+        position = self._period(period)
+        result = {"metric": metric, "period": self.periods[position], "value": _number(series[position])}
+        if member:
+            result.update(dimension=dimension, member=member)
+        baseline = self._baseline(position, compare_period)
+        if baseline is not None:
+            result.update(
+                compare_period=self.periods[baseline],
+                compare_value=_number(series[baseline]),
+                change=_number(series[position] - series[baseline]),
+                change_pct=_change_pct(series[position], series[baseline]),
+            )
+        return result
+
+    def rank(self, metric: str, dimension: str, period: str | None = None, top_n: int = 5, ascending: bool = False) -> dict:
+        """按指标值给一个维度的成员排名，附带占总量的比例"""
+        values = self.breakdowns[self._dimension(dimension)][self._metric(metric)]
+        position = self._period(period)
+        column = values[:, position]
+        order = np.argsort(column, kind="stable")
+        if not _as_bool("ascending", ascending):
+            order = order[::-1]
+        total = self.totals[metric][position]
+        members = self.members[dimension]
+        return {
+            "metric": metric,
+            "dimension": dimension,
+            "period": self.periods[position],
+            "total": _number(total),
+            "top": [
+                {
+                    "member": members[i],
+                    "value": _number(column[i]),
+                    "share_pct": _pct(column[i], total),
+                }
+                for i in order[: max(_as_int("top_n", top_n), 1)]
+            ],
+        }
+
+    def attribute(
+        self,
+        metric: str,
+        dimension: str,
+        period: str | None = None,
+        compare_period: str | None = None,
+        top_n: int = 3,
+    ) -> dict:
+        """把指标在两个周期之间的变化拆到一个维度的成员上，返回贡献最大的 top_n 个
+
+        按与总变化同方向的贡献排序：总量下降时列出跌得最多的成员，上升时列出涨得最多的。
+        """
+        values = self.breakdowns[self._dimension(dimension)][self._metric(metric)]
+        position = self._period(period)
+        baseline = self._baseline(position, compare_period)
+        if baseline is None:
+            raise MetricsQueryError(f"{self.periods[position]} 之前没有数据，无法对比")
+        totals = self.totals[metric]
+        total_change = totals[position] - totals[baseline]
+        deltas = values[:, position] - values[:, baseline]
+        direction = -1.0 if total_change < 0 else 1.0
+        order = np.argsort(-deltas * direction, kind="stable")
+        members = self.members[dimension]
+        return {
+            "metric": metric,
+            "dimension": dimension,
+            "period": self.periods[position],
+            "compare_period": self.periods[baseline],
+            "value": _number(totals[position]),
+            "compare_value": _number(totals[baseline]),
+            "change": _number(total_change),
+            "change_pct": _change_pct(totals[position], totals[baseline]),
+            "top": [
+                {
+                    "member": members[i],
+                    "value": _number(values[i, position]),
+                    "change": _number(deltas[i]),
+                    "change_pct": _change_pct(values[i, position], values[i, baseline]),
+                    "contribution_pct": _pct(deltas[i], total_change),
+                }
+                for i in order[: max(_as_int("top_n", top_n), 1)]
+            ],
+        }
+
+    def describe(self) -> str:
+        """给 LLM 的数据目录：指标、维度及成员、周期范围"""
+        dimensions = "；".join(f"{d}（{'、'.join(self.members[d])}）" for d in self.dimensions)
+        periods = f"{self.periods[0]} 至 {self.periods[-1]}" if self.periods else "无"
+        return f"指标：{'、'.join(self.metrics)}\n维度：{dimensions or '无'}\n周期：{periods}，最新 {self.periods[-1] if self.periods else '无'}"
+
+
+class MetricsTools:
+    """一个会话的指标查询工具：函数定义、处理函数和按会话的结果缓存
+
+    同一会话里用户常常追问同一组数（"那华东呢""再说一遍"），相同工具和参数直接返回缓存结果，
+    保证前后回答的数字一致。索引在会话内不变；同一条管线会接待先后多个连接，
+    连接断开时调用 reset() 清空缓存并换上最新的索引。
+
+    Args:
+        index: 指标索引
+        cache_size: 每个会话缓存的结果数
+    """
+
+    def __init__(self, index: MetricsIndex, cache_size: int = 256):
+        self._cache: OrderedDict[tuple[str, str], dict] = OrderedDict()
+        self._cache_size = cache_size
+        self._bind(index)
+        self.calls = 0
+        self.hits = 0
+        self.query_us = 0.0
+
+    def _build_schemas(self) -> list[FunctionSchema]:
+        metric = {"type": "string", "enum": self.index.metrics, "description": "指标名称"}
+        dimension = {"type": "string", "enum": self.index.dimensions, "description": "维度名称"}
+        period = {"type": "string", "description": "周期标签，格式与数据一致，不填为最新周期"}
+        compare_period = {"type": "string", "description": "对比周期，不填为上一周期"}
+        return [
+            FunctionSchema(
+                name="query_metric",
+                description="查询某个周期的指标值，并和对比周期（默认上一周期）比较，返回变化量和变化百分比。"
+                "可限定一个维度成员，如某个地区。",
+                properties={
+                    "metric": metric,
+                    "period": period,
+                    "compare_period": compare_period,
+                    "member": {"type": "string", "description": "维度成员，如「华东」，不填为总量"},
+                    "dimension": {**dimension, "description": "成员所属维度，成员名唯一时可不填"},
+                },
+                required=["metric"],
+            ),
+            FunctionSchema(
+                name="rank_members",
+                description="按指标值给某个维度的成员排名（如哪个地区销售额最高），返回前几名及占比。",
+                properties={
+                    "metric": metric,
+                    "dimension": dimension,
+                    "period": period,
+                    "top_n": {"type": "integer", "description": "返回前几名，默认 5"},
+                    "ascending": {"type": "boolean", "description": "true 时从低到高排"},
+                },
+                required=["metric", "dimension"],
+            ),
+            FunctionSchema(
+                name="attribute_change",
+                description="归因分析：把指标在两个周期之间的变化拆到某个维度的成员上，"
+                "返回对变化贡献最大的几个成员及贡献占比。",
+                properties={
+                    "metric": metric,
+                    "dimension": dimension,
+                    "period": period,
+                    "compare_period": compare_period,
+                    "top_n": {"type": "integer", "description": "返回前几个成员，默认 3"},
+                },
+                required=["metric", "dimension"],
+            ),
+        ]
+
+    def reset(self, index: MetricsIndex | None = None) -> bool:
+        """会话结束：清空结果缓存和统计；传入的索引与当前不同时换用新索引。返回是否换了索引"""
+        self._cache.clear()
+        self.calls = self.hits = 0
+        self.query_us = 0.0
+        if index is None or index is self.index:
+            return False
+        self._bind(index)
+        return True
+
+    def _bind(self, index: MetricsIndex):
+        self.index = index
+        self._handlers = {
+            "query_metric": index.lookup,
+            "rank_members": index.rank,
+            "attribute_change": index.attribute,
+        }
+        self._schemas = self._build_schemas()
+        # 每个函数的参数名 -> 类型，用来整理 LLM 给的参数
+        self._arguments = {
+            schema.name: {name: spec.get("type") for name, spec in schema.properties.items()} for schema in self._schemas
+        }
+
+    def tools_schema(self) -> ToolsSchema:
+        return ToolsSchema(standard_tools=self._schemas)
+
+    def prompt_sections(self) -> dict[str, str]:
+        """放进动态内容的数据查询说明（在可缓存前缀之后，不影响缓存）"""
+        return {
+            "数据查询": "回答涉及具体数字时，先调用工具查询，只用工具返回的数字，不要编造；"
+            "查不到就直说没有这项数据。数字按口语读，如 1204315 读作一百二十万。\n" + self.index.describe()
+        }
+
+    def register(self, llm: LLMService):
+        for name in self._handlers:
+            llm.register_function(name, self._handle)
+
+    def _coerce(self, name: str, arguments: dict) -> dict:
+        """按函数定义的类型整理 LLM 给的参数：丢掉未定义的，整数、布尔、字符串逐个转换"""
+        types = self._arguments[name]
+        coerced = {}
+        for key, value in arguments.items():
+            if key not in types or value in (None, ""):
+                continue
+            if types[key] == "integer":
+                coerced[key] = _as_int(key, value)
+            elif types[key] == "boolean":
+                coerced[key] = _as_bool(key, value)
+            elif isinstance(value, (dict, list)):
+                raise MetricsQueryError(f"参数 {key} 应为字符串，收到 {value!r}")
+            else:
+                coerced[key] = str(value)
+        return coerced
+
+    def call(self, name: str, arguments: dict) -> dict:
+        """执行一次工具调用（同步，命中缓存时不重新计算）
+
+        参数不合法时返回 {"error": ...} 交给 LLM，不抛异常：处理函数抛出后 Pipecat 不会回调结果，
+        这一轮会一直等工具返回。
+        """
+        self.calls += 1
+        try:
+            arguments = self._coerce(name, arguments)
+        except MetricsQueryError as e:
+            return {"error": str(e)}
+        key = (name, json.dumps(arguments, sort_keys=True, ensure_ascii=False))
+        result = self._cache.get(key)
+        if result is not None:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return result
+        started = time.perf_counter()
+        try:
+            result = self._handlers[name](**arguments)
+        except (TypeError, ValueError) as e:  # MetricsQueryError 是 ValueError 的子类
+            result = {"error": str(e)}
+        self.query_us += (time.perf_counter() - started) * 1e6
+        self._cache[key] = result
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return result
+
+    async def _handle(self, params: FunctionCallParams):
+        result = self.call(params.function_name, dict(params.arguments or {}))
+        logger.debug(f"🔧 {params.function_name}({dict(params.arguments or {})}) -> {result}")
+        await params.result_callback(result)
+
+    def stats(self) -> dict:
+        misses = self.calls - self.hits
+        return {
+            "calls": self.calls,
+            "cache_hits": self.hits,
+            "avg_query_us": round(self.query_us / misses, 1) if misses else None,
+        }
+
+
+_INDEX: MetricsIndex | None = None
+_INDEX_MTIME: float | None = None
+
+
+def get_metrics_index() -> MetricsIndex | None:
+    """进程内共享的指标索引（METRICS_INDEX 指向的文件，未配置时为 None）
+
+    启动时和每个连接断开时调用；文件更新后重新加载，之后的新连接使用新数据，加载失败时沿用旧索引。
+    """
+    global _INDEX, _INDEX_MTIME
+    path = os.getenv("METRICS_INDEX", "")
+    if not path:
+        return None
+    try:
+        mtime = os.path.getmtime(path)
+        if _INDEX is None or mtime != _INDEX_MTIME or _INDEX.source != str(Path(path)):
+            started = time.perf_counter()
+            _INDEX, _INDEX_MTIME = MetricsIndex.load(path), mtime
+            logger.info(
+                f"✅ Metrics index loaded from {path}: {_INDEX.rows} rows, {len(_INDEX.metrics)} metrics, "
+                f"{len(_INDEX.dimensions)} dimensions, {len(_INDEX.periods)} periods "
+                f"({(time.perf_counter() - started) * 1000:.0f}ms)"
+            )
+    except (OSError, ValueError) as e:
+        logger.error(f"Failed to load metrics index {path}: {e}")
+    return _INDEX
@@ -0,0 +1,169 @@
+#
+# DataAgent 语音服务 - 句子级并行 TTS 合成
+# 默认的 TTSService 一句一句串行合成，长回答第 3 句要等第 2 句合成完才开始；
+# 这里把后面 K 句同时发给 TTS，按序号顺序播放
+#
+
+import asyncio
+import itertools
+from dataclasses import dataclass, field
+
+from loguru import logger
+
+from pipecat.frames.frames import (
+    AggregatedTextFrame,
+    AggregationType,
+    CancelFrame,
+    EndFrame,
+    Frame,
+    InterimTranscriptionFrame,
+    InterruptionFrame,
+    LLMFullResponseEndFrame,
+    StartFrame,
+    SystemFrame,
+    TextFrame,
+    TranscriptionFrame,
+    TTSSpeakFrame,
+    TTSTextFrame,
+)
+from pipecat.processors.frame_processor import FrameDirection, FrameProcessor
+from pipecat.services.tts_service import TTSService
+from pipecat.utils.text.simple_text_aggregator import SimpleTextAggregator
+
+@dataclass
+class _Sentence:
+    seq: int
+    text: str
+    frames: asyncio.Queue = field(default_factory=asyncio.Queue)
+    task: asyncio.Task | None = None
+
+
+class ParallelTTSStage(FrameProcessor):
+    """放在 TTS 服务之前，接管 LLM 文本的分句与合成
+
+    每个完整句子分配一个序号并立即派发合成任务，最多同时有 max_inflight 句
+    处于合成或待播放状态；服务商的全局限速和并发上限由 governor.govern_tts 包装的
+    run_tts 负责。输出按序号重新排队：
+    当前句的音频边合成边推送，后面的句子先在内存里缓冲。句子播放完成后再推送
+    skip_tts 的 TTSTextFrame，保证助手上下文只记录已说出的内容。
+    被打断时取消所有合成任务并清空队列。
+
+    管线中的 TTS 服务仍然保留（负责启动、指标和设置更新），它只会收到本阶段
+    产生的音频帧和 skip_tts 文本帧并原样透传。只适用于一次请求返回整段音频的
+    HTTP 类 TTS；WebSocket 流式 TTS 本身不串行，不需要这个阶段。
+
+    Args:
+        tts: 管线中的 TTS 服务
+        max_inflight: 每个会话最多提前合成的句子数（K）
+    """
+
+    def __init__(self, tts: TTSService, max_inflight: int = 3):
+        super().__init__()
+        self._tts = tts
+        self._max_inflight = max_inflight
+        self._aggregator = SimpleTextAggregator()
+        self._seq = itertools.count()
+        self._window = asyncio.Semaphore(max_inflight)
+        self._ordered: asyncio.Queue = asyncio.Queue()
+        self._sentences: list[_Sentence] = []
+        self._emitter_task: asyncio.Task | None = None
+
+    async def process_frame(self, frame: Frame, direction: FrameDirection):
+        await super().process_frame(frame, direction)
+
+        if isinstance(frame, StartFrame):
+            await self.push_frame(frame, direction)
+            self._emitter_task = self.create_task(self._emitter())
+        elif isinstance(frame, (EndFrame, CancelFrame)):
+            if isinstance(frame, EndFrame):
+                await self._flush()
+                await self._drain()
+            await self._reset(restart=False)
+            await self.push_frame(frame, direction)
+        elif isinstance(frame, InterruptionFrame):
+            await self._reset(restart=True)
+            await self.push_frame(frame, direction)
+        elif direction == FrameDirection.UPSTREAM or isinstance(frame, SystemFrame):
+            await self.push_frame(frame, direction)
+        elif (
+            isinstance(frame, TextFrame)
+            and not isinstance(frame, (InterimTranscriptionFrame, TranscriptionFrame))
+            and not frame.skip_tts
+        ):
+            async for aggregate in self._aggregator.aggregate(frame.text):
+                self._dispatch(aggregate.text)
+        elif isinstance(frame, TTSSpeakFrame):
+            self._dispatch(frame.text)
+        elif isinstance(frame, LLMFullResponseEndFrame):
+            await self._flush()
+            await self._ordered.put(frame)
+        else:
+            # 其他数据 / 控制帧排在已派发的句子之后，保持原有顺序
+            await self._ordered.put(frame)
+
+    async def _flush(self):
+        remaining = await self._aggregator.flush()
+        if remaining and remaining.text.strip():
+            self._dispatch(remaining.text)
+
+    def _dispatch(self, text: str):
+        text = text.lstrip("\n")
+        if not text.strip():
+            return
+        sentence = _Sentence(next(self._seq), text)
+        sentence.task = self.create_task(self._synthesize(sentence), f"tts_sentence_{sentence.seq}")
+        self._sentences.append(sentence)
+        self._ordered.put_nowait(sentence)
+
+    async def _synthesize(self, sentence: _Sentence):
+        # 窗口名额在句子播放完后由 _emitter 归还，保证最多提前 K 句
+        await self._window.acquire()
+        try:
+            async for frame in self._tts.run_tts(sentence.text):
+                if frame:
+                    await sentence.frames.put(frame)
+        except Exception as e:
+            logger.error(f"❌ TTS sentence {sentence.seq} failed: {e}")
+        finally:
+            await sentence.frames.put(None)
+
+    async def _emitter(self):
+        while True:
+            item = await self._ordered.get()
+            if not isinstance(item, _Sentence):
+                await self.push_frame(item)
+                continue
+            # 与 TTSService 一致：先告知即将朗读的句子（不写入上下文）
+            pending_frame = AggregatedTextFrame(item.text, AggregationType.SENTENCE)
+            pending_frame.append_to_context = False
+            pending_frame.skip_tts = True
+            await self.push_frame(pending_frame)
+            while (frame := await item.frames.get()) is not None:
+                await self.push_frame(frame)
+            self._window.release()
+            if item in self._sentences:
+                self._sentences.remove(item)
+            text_frame = TTSTextFrame(item.text, aggregated_by=AggregationType.SENTENCE)
+            text_frame.skip_tts = True
+            await self.push_frame(text_frame)
+
+    async def _drain(self):
+        """EndFrame 前等待已派发的句子播放完"""
+        while self._sentences or not self._ordered.empty():
+            await asyncio.sleep(0.01)
+
+    async def _reset(self, restart: bool):
+        if self._emitter_task:
+            await self.cancel_task(self._emitter_task)
+            self._emitter_task = None
+        for sentence in self._sentences:
+            if sentence.task:
+                await self.cancel_task(sentence.task)
+        if self._sentences:
+            logger.debug(f"Cancelled {len(self._sentences)} pending TTS sentences")
+        self._sentences.clear()
+        self._ordered = asyncio.Queue()
+        self._window = asyncio.Semaphore(self._max_inflight)
+        await self._aggregator.reset()
+        if restart:
+            self._emitter_task = self.create_task(self._emitter())
@@ -0,0 +1,16 @@
+#
+# DataAgent 语音服务 - 运行时数据路径
+# 用量库、音频采集、会话交接状态、对话归档、用户记忆的相对路径都按本目录解析，
+# 不随启动时的工作目录散落到仓库里别的位置
+#
+
+import os
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+
+
+def data_path(env: str, default: str) -> str:
+    """读取环境变量里的数据路径，相对路径相对 voice-backend 目录；变量设为空时返回空字符串"""
+    path = os.getenv(env, default)
+    return str(BASE_DIR / path) if path else ""
@@ -0,0 +1,397 @@
+#
+# DataAgent 语音服务 - 本地 Piper TTS 引擎（常驻模型的工作进程池）
+# TTS_SERVICE=piper 是唯一不走网络、不按字计费的选项，但每条管线各自合成、在进程内没有并发控制。
+# 这里启动一组工作进程，每个进程常驻一份声音模型；所有会话待合成的句子进同一个队列，
+# 按会话轮转调度，谁也不会被别人的长回答饿死；合成结果按句流式返回
+#
+
+import asyncio
+import importlib.util
+import json
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import aclosing
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import AsyncGenerator
+
+import numpy as np
+from loguru import logger
+
+from pipecat.frames.frames import ErrorFrame, Frame, StartFrame, TTSAudioRawFrame, TTSStartedFrame, TTSStoppedFrame
+from pipecat.services.tts_service import TTSService
+
+# 每帧推送的音频时长：合成结果按句返回，再切成小帧交给管线
+CHUNK_SECS = 0.1
+
+
+def _worker_main(conn, model: bytes | str, config: dict, threads: int):
+    """工作进程：加载模型后循环处理合成任务
+
+    model 为模型字节（fork 时直接继承父进程内存，不重新读盘）或模型路径（spawn 时）。
+    工作进程不写日志（fork 前父进程的日志线程可能持有锁），错误通过管道报回父进程。
+    """
+    import onnxruntime
+    import soxr
+    from piper import PiperVoice
+    from piper.config import PiperConfig
+
+    started = time.perf_counter()
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = threads
+    options.inter_op_num_threads = 1
+    try:
+        voice = PiperVoice(
+            config=PiperConfig.from_dict(config),
+            session=onnxruntime.InferenceSession(model, sess_options=options, providers=["CPUExecutionProvider"]),
+        )
+    except Exception as e:
+        conn.send(("failed", os.getpid(), f"{e.__class__.__name__}: {e}"))
+        return
+    del model
+    try:
+        # 预热：ONNX Runtime 第一次推理要分配内存、选算子实现，不要让第一位用户等
+        for _ in voice.synthesize("ok."):
+            pass
+    except Exception:
+        pass
+    conn.send(("ready", os.getpid(), time.perf_counter() - started))
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            return
+        if message[0] == "stop":
+            return
+        _, job_id, text, sample_rate = message
+        try:
+            started = time.perf_counter()
+            resampler = None
+            if sample_rate != voice.config.sample_rate:
+                resampler = soxr.ResampleStream(voice.config.sample_rate, sample_rate, 1, dtype="int16")
+            samples = 0
+            for chunk in voice.synthesize(text):
+                pcm = (chunk.audio_float_array * 32767).astype(np.int16)
+                samples += len(pcm)
+                if resampler:
+                    pcm = resampler.resample_chunk(pcm)
+                if len(pcm):
+                    conn.send(("audio", job_id, pcm.tobytes()))
+            if resampler:
+                tail = resampler.resample_chunk(np.zeros(0, dtype=np.int16), last=True)
+                if len(tail):
+                    conn.send(("audio", job_id, tail.tobytes()))
+            conn.send(("done", job_id, samples / voice.config.sample_rate, time.perf_counter() - started))
+        except Exception as e:
+            conn.send(("error", job_id, f"{e.__class__.__name__}: {e}"))
+
+
+@dataclass
+class _Job:
+    session_id: str
+    text: str
+    sample_rate: int
+    queued_at: float = field(default_factory=time.monotonic)
+    chunks: asyncio.Queue = field(default_factory=asyncio.Queue)
+    cancelled: bool = False
+    finished: bool = False
+
+
+class _Worker:
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.ready = False
+        self.job: _Job | None = None
+        self.job_id = 0
+
+
+class PiperEngine:
+    """Piper 工作进程池和跨会话的合成队列
+
+    模型文件和配置在父进程里读一次，Linux 上以 fork 启动工作进程，模型字节、已导入的
+    piper / onnxruntime 按写时复制共享，不重复读盘；ONNX Runtime 会话不能跨 fork 使用，
+    每个工作进程各建一个（intra-op 线程数为 threads，默认 1，即一个进程占一个核）。
+    Windows 上以 spawn 启动，各自按路径加载。
+
+    调度：每个会话一个待合成队列，空闲的工作进程按会话轮转取句子，同一会话内按提交顺序。
+    Piper 导出的模型不输出每条样本的长度，不能把多个会话的句子拼成一个批次推理，
+    跨会话的合并发生在队列层面：所有会话共用这组常驻模型的进程。
+
+    Args:
+        model_path: Piper 声音模型（.onnx）
+        config_path: 模型配置，默认为 model_path + ".json"
+        workers: 工作进程数
+        threads: 每个工作进程的推理线程数
+    """
+
+    def __init__(self, model_path: str, config_path: str | None = None, workers: int = 1, threads: int = 1):
+        self.model_path = model_path
+        with open(config_path or f"{model_path}.json", encoding="utf-8") as f:
+            self._config = json.load(f)
+        self.sample_rate: int = self._config["audio"]["sample_rate"]
+        self._threads = threads
+        self._context = multiprocessing.get_context(
+            "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+        )
+        self._model: bytes | str = (
+            Path(model_path).read_bytes() if self._context.get_start_method() == "fork" else model_path
+        )
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_bound = threading.Event()
+        self.error: str | None = None
+        self._workers: list[_Worker] = [self._spawn() for _ in range(max(workers, 1))]
+        self._pending: OrderedDict[str, deque[_Job]] = OrderedDict()
+        self._ready = asyncio.Event()
+        self._closed = False
+        self.jobs = 0
+        self.audio_secs = 0.0
+        self.synth_secs = 0.0
+        logger.info(
+            f"✅ Piper engine: {len(self._workers)} workers × {threads} threads "
+            f"({self._context.get_start_method()}), model {Path(model_path).name} @ {self.sample_rate}Hz"
+        )
+
+    # ---- 工作进程 ----
+
+    def _spawn(self) -> _Worker:
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(child_conn, self._model, self._config, self._threads),
+            name="piper-worker",
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        worker = _Worker(process, parent_conn)
+        threading.Thread(target=self._read_worker, args=(worker,), name="piper-reader", daemon=True).start()
+        return worker
+
+    def _read_worker(self, worker: _Worker):
+        """每个工作进程一个读线程，把消息交回事件循环处理（Windows 的事件循环不支持 add_reader）"""
+        while True:
+            try:
+                message = worker.conn.recv()
+            except (EOFError, OSError):
+                message = ("exit",)
+            if message[0] == "ready" and self._loop is None:
+                # 事件循环还没开始使用引擎（启动阶段），直接记下
+                worker.ready = True
+                continue
+            self._loop_bound.wait()
+            try:
+                self._loop.call_soon_threadsafe(self._on_message, worker, message)
+            except RuntimeError:
+                # 事件循环已关闭（进程退出中）
+                return
+            if message[0] == "exit":
+                return
+
+    def _on_message(self, worker: _Worker, message: tuple):
+        kind = message[0]
+        if kind == "ready":
+            worker.ready = True
+            logger.debug(f"Piper worker {message[1]} ready ({message[2]:.2f}s)")
+        elif kind == "failed":
+            # 模型加载失败，重启也没用：让等待中的合成和就绪检查都报错
+            self.error = f"Piper worker failed to load {self.model_path}: {message[2]}"
+            logger.error(self.error)
+            self._fail_pending()
+            self._ready.set()
+            return
+        elif kind == "exit":
+            self._on_worker_exit(worker)
+            return
+        elif worker.job and message[1] == worker.job_id:
+            job = worker.job
+            if kind == "audio":
+                if not job.cancelled:
+                    job.chunks.put_nowait(message[2])
+                return
+            job.finished = True
+            worker.job = None
+            if kind == "done":
+                self.jobs += 1
+                self.audio_secs += message[2]
+                self.synth_secs += message[3]
+                job.chunks.put_nowait(None)
+            else:
+                job.chunks.put_nowait(RuntimeError(f"Piper synthesis failed: {message[2]}"))
+        if all(w.ready for w in self._workers):
+            self._ready.set()
+        self._dispatch()
+
+    def _on_worker_exit(self, worker: _Worker):
+        if worker not in self._workers:
+            return
+        self._workers.remove(worker)
+        if worker.job and not worker.job.finished:
+            worker.job.finished = True
+            worker.job.chunks.put_nowait(RuntimeError("Piper worker exited"))
+        if self._closed or self.error:
+            return
+        worker.process.join(timeout=1)
+        logger.warning(f"⚠️ Piper worker {worker.process.pid} exited ({worker.process.exitcode}), restarting")
+        self._ready.clear()
+        self._workers.append(self._spawn())
+
+    # ---- 调度 ----
+
+    def _bind_loop(self):
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+            self._ready = asyncio.Event()
+            if all(w.ready for w in self._workers):
+                self._ready.set()
+            self._loop_bound.set()
+
+    def _fail_pending(self):
+        for jobs in self._pending.values():
+            for job in jobs:
+                job.finished = True
+                job.chunks.put_nowait(RuntimeError(self.error))
+        self._pending.clear()
+
+    def _dispatch(self):
+        for worker in self._workers:
+            if not self._pending:
+                return
+            if not worker.ready or worker.job:
+                continue
+            job = self._next_job()
+            if job is None:
+                return
+            worker.job_id += 1
+            worker.job = job
+            worker.conn.send(("synth", worker.job_id, job.text, job.sample_rate))
+
+    def _next_job(self) -> _Job | None:
+        # 按会话轮转：取最前面会话的第一句，该会话还有句子就排到队尾
+        while self._pending:
+            session_id, jobs = self._pending.popitem(last=False)
+            job = jobs.popleft()
+            if jobs:
+                self._pending[session_id] = jobs
+            if not job.cancelled:
+                return job
+        return None
+
+    async def wait_ready(self):
+        """等所有工作进程加载完模型"""
+        self._bind_loop()
+        await self._ready.wait()
+        if self.error:
+            raise RuntimeError(self.error)
+
+    async def synthesize(self, session_id: str, text: str, sample_rate: int | None = None) -> AsyncGenerator[bytes, None]:
+        """合成一段文本，按句流式返回 16-bit PCM（sample_rate 与模型不同时在工作进程里重采样）"""
+        self._bind_loop()
+        if self.error:
+            raise RuntimeError(self.error)
+        job = _Job(session_id, text, sample_rate or self.sample_rate)
+        self._pending.setdefault(session_id, deque()).append(job)
+        self._dispatch()
+        try:
+            while True:
+                item = await job.chunks.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # 被打断或出错时：还在排队的句子不再合成，正在合成的结果丢弃
+            if not job.finished:
+                job.cancelled = True
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._workers),
+            "busy": sum(1 for w in self._workers if w.job),
+            "queued": sum(len(jobs) for jobs in self._pending.values()),
+            "jobs": self.jobs,
+            "rtf": round(self.synth_secs / self.audio_secs, 3) if self.audio_secs else None,
+        }
+
+    def close(self):
+        self._closed = True
+        for worker in self._workers:
+            try:
+                worker.conn.send(("stop",))
+            except (OSError, ValueError):
+                pass
+        for worker in self._workers:
+            worker.process.join(timeout=2)
+            if worker.process.is_alive():
+                worker.process.terminate()
+
+
+class PiperPoolTTSService(TTSService):
+    """使用进程内共享 PiperEngine 的 TTS 服务
+
+    StartFrame 时等工作进程加载完模型，管线就绪即代表本地 TTS 可用；
+    合成结果在工作进程里重采样到管线的输出采样率。
+
+    Args:
+        engine: Piper 引擎
+    """
+
+    def __init__(self, engine: PiperEngine, **kwargs):
+        super().__init__(**kwargs)
+        self._engine = engine
+        self.set_model_name(Path(engine.model_path).stem)
+
+    def can_generate_metrics(self) -> bool:
+        return True
+
+    async def start(self, frame: StartFrame):
+        await super().start(frame)
+        await self._engine.wait_ready()
+
+    async def run_tts(self, text: str) -> AsyncGenerator[Frame, None]:
+        logger.debug(f"{self}: Generating TTS [{text}]")
+        # 预合成应答语时服务不在管线里运行（没有 StartFrame），采用构造时指定的采样率
+        sample_rate = self.sample_rate or self._init_sample_rate or self._engine.sample_rate
+        chunk_bytes = int(sample_rate * CHUNK_SECS) * 2
+        try:
+            await self.start_ttfb_metrics()
+            await self.start_tts_usage_metrics(text)
+            yield TTSStartedFrame()
+            # aclosing：被打断时立即撤销还在排队的句子，而不是等生成器被回收
+            async with aclosing(self._engine.synthesize(self.id, text, sample_rate)) as stream:
+                async for pcm in stream:
+                    await self.stop_ttfb_metrics()
+                    for offset in range(0, len(pcm), chunk_bytes):
+                        yield TTSAudioRawFrame(pcm[offset : offset + chunk_bytes], sample_rate, 1)
+        except Exception as e:
+            logger.error(f"{self} exception: {e}")
+            yield ErrorFrame(error=f"Piper TTS error: {e}")
+        await self.stop_ttfb_metrics()
+        yield TTSStoppedFrame()
+
+
+_ENGINE: PiperEngine | None = None
+
+
+def get_piper_engine() -> PiperEngine:
+    """进程内唯一的 Piper 引擎（首次使用时按环境变量启动工作进程）"""
+    global _ENGINE
+    if _ENGINE is None:
+        model = os.getenv("PIPER_MODEL", "")
+        if not model:
+            raise ValueError("TTS_SERVICE=piper 需要设置 PIPER_MODEL（Piper 声音模型 .onnx 路径）")
+        # 引擎在工作进程里才导入 piper，缺包时在这里先报清楚，而不是等工作进程启动失败
+        if importlib.util.find_spec("piper") is None:
+            raise ImportError("TTS_SERVICE=piper 需要安装 piper-tts（pip install -r requirements-optional.txt）")
+        _ENGINE = PiperEngine(
+            model,
+            os.getenv("PIPER_CONFIG") or None,
+            workers=int(os.getenv("PIPER_WORKERS") or os.cpu_count() or 1),
+            threads=int(os.getenv("PIPER_THREADS") or 1),
+        )
+    return _ENGINE
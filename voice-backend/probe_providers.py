@@ -0,0 +1,449 @@
+#
+# DataAgent 语音服务 - 服务商延迟探测
+# 按 .env 配置对 LLM（DeepSeek）、STT（Deepgram）和 TTS 服务商发起真实请求，在逐级增加的并发下
+# 测量建连、首包延迟、吞吐和错误率，输出表格和 JSON，用于选择 TTS_SERVICE 和限流器的并发上限
+#
+# 用法:
+#   python probe_providers.py                                   # 按 .env 探测 LLM / STT / 当前 TTS
+#   python probe_providers.py --tts deepgram,cartesia,openai:shimmer --levels 1,4,8,16
+#   python probe_providers.py --json probe.json --baseline probe_last_week.json
+#   python probe_providers.py --standin                         # 本地替身服务（CI，不联网不计费）
+#
+# 指标（每个请求新建连接）:
+#   connect    建立 TCP / TLS 连接的耗时
+#   TTFB       LLM / TTS：发出请求到第一个 token / 第一块音频；STT：音频发完到识别结束
+#   throughput LLM：首 token 之后每秒输出字数；TTS / STT：音频时长 / 请求耗时（实时倍数）
+#
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Awaitable, Callable
+
+import aiohttp
+import numpy as np
+from dotenv import load_dotenv
+
+from standins import ProviderStandinServer, tone
+
+LLM_PROMPT = "上周销售额是多少？和前一周比怎么样？"
+TTS_TEXT = "上周全国销售额是一千二百三十万元，环比增长百分之六点二，主要来自华东地区的线上渠道。"
+STT_SAMPLE_RATE = 16000
+TTS_SAMPLE_RATE = 24000
+
+# 各类服务商对应的并发上限配置（见 governor.ProviderGovernor.from_env）
+LIMIT_ENV = {"llm": "GOVERNOR_LLM_CONCURRENCY", "stt": "GOVERNOR_STT_CONCURRENCY", "tts": "TTS_MAX_CONCURRENCY"}
+
+
+class ProbeError(Exception):
+    """服务商返回了错误（HTTP 状态码等），message 即错误分类"""
+
+
+@dataclass
+class Sample:
+    ok: bool
+    total_ms: float
+    connect_ms: float | None = None
+    ttfb_ms: float | None = None
+    throughput: float | None = None
+    error: str | None = None
+
+
+# 一次探测：在给定的 aiohttp 会话上发请求，返回 (首包延迟秒数, 吞吐)
+ProbeFn = Callable[[aiohttp.ClientSession], Awaitable[tuple[float, float]]]
+
+
+@dataclass
+class Target:
+    name: str  # 服务商/模型或音色
+    kind: str  # llm / stt / tts
+    unit: str  # 吞吐的单位
+    probe: ProbeFn
+
+
+async def _check(response: aiohttp.ClientResponse):
+    if response.status >= 400:
+        raise ProbeError(f"HTTP {response.status}")
+
+
+# ---- LLM ----
+
+
+def llm_target(base_url: str, api_key: str, model: str, max_tokens: int) -> Target:
+    async def probe(session: aiohttp.ClientSession) -> tuple[float, float]:
+        started = time.perf_counter()
+        first = None
+        chars = 0
+        async with session.post(
+            f"{base_url}/chat/completions",
+            headers={"Authorization": f"Bearer {api_key}"},
+            json={
+                "model": model,
+                "messages": [
+                    {"role": "system", "content": "你是数据分析助手，用一两句话简短回答。"},
+                    {"role": "user", "content": LLM_PROMPT},
+                ],
+                "stream": True,
+                "max_tokens": max_tokens,
+            },
+        ) as response:
+            await _check(response)
+            async for line in response.content:
+                line = line.strip()
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[5:].strip()
+                if data == b"[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or [{}]
+                delta = (choices[0].get("delta") or {}).get("content") or ""
+                if delta:
+                    first = first or time.perf_counter()
+                    chars += len(delta)
+        if first is None:
+            raise ProbeError("empty response")
+        generating = time.perf_counter() - first
+        return first - started, chars / generating if generating > 0 else 0.0
+
+    return Target(f"deepseek-llm/{model}", "llm", "字/s", probe)
+
+
+# ---- STT ----
+
+
+def stt_target(base_url: str, api_key: str, audio: bytes, speed: float) -> Target:
+    audio_secs = len(audio) / 2 / STT_SAMPLE_RATE
+    chunk = int(STT_SAMPLE_RATE * 0.1) * 2
+
+    async def probe(session: aiohttp.ClientSession) -> tuple[float, float]:
+        started = time.perf_counter()
+        params = {
+            "model": "nova-2",
+            "language": "zh-CN",
+            "encoding": "linear16",
+            "sample_rate": str(STT_SAMPLE_RATE),
+            "interim_results": "true",
+            "punctuate": "true",
+        }
+        async with session.ws_connect(
+            f"{base_url}/v1/listen", params=params, headers={"Authorization": f"Token {api_key}"}
+        ) as ws:
+            for offset in range(0, len(audio), chunk):
+                await ws.send_bytes(audio[offset : offset + chunk])
+                await asyncio.sleep(0.1 / speed)
+            ended = time.perf_counter()
+            await ws.send_str(json.dumps({"type": "CloseStream"}))
+            # 识别结束：服务端发完最终结果和 Metadata 后关闭连接
+            async for message in ws:
+                if message.type == aiohttp.WSMsgType.TEXT and json.loads(message.data).get("type") == "Metadata":
+                    break
+                if message.type == aiohttp.WSMsgType.ERROR:
+                    raise ProbeError("websocket error")
+        finished = time.perf_counter()
+        return finished - ended, audio_secs / (finished - started)
+
+    return Target("deepgram-stt/nova-2", "stt", "x实时", probe)
+
+
+# ---- TTS ----
+
+
+def tts_request(service: str, voice: str | None, base_url: str | None) -> tuple[str, dict, int]:
+    """各 TTS 服务商 HTTP 流式合成接口（与 voice_bot.create_tts_service 的 HTTP 实现同一音色）
+
+    返回 (音色说明, aiohttp 请求参数, 采样率)，请求都要求返回 16-bit PCM。
+    """
+    if service == "deepgram":
+        voice = voice or "aura-2-helena-en"
+        return voice, {
+            "url": f"{base_url or 'https://api.deepgram.com'}/v1/speak",
+            "headers": {"Authorization": f"Token {os.getenv('DEEPGRAM_API_KEY')}"},
+            "params": {"model": voice, "encoding": "linear16", "sample_rate": str(TTS_SAMPLE_RATE), "container": "none"},
+            "json": {"text": TTS_TEXT},
+        }, TTS_SAMPLE_RATE
+    if service == "cartesia":
+        voice = voice or os.getenv("CARTESIA_VOICE_ID", "71a7ad14-091c-4e8e-a314-022ece01c121")
+        return voice, {
+            "url": f"{base_url or 'https://api.cartesia.ai'}/tts/bytes",
+            "headers": {"Cartesia-Version": "2024-11-13", "X-API-Key": os.getenv("CARTESIA_API_KEY", "")},
+            "json": {
+                "model_id": "sonic-3",
+                "transcript": TTS_TEXT,
+                "voice": {"mode": "id", "id": voice},
+                "output_format": {"container": "raw", "encoding": "pcm_s16le", "sample_rate": TTS_SAMPLE_RATE},
+                "language": "zh",
+            },
+        }, TTS_SAMPLE_RATE
+    if service == "elevenlabs":
+        voice = voice or os.getenv("ELEVENLABS_VOICE_ID", "21m00Tcm4TlvDq8ikWAM")
+        return voice, {
+            "url": f"{base_url or 'https://api.elevenlabs.io'}/v1/text-to-speech/{voice}/stream",
+            "headers": {"xi-api-key": os.getenv("ELEVENLABS_API_KEY", "")},
+            "params": {"output_format": f"pcm_{TTS_SAMPLE_RATE}"},
+            "json": {"text": TTS_TEXT, "model_id": "eleven_turbo_v2_5"},
+        }, TTS_SAMPLE_RATE
+    if service == "openai":
+        voice = voice or os.getenv("OPENAI_TTS_VOICE", "nova")
+        # OpenAI 的 pcm 输出固定为 24kHz
+        return voice, {
+            "url": f"{base_url or 'https://api.openai.com'}/v1/audio/speech",
+            "headers": {"Authorization": f"Bearer {os.getenv('OPENAI_API_KEY')}"},
+            "json": {"model": "gpt-4o-mini-tts", "voice": voice, "input": TTS_TEXT, "response_format": "pcm"},
+        }, 24000
+    raise ValueError(f"未知的 TTS 服务: {service}")
+
+
+def tts_target(service: str, voice: str | None, base_url: str | None) -> Target:
+    if service == "piper":
+        return piper_target()
+    label, request, sample_rate = tts_request(service, voice, base_url)
+
+    async def probe(session: aiohttp.ClientSession) -> tuple[float, float]:
+        started = time.perf_counter()
+        first = None
+        size = 0
+        async with session.post(**request) as response:
+            await _check(response)
+            async for data in response.content.iter_any():
+                first = first or time.perf_counter()
+                size += len(data)
+        if not size:
+            raise ProbeError("no audio")
+        return first - started, size / 2 / sample_rate / (time.perf_counter() - started)
+
+    return Target(f"{service}-tts/{label}", "tts", "x实时", probe)
+
+
+def piper_target() -> Target:
+    """本地 Piper 引擎（进程内工作进程池，没有建连）"""
+    from piper_pool import get_piper_engine
+
+    engine = get_piper_engine()
+
+    async def probe(session: aiohttp.ClientSession) -> tuple[float, float]:
+        await engine.wait_ready()
+        started = time.perf_counter()
+        first = None
+        size = 0
+        async for pcm in engine.synthesize(f"probe-{id(session)}", TTS_TEXT, TTS_SAMPLE_RATE):
+            first = first or time.perf_counter()
+            size += len(pcm)
+        return first - started, size / 2 / TTS_SAMPLE_RATE / (time.perf_counter() - started)
+
+    return Target(f"piper-tts/{Path(engine.model_path).stem}", "tts", "x实时", probe)
+
+
+# ---- 执行与汇总 ----
+
+
+async def run_probe(target: Target, timeout: float) -> Sample:
+    """新建连接执行一次探测（通过 aiohttp 的连接跟踪记录建连耗时）"""
+    timing: dict[str, float] = {}
+
+    async def on_connect_start(session, context, params):
+        timing["connect_start"] = time.perf_counter()
+
+    async def on_connect_end(session, context, params):
+        timing["connect_ms"] = (time.perf_counter() - timing["connect_start"]) * 1000
+
+    trace = aiohttp.TraceConfig()
+    trace.on_connection_create_start.append(on_connect_start)
+    trace.on_connection_create_end.append(on_connect_end)
+
+    started = time.perf_counter()
+    try:
+        async with aiohttp.ClientSession(trace_configs=[trace]) as session:
+            async with asyncio.timeout(timeout):
+                ttfb, throughput = await target.probe(session)
+    except ProbeError as e:
+        return Sample(False, (time.perf_counter() - started) * 1000, timing.get("connect_ms"), error=str(e))
+    except TimeoutError:
+        return Sample(False, (time.perf_counter() - started) * 1000, timing.get("connect_ms"), error="timeout")
+    except (aiohttp.WSServerHandshakeError, aiohttp.ClientResponseError) as e:
+        return Sample(False, (time.perf_counter() - started) * 1000, timing.get("connect_ms"), error=f"HTTP {e.status}")
+    except Exception as e:
+        return Sample(False, (time.perf_counter() - started) * 1000, timing.get("connect_ms"), error=e.__class__.__name__)
+    return Sample(True, (time.perf_counter() - started) * 1000, timing.get("connect_ms"), ttfb * 1000, throughput)
+
+
+async def run_level(target: Target, level: int, rounds: int, timeout: float) -> list[Sample]:
+    """level 个并发客户端，各自连续探测 rounds 次"""
+
+    async def client() -> list[Sample]:
+        return [await run_probe(target, timeout) for _ in range(rounds)]
+
+    results = await asyncio.gather(*(client() for _ in range(level)))
+    return [sample for samples in results for sample in samples]
+
+
+def _pct(values: list[float], q: float) -> float | None:
+    return round(float(np.percentile(values, q)), 1) if values else None
+
+
+def summarize(target: Target, level: int, samples: list[Sample]) -> dict:
+    ok = [s for s in samples if s.ok]
+    errors = Counter(s.error for s in samples if not s.ok)
+    return {
+        "target": target.name,
+        "kind": target.kind,
+        "level": level,
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "error_rate": round((len(samples) - len(ok)) / len(samples), 3),
+        "connect_p50_ms": _pct([s.connect_ms for s in samples if s.connect_ms is not None], 50),
+        "ttfb_p50_ms": _pct([s.ttfb_ms for s in ok], 50),
+        "ttfb_p95_ms": _pct([s.ttfb_ms for s in ok], 95),
+        "total_p50_ms": _pct([s.total_ms for s in ok], 50),
+        "throughput_p50": _pct([s.throughput for s in ok], 50),
+        "unit": target.unit,
+        "top_errors": dict(errors.most_common(3)),
+    }
+
+
+def recommend(rows: list[dict], slack: float) -> dict[str, dict]:
+    """每个目标不出错、且 p95 首包延迟不超过最低并发时 slack 倍的最高并发级别"""
+    result = {}
+    for name in dict.fromkeys(row["target"] for row in rows):
+        levels = sorted((row for row in rows if row["target"] == name), key=lambda row: row["level"])
+        base = levels[0]["ttfb_p95_ms"]
+        best = None
+        for row in levels:
+            if row["errors"] or base is None or row["ttfb_p95_ms"] > base * slack:
+                break
+            best = row["level"]
+        result[name] = {"env": LIMIT_ENV[levels[0]["kind"]], "max_concurrency": best}
+    return result
+
+
+def _ms(value) -> str:
+    return "-" if value is None else f"{value:.0f}ms"
+
+
+def print_table(rows: list[dict], baseline: dict[tuple, dict]):
+    width = max(len(row["target"]) for row in rows)
+    header = (
+        f"{'target':<{width}} {'conc':>4} {'n':>4} {'err%':>5} {'connect':>8} "
+        f"{'TTFB p50':>9} {'TTFB p95':>9} {'total':>8} {'throughput':>14}"
+    )
+    print(header + (f" {'ΔTTFB p50':>10}" if baseline else ""))
+    for row in rows:
+        throughput = "-" if row["throughput_p50"] is None else f"{row['throughput_p50']:.1f} {row['unit']}"
+        line = (
+            f"{row['target']:<{width}} {row['level']:>4} {row['requests']:>4} {row['error_rate'] * 100:>5.1f} "
+            f"{_ms(row['connect_p50_ms']):>8} {_ms(row['ttfb_p50_ms']):>9} {_ms(row['ttfb_p95_ms']):>9} "
+            f"{_ms(row['total_p50_ms']):>8} {throughput:>14}"
+        )
+        if baseline:
+            before = baseline.get((row["target"], row["level"]), {}).get("ttfb_p50_ms")
+            delta = "-" if not before or row["ttfb_p50_ms"] is None else f"{(row['ttfb_p50_ms'] / before - 1) * 100:+.0f}%"
+            line += f" {delta:>10}"
+        print(line)
+        if row["top_errors"]:
+            print(f"{'':<{width}}      errors: {row['top_errors']}")
+
+
+def build_targets(args, standin: ProviderStandinServer | None) -> list[Target]:
+    kinds = set(args.kinds.split(","))
+    targets = []
+    if standin:
+        # 替身只实现 DeepSeek / Deepgram 的接口，TTS 按 Deepgram HTTP 合成探测
+        base = standin.base_url
+        llm_url, stt_url, tts_url, services = f"{base}/v1", base, base, [("deepgram", None)]
+    else:
+        llm_url = args.llm_url or "https://api.deepseek.com/v1"
+        stt_url = args.stt_url or "wss://api.deepgram.com"
+        tts_url = args.tts_url
+        services = [
+            (spec.partition(":")[0].strip().lower(), spec.partition(":")[2] or None)
+            for spec in (args.tts or os.getenv("TTS_SERVICE", "deepgram")).split(",")
+        ]
+
+    if "llm" in kinds:
+        api_key = os.getenv("DEEPSEEK_API_KEY", os.getenv("VITE_DEEPSEEK_API_KEY", ""))
+        targets.append(llm_target(llm_url, api_key, args.llm_model, args.llm_tokens))
+    if "stt" in kinds:
+        audio = load_stt_audio(args.stt_audio) if args.stt_audio else tone(3.0, STT_SAMPLE_RATE).tobytes()
+        targets.append(stt_target(stt_url, os.getenv("DEEPGRAM_API_KEY", ""), audio, args.stt_speed))
+    if "tts" in kinds:
+        targets.extend(tts_target(service, voice, tts_url) for service, voice in services)
+    return targets
+
+
+def load_stt_audio(path: str) -> bytes:
+    from eval_endpointing import load_pcm
+
+    return load_pcm(Path(path))
+
+
+async def main(args) -> int:
+    standin = None
+    if args.standin:
+        standin = ProviderStandinServer(capacity=args.standin_capacity)
+        await standin.start()
+    try:
+        targets = build_targets(args, standin)
+        levels = [int(level) for level in args.levels.split(",")]
+        rows = []
+        for target in targets:
+            for level in levels:
+                print(f"… {target.name} × {level}", file=sys.stderr)
+                rows.append(summarize(target, level, await run_level(target, level, args.rounds, args.timeout)))
+    finally:
+        if standin:
+            await standin.stop()
+
+    baseline = {}
+    if args.baseline:
+        previous = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        baseline = {(row["target"], row["level"]): row for row in previous["results"]}
+
+    print()
+    print_table(rows, baseline)
+    recommendations = recommend(rows, args.slack)
+    print(f"\n建议并发上限（无错误且 p95 首包延迟不超过单并发的 {args.slack:g} 倍）:")
+    for name, item in recommendations.items():
+        value = item["max_concurrency"] or "单并发已出错或无数据"
+        print(f"  {name}: {item['env']} ≤ {value}")
+
+    if args.json:
+        report = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "standin": bool(standin),
+            "levels": levels,
+            "rounds": args.rounds,
+            "results": rows,
+            "recommendations": recommendations,
+        }
+        Path(args.json).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"\n💾 Report saved to {args.json}")
+    return 1 if any(row["error_rate"] == 1 for row in rows) else 0
+
+
+if __name__ == "__main__":
+    load_dotenv(override=True)
+    parser = argparse.ArgumentParser(description="服务商延迟探测：建连、首包延迟、吞吐、错误率随并发的变化")
+    parser.add_argument("--kinds", default="llm,stt,tts", help="要探测的服务类型，逗号分隔")
+    parser.add_argument("--tts", help="TTS 服务[:音色]，逗号分隔，默认为 TTS_SERVICE")
+    parser.add_argument("--levels", default="1,2,4,8", help="并发级别，逗号分隔")
+    parser.add_argument("--rounds", type=int, default=2, help="每个并发客户端连续请求的次数")
+    parser.add_argument("--timeout", type=float, default=30.0, help="单个请求的超时（秒）")
+    parser.add_argument("--slack", type=float, default=2.0, help="建议并发上限时允许的 p95 首包延迟倍数")
+    parser.add_argument("--llm-model", default="deepseek-chat")
+    parser.add_argument("--llm-tokens", type=int, default=64, help="LLM 最多生成的 token 数")
+    parser.add_argument("--stt-audio", help="STT 使用的录音（WAV），默认为 3 秒正弦音（只测延迟）")
+    parser.add_argument("--stt-speed", type=float, default=1.0, help="STT 音频发送倍速")
+    parser.add_argument("--llm-url", help="LLM 接口地址（OpenAI 兼容），默认 DeepSeek")
+    parser.add_argument("--stt-url", help="Deepgram 接口地址，默认 wss://api.deepgram.com")
+    parser.add_argument("--tts-url", help="TTS 接口地址，默认各服务商官方地址")
+    parser.add_argument("--standin", action="store_true", help="启动本地替身服务并探测它（CI 使用）")
+    parser.add_argument("--standin-capacity", type=int, default=8, help="替身服务的并发上限，超过返回 429")
+    parser.add_argument("--json", help="同时把结果写入 JSON 文件")
+    parser.add_argument("--baseline", help="之前保存的 JSON，表格中对比首包延迟的变化")
+    sys.exit(asyncio.run(main(parser.parse_args())))
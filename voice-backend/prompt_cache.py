@@ -0,0 +1,198 @@
+#
+# DataAgent 语音服务 - 提示词前缀布局与 DeepSeek 上下文缓存统计
+# DeepSeek 只对「逐字节相同」的前缀命中缓存，这里保证每个 Agent 的前缀稳定，
+# 并把每轮的缓存命中 / 未命中 token 记录下来
+#
+
+import hashlib
+import time
+import unicodedata
+from collections import deque
+from datetime import datetime
+
+from loguru import logger
+from openai.types.completion_usage import PromptTokensDetails
+
+from pipecat.frames.frames import Frame, MetricsFrame, TTSSpeakFrame
+from pipecat.metrics.metrics import LLMUsageMetricsData, TTFBMetricsData
+from pipecat.processors.frame_processor import FrameDirection, FrameProcessor
+from pipecat.services.deepseek.llm import DeepSeekLLMService
+
+from governor import GovernorBusy, ProviderGovernor
+
+# LLM 排队超时时播报的提示，代替一段长时间的沉默
+BUSY_REPLY = "现在请求有点多，请稍等几秒再问我一次。"
+
+WEEKDAYS = ["星期一", "星期二", "星期三", "星期四", "星期五", "星期六", "星期日"]
+
+
+def canonicalize_prompt(text: str) -> str:
+    """把提示词规范化为稳定的字节序列
+
+    统一换行符和 Unicode 形式，去掉行尾空白和首尾空行，
+    保证同一份提示词无论从哪里拼出来都逐字节一致。
+    """
+    text = unicodedata.normalize("NFC", text.replace("\r\n", "\n").replace("\r", "\n"))
+    lines = [line.rstrip() for line in text.split("\n")]
+    return "\n".join(lines).strip("\n") + "\n"
+
+
+class PromptBuilder:
+    """按 Agent 组装系统消息：可缓存前缀在前，动态内容在后
+
+    messages[0] 是规范化后的静态前缀（通用语音规则 + 人设），同一 Agent 的
+    所有会话逐字节相同；时间、用户记忆等动态内容放在单独的第二条 system
+    消息里，只影响前缀之后的部分，不会让缓存失效。
+    """
+
+    def __init__(self, prompts: dict[str, str], default_agent: str = "default"):
+        self._prompts = prompts
+        self._default_agent = default_agent
+        self._prefixes: dict[str, str] = {}
+
+    def resolve_agent(self, agent_id: str) -> str:
+        return agent_id if agent_id in self._prompts else self._default_agent
+
+    def prefix(self, agent_id: str) -> str:
+        """返回 Agent 的可缓存前缀（进程内只计算一次）"""
+        agent_id = self.resolve_agent(agent_id)
+        prefix = self._prefixes.get(agent_id)
+        if prefix is None:
+            prefix = canonicalize_prompt(self._prompts[agent_id])
+            self._prefixes[agent_id] = prefix
+        return prefix
+
+    def prefix_hash(self, agent_id: str) -> str:
+        """前缀的短哈希，用于在日志中确认不同会话的前缀是否一致"""
+        return hashlib.sha1(self.prefix(agent_id).encode("utf-8")).hexdigest()[:12]
+
+    def dynamic_context(self, sections: dict[str, str] | None = None, now: datetime | None = None) -> str:
+        """生成放在前缀之后的动态内容（会话时间 + 其他附加段落）"""
+        now = now or datetime.now()
+        parts = [f"【会话信息】\n当前时间：{now:%Y-%m-%d %H:%M}（{WEEKDAYS[now.weekday()]}）"]
+        for title, body in (sections or {}).items():
+            if body and body.strip():
+                parts.append(f"【{title}】\n{body.strip()}")
+        return canonicalize_prompt("\n\n".join(parts))
+
+    def build_messages(self, agent_id: str, sections: dict[str, str] | None = None) -> list[dict]:
+        """构建会话初始消息：[静态前缀, 动态内容]"""
+        return [
+            {"role": "system", "content": self.prefix(agent_id)},
+            {"role": "system", "content": self.dynamic_context(sections)},
+        ]
+
+    def rebuild_messages(
+        self, messages: list[dict], agent_id: str, sections: dict[str, str] | None = None
+    ) -> list[dict]:
+        """切换 Agent：替换开头的系统消息，保留之后的对话历史"""
+        start = 0
+        while start < len(messages) and messages[start].get("role") == "system":
+            start += 1
+        return self.build_messages(agent_id, sections) + list(messages[start:])
+
+
+class CacheAwareDeepSeekLLMService(DeepSeekLLMService):
+    """把 DeepSeek 的 prompt_cache_hit_tokens 映射到标准的 cached_tokens 字段
+
+    DeepSeek 在 usage 里用 prompt_cache_hit_tokens / prompt_cache_miss_tokens
+    报告缓存情况，Pipecat 只读取 OpenAI 格式的 prompt_tokens_details.cached_tokens，
+    这里在流式响应里补上该字段，让 LLMUsageMetricsData 带上命中数。
+
+    传入 governor 时每次请求先在限流器排队，整个流式响应期间占用一个并发名额；
+    排队超时则播报 BUSY_REPLY。
+    """
+
+    def __init__(self, *, governor: ProviderGovernor | None = None, **kwargs):
+        super().__init__(**kwargs)
+        self._governor = governor
+        self._governor_key = kwargs.get("api_key")
+
+    async def _process_context(self, context):
+        if not self._governor:
+            return await super()._process_context(context)
+        try:
+            async with self._governor.slot("deepseek-llm", self._governor_key):
+                await super()._process_context(context)
+        except GovernorBusy:
+            await self.push_frame(TTSSpeakFrame(BUSY_REPLY))
+
+    async def get_chat_completions(self, *args, **kwargs):
+        stream = await super().get_chat_completions(*args, **kwargs)
+        return self._with_cache_usage(stream)
+
+    async def _with_cache_usage(self, stream):
+        async for chunk in stream:
+            usage = getattr(chunk, "usage", None)
+            if usage is not None and not usage.prompt_tokens_details:
+                hit_tokens = getattr(usage, "prompt_cache_hit_tokens", None)
+                if hit_tokens is not None:
+                    usage.prompt_tokens_details = PromptTokensDetails(cached_tokens=hit_tokens)
+            yield chunk
+
+
+class PromptCacheMetrics(FrameProcessor):
+    """按轮次记录 LLM 缓存命中 / 未命中 token 和首 token 延迟
+
+    放在 LLM 之后，只读取 MetricsFrame，所有帧原样透传。
+    """
+
+    def __init__(self, agent_id: str, prefix_hash: str = "", max_turns: int = 500):
+        super().__init__()
+        self.agent_id = agent_id
+        self.prefix_hash = prefix_hash
+        self.turns: deque[dict] = deque(maxlen=max_turns)
+        self.hit_tokens = 0
+        self.miss_tokens = 0
+        self._turn = 0
+        self._pending_ttfb: float | None = None
+
+    async def process_frame(self, frame: Frame, direction: FrameDirection):
+        await super().process_frame(frame, direction)
+
+        if isinstance(frame, MetricsFrame):
+            for data in frame.data:
+                if isinstance(data, TTFBMetricsData) and "LLM" in data.processor:
+                    self._pending_ttfb = data.value
+                elif isinstance(data, LLMUsageMetricsData):
+                    self._record_usage(data)
+
+        await self.push_frame(frame, direction)
+
+    def _record_usage(self, data: LLMUsageMetricsData):
+        usage = data.value
+        hit = usage.cache_read_input_tokens or 0
+        miss = max(usage.prompt_tokens - hit, 0)
+        self._turn += 1
+        self.hit_tokens += hit
+        self.miss_tokens += miss
+        turn = {
+            "turn": self._turn,
+            "time": time.time(),
+            "agent_id": self.agent_id,
+            "prefix_hash": self.prefix_hash,
+            "cache_hit_tokens": hit,
+            "cache_miss_tokens": miss,
+            "completion_tokens": usage.completion_tokens,
+            "ttfb": self._pending_ttfb,
+        }
+        self.turns.append(turn)
+        self._pending_ttfb = None
+
+        ratio = hit / usage.prompt_tokens if usage.prompt_tokens else 0.0
+        ttfb = f"{turn['ttfb'] * 1000:.0f}ms" if turn["ttfb"] is not None else "-"
+        logger.info(
+            f"🧠 Prompt cache turn {self._turn}: hit={hit} miss={miss} ({ratio:.0%}) ttfb={ttfb}"
+        )
+
+    def summary(self) -> dict:
+        """会话累计的缓存命中情况"""
+        total = self.hit_tokens + self.miss_tokens
+        return {
+            "agent_id": self.agent_id,
+            "prefix_hash": self.prefix_hash,
+            "turns": self._turn,
+            "cache_hit_tokens": self.hit_tokens,
+            "cache_miss_tokens": self.miss_tokens,
+            "hit_ratio": self.hit_tokens / total if total else 0.0,
+        }
@@ -0,0 +1,321 @@
+#
+# DataAgent 语音服务 - 会话录制回放
+# 读取 capture.py 录下的会话：查看时间线、导出双方音频，或者把收到的原始消息按原时序
+# 重新喂给和线上相同的管线（run_voice_bot），对比回放和原会话每一轮的耗时
+#
+# 用法:
+#   python replay_capture.py captures/                              # 列出录制的会话
+#   python replay_capture.py captures/20261019-101500-alisa         # 会话时间线
+#   python replay_capture.py captures/20261019-101500-alisa --export out/   # 导出 inbound.wav / outbound.wav
+#   python replay_capture.py captures/20261019-101500-alisa --replay --providers local --speed 2
+#
+# --providers local 时替身 STT 按原会话的转写结果返回，回放结果可复现，适合复现断句和调度问题；
+# real 按 .env 配置调用真实服务，需要 --speed 1
+#
+
+import argparse
+import asyncio
+import io
+import json
+import sys
+import time
+import wave
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from pipecat.frames.frames import CancelFrame, EndFrame, EndTaskFrame, InputAudioRawFrame, StartFrame
+from pipecat.processors.frame_processor import FrameDirection
+from pipecat.runner.types import RunnerArguments
+from pipecat.transports.base_input import BaseInputTransport
+from pipecat.transports.base_transport import BaseTransport, TransportParams
+
+from batch_qa import FRAME_SECS, CaptureOutputTransport, TurnRecorder, local_services, write_wav
+from capture import EVENT, IN_BINARY, IN_TEXT, OUT_AUDIO, iter_session, read_ring
+from eval_endpointing import SAMPLE_RATE
+from serializer import HybridAudioSerializer
+from voice_bot import create_turn_analyzers, create_voice_services, run_voice_bot
+from voice_logging import setup_logging
+
+
+@dataclass
+class RecordedTurn:
+    speech_end: float | None = None
+    transcript: str = ""
+    bot_started: float | None = None
+
+    def e2e_ms(self) -> int | None:
+        if self.speech_end is None or self.bot_started is None:
+            return None
+        return max(round((self.bot_started - self.speech_end) * 1000), 0)
+
+
+@dataclass
+class Session:
+    directory: Path
+    created: float
+    inbound: list[tuple[int, int, bytes]] = field(default_factory=list)
+    events: list[tuple[float, dict]] = field(default_factory=list)
+    outbound_audio: list[tuple[float, bytes]] = field(default_factory=list)
+
+    @classmethod
+    def load(cls, directory: Path) -> "Session":
+        created_ns, _ = read_ring(directory / "inbound.ring")
+        session = cls(directory, created_ns / 1e9)
+        for ts_ns, direction, kind, payload in iter_session(directory):
+            if kind in (IN_BINARY, IN_TEXT):
+                session.inbound.append((ts_ns, kind, payload))
+            elif kind == EVENT:
+                session.events.append((ts_ns / 1e9, json.loads(payload)))
+            elif kind == OUT_AUDIO:
+                session.outbound_audio.append((ts_ns / 1e9, payload))
+        return session
+
+    def turns(self) -> list[RecordedTurn]:
+        """按录下的事件重建每一轮（与 batch_qa.TurnRecorder 的口径一致）"""
+        turns: list[RecordedTurn] = []
+        open_turn: RecordedTurn | None = None
+        vad_stopped = None
+        for ts, event in self.events:
+            name = event["event"]
+            if name == "VADUserStoppedSpeakingFrame":
+                vad_stopped = ts
+            elif name == "UserStartedSpeakingFrame":
+                open_turn = open_turn or RecordedTurn()
+            elif name == "UserStoppedSpeakingFrame":
+                turn, open_turn = open_turn or RecordedTurn(), None
+                turn.speech_end = vad_stopped or ts
+                turns.append(turn)
+            elif name == "TranscriptionFrame":
+                target = open_turn or (turns[-1] if turns else None)
+                if target is None:
+                    target = open_turn = RecordedTurn()
+                target.transcript += event.get("text", "")
+            elif name == "BotStartedSpeakingFrame" and turns:
+                turns[-1].bot_started = turns[-1].bot_started or ts
+        return turns
+
+    def duration(self) -> float:
+        last = [records[-1][0] / 1e9 for records in (self.inbound,) if records]
+        last += [items[-1][0] for items in (self.events, self.outbound_audio) if items]
+        return max(last, default=0.0)
+
+
+def decode_audio(payload: bytes) -> tuple[bytes, int]:
+    """发出的音频带 WAV 头（add_wav_header=True），返回 (PCM, 采样率)"""
+    if payload[:4] == b"RIFF":
+        with wave.open(io.BytesIO(payload)) as wav:
+            return wav.readframes(wav.getnframes()), wav.getframerate()
+    return payload, 0
+
+
+def print_timeline(session: Session):
+    audio_bytes = sum(len(payload) for _, kind, payload in session.inbound if kind == IN_BINARY)
+    outbound = [decode_audio(payload) for _, payload in session.outbound_audio]
+    outbound_secs = sum(len(pcm) / 2 / rate for pcm, rate in outbound if rate)
+    started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(session.created))
+    print(f"📼 {session.directory.name}  started {started}  duration {session.duration():.1f}s")
+    print(f"   inbound: {len(session.inbound)} messages ({audio_bytes / 2 / SAMPLE_RATE:.1f}s audio)")
+    print(f"   outbound: {len(session.outbound_audio)} audio chunks ({outbound_secs:.1f}s)")
+    print()
+    for ts, event in session.events:
+        name = event["event"].removesuffix("Frame")
+        text = f"  {event['text']}" if event.get("text") else ""
+        print(f"{ts:9.3f}s  {name}{text}")
+    print()
+    for index, turn in enumerate(session.turns(), 1):
+        print(f"turn {index}: e2e={turn.e2e_ms()}ms  {turn.transcript}")
+
+
+def export_audio(session: Session, out: Path):
+    """inbound.wav 为收到的原始 PCM（按到达顺序拼接），outbound.wav 为机器人的回答音频"""
+    inbound = b"".join(payload for _, kind, payload in session.inbound if kind == IN_BINARY)
+    write_wav(out / "inbound.wav", inbound, SAMPLE_RATE)
+    chunks = [decode_audio(payload) for _, payload in session.outbound_audio]
+    rate = next((rate for _, rate in chunks if rate), 0)
+    if chunks and rate:
+        write_wav(out / "outbound.wav", b"".join(pcm for pcm, _ in chunks), rate)
+    print(f"💾 Audio exported to {out}")
+
+
+class ReplayInputTransport(BaseInputTransport):
+    """把录下的原始消息按原时序（可加速）经 HybridAudioSerializer 反序列化后推给管线
+
+    消息放完后继续送静音，直到这一会话的问答完成，再结束管线。
+    """
+
+    def __init__(self, transport: "ReplayTransport", params: TransportParams, **kwargs):
+        super().__init__(params, **kwargs)
+        self._transport = transport
+        self._serializer = HybridAudioSerializer()
+        self._feed_task: asyncio.Task | None = None
+
+    async def start(self, frame: StartFrame):
+        await super().start(frame)
+        await self.set_transport_ready(frame)
+        self._feed_task = self.create_task(self._feed())
+
+    async def stop(self, frame: EndFrame):
+        await super().stop(frame)
+        await self._cancel_feed()
+
+    async def cancel(self, frame: CancelFrame):
+        await super().cancel(frame)
+        await self._cancel_feed()
+
+    async def _cancel_feed(self):
+        if self._feed_task:
+            await self.cancel_task(self._feed_task)
+            self._feed_task = None
+
+    async def _feed(self):
+        transport = self._transport
+        await transport._call_event_handler("on_client_connected", None)
+        started = time.monotonic()
+        # 环形文件写满后最早的消息已被覆盖，从保留下来的第一条开始计时
+        first_ns = transport.records[0][0] if transport.records else 0
+        for ts_ns, kind, payload in transport.records:
+            delay = (ts_ns - first_ns) / 1e9 / transport.speed
+            await asyncio.sleep(max(started + delay - time.monotonic(), 0))
+            frame = await self._serializer.deserialize(payload.decode("utf-8") if kind == IN_TEXT else payload)
+            if isinstance(frame, InputAudioRawFrame):
+                await self.push_audio_frame(frame)
+            elif frame:
+                await self.push_frame(frame)
+
+        silence = bytes(int(SAMPLE_RATE * FRAME_SECS) * 2)
+        fed = time.monotonic()
+        while not transport.done() and time.monotonic() - fed < transport.timeout_secs:
+            await self.push_audio_frame(InputAudioRawFrame(audio=silence, sample_rate=SAMPLE_RATE, num_channels=1))
+            await asyncio.sleep(FRAME_SECS / transport.speed)
+        await transport._call_event_handler("on_client_disconnected", None)
+        await self.push_frame(EndTaskFrame(), FrameDirection.UPSTREAM)
+
+
+class ReplayTransport(BaseTransport):
+    """回放一个录制会话的传输层
+
+    Args:
+        records: 收到的原始消息 [(相对时间 ns, 类型, 负载), ...]
+        params: 传输参数（VAD / Smart Turn）
+        done: 返回问答是否已完成的函数
+        speed: 回放倍速
+        timeout_secs: 消息放完后最多再等多久
+    """
+
+    def __init__(self, records, params: TransportParams, done, speed: float = 1.0, timeout_secs: float = 30.0):
+        super().__init__()
+        self.records = records
+        self.done = done
+        self.speed = speed
+        self.timeout_secs = timeout_secs
+        self._input = ReplayInputTransport(self, params)
+        self._output = CaptureOutputTransport(params)
+        self._register_event_handler("on_client_connected")
+        self._register_event_handler("on_client_disconnected")
+
+    def input(self) -> ReplayInputTransport:
+        return self._input
+
+    def output(self) -> CaptureOutputTransport:
+        return self._output
+
+
+async def replay(session: Session, args) -> list[dict]:
+    original = session.turns()
+    vad_analyzer, turn_analyzer = create_turn_analyzers()
+    params = TransportParams(
+        audio_in_enabled=True,
+        audio_out_enabled=True,
+        vad_analyzer=vad_analyzer,
+        turn_analyzer=turn_analyzer if args.smart_turn else None,
+        audio_out_end_silence_secs=0,
+    )
+    recorder = TurnRecorder()
+    transport = ReplayTransport(
+        session.inbound,
+        params,
+        lambda: recorder.idle_secs() >= args.settle_secs,
+        speed=args.speed,
+        timeout_secs=args.turn_timeout,
+    )
+    if args.providers == "local":
+        services = local_services([turn.transcript for turn in original if turn.transcript])
+    else:
+        services = create_voice_services()
+    runner_args = RunnerArguments()
+    runner_args.handle_sigint = False
+    await run_voice_bot(transport, runner_args, args.agent, services=services, observers=[recorder])
+
+    rows = []
+    for index in range(max(len(original), len(recorder.turns))):
+        before = original[index] if index < len(original) else None
+        after = recorder.turns[index].latency_ms() if index < len(recorder.turns) else {}
+        rows.append(
+            {
+                "turn": index + 1,
+                "transcript": before.transcript if before else None,
+                "replay_transcript": recorder.turns[index].transcript if after else None,
+                "e2e_ms": before.e2e_ms() if before else None,
+                "replay_e2e_ms": after.get("e2e_ms"),
+                "replay_stt_ms": after.get("stt_ms"),
+                "replay_llm_ttfb_ms": after.get("llm_ttfb_ms"),
+                "replay_tts_ttfb_ms": after.get("tts_ttfb_ms"),
+            }
+        )
+    return rows
+
+
+def print_comparison(rows: list[dict]):
+    print(f"{'turn':>4}  {'e2e':>7}  {'replay':>7}  {'stt':>6}  {'llm':>6}  {'tts':>6}  transcript")
+    for row in rows:
+        values = [row[key] for key in ("e2e_ms", "replay_e2e_ms", "replay_stt_ms", "replay_llm_ttfb_ms", "replay_tts_ttfb_ms")]
+        cells = "  ".join(f"{'-' if value is None else value:>{width}}" for value, width in zip(values, (7, 7, 6, 6, 6)))
+        transcript = row["transcript"] or ""
+        if row["replay_transcript"] is not None and row["replay_transcript"] != transcript:
+            transcript += f"  → {row['replay_transcript']}"
+        print(f"{row['turn']:>4}  {cells}  {transcript}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="会话录制回放：时间线、音频导出、按原时序重跑管线")
+    parser.add_argument("path", help="会话目录，或录制根目录（列出所有会话）")
+    parser.add_argument("--export", help="导出 inbound.wav / outbound.wav 到这个目录")
+    parser.add_argument("--replay", action="store_true", help="按原时序把收到的消息重新喂给管线")
+    parser.add_argument("--agent", default="alisa", help="回放使用的 Agent ID")
+    parser.add_argument("--providers", choices=["real", "local"], default="local", help="real=按 .env 配置，local=本地替身")
+    parser.add_argument("--speed", type=float, default=1.0, help="回放倍速")
+    parser.add_argument("--settle-secs", type=float, default=2.0, help="机器人说完后再静默多久算回放结束")
+    parser.add_argument("--turn-timeout", type=float, default=30.0, help="消息放完后最多等待多久（秒）")
+    parser.add_argument("--no-smart-turn", dest="smart_turn", action="store_false", help="只用 VAD 断句")
+    parser.add_argument("--json", help="把回放对比结果另存为 JSON")
+    parser.add_argument("--log-level", default="WARNING", help="日志级别")
+    args = parser.parse_args()
+
+    setup_logging(level=args.log_level.upper())
+    path = Path(args.path)
+    if not (path / "inbound.ring").exists():
+        sessions = sorted(p for p in path.iterdir() if (p / "inbound.ring").exists()) if path.is_dir() else []
+        if not sessions:
+            print(f"❌ 没有找到录制: {path}")
+            return 1
+        for directory in sessions:
+            session = Session.load(directory)
+            print(f"{directory.name:<40} {session.duration():7.1f}s  {len(session.turns()):3d} turns")
+        return 0
+
+    session = Session.load(path)
+    print_timeline(session)
+    if args.export:
+        export_audio(session, Path(args.export))
+    if args.replay:
+        print(f"\n🔁 Replaying at {args.speed}x ({args.providers} providers)...")
+        rows = asyncio.run(replay(session, args))
+        print_comparison(rows)
+        if args.json:
+            Path(args.json).write_text(json.dumps(rows, ensure_ascii=False, indent=2), encoding="utf-8")
+            print(f"\n💾 Comparison saved to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
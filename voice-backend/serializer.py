@@ -0,0 +1,203 @@
+#
+# DataAgent 语音服务 - WebSocket 帧序列化
+# 浏览器直接发送原始 PCM 和 JSON 控制消息，播放端需要带 WAV 头的音频，
+# 其他帧沿用 Pipecat 的 Protobuf 格式
+#
+
+import json
+import struct
+
+from pipecat.frames.frames import (
+    Frame,
+    InputAudioRawFrame,
+    InputTransportMessageFrame,
+    OutputAudioRawFrame,
+    OutputTransportMessageFrame,
+    OutputTransportMessageUrgentFrame,
+)
+from pipecat.serializers.base_serializer import FrameSerializer, FrameSerializerType
+from pipecat.serializers.protobuf import ProtobufFrameSerializer
+
+# 标准 44 字节 PCM WAV 头
+_WAV_HEADER = struct.Struct("<4sI4s4sIHHIIHH4sI")
+WAV_HEADER_SIZE = _WAV_HEADER.size
+
+# Pipecat frames.proto 中 Frame 的 oneof 字段（text=1 / audio=2 / transcription=3 / message=4）的标签字节
+_PROTOBUF_TAGS = frozenset((0x0A, 0x12, 0x1A, 0x22))
+
+
+def _looks_like_protobuf(data: bytes) -> bool:
+    """Protobuf 的 Frame 是「标签 + varint 长度 + 子消息」，长度正好覆盖剩余字节；
+    原始 PCM 几乎不可能满足，这样不必对每个音频包都尝试解析一遍"""
+    if len(data) < 2 or data[0] not in _PROTOBUF_TAGS:
+        return False
+    length, shift, index = 0, 0, 1
+    while index < len(data) and index < 6:
+        byte = data[index]
+        length |= (byte & 0x7F) << shift
+        index += 1
+        if not byte & 0x80:
+            return index + length == len(data)
+        shift += 7
+    return False
+
+
+class WavFrameBuffer:
+    """每个会话复用的 WAV 帧缓冲区
+
+    WAV 头和 PCM 写进同一块预分配的 bytearray：头部只在采样率、声道数或长度变化时重写，
+    PCM 直接拷进头部之后的位置，返回的 memoryview 在下一次 wrap() 之前有效。
+    websockets 在 send() 里同步把负载拷进 WebSocket 帧，发送返回后即可复用。
+
+    Args:
+        capacity: 初始容量（PCM 字节数），遇到更大的帧时自动扩容
+    """
+
+    def __init__(self, capacity: int = 8192):
+        self._buffer = bytearray(WAV_HEADER_SIZE + capacity)
+        self._format: tuple[int, int, int] | None = None
+        self._body: memoryview | None = None
+        self._payload: memoryview | None = None
+
+    def wrap(self, pcm, sample_rate: int, num_channels: int) -> memoryview:
+        size = len(pcm)
+        if self._format != (sample_rate, num_channels, size):
+            self._reformat(size, sample_rate, num_channels)
+        self._body[:] = pcm
+        return self._payload
+
+    def _reformat(self, size: int, sample_rate: int, num_channels: int):
+        # 格式或长度变化时才重写头部和切片（TTS 输出按固定块长切分，通常只在每段结尾的短块发生）
+        if self._payload is not None:
+            self._body.release()
+            self._payload.release()
+        if WAV_HEADER_SIZE + size > len(self._buffer):
+            self._buffer = bytearray(WAV_HEADER_SIZE + size)
+        _WAV_HEADER.pack_into(
+            self._buffer,
+            0,
+            b"RIFF",
+            36 + size,
+            b"WAVE",
+            b"fmt ",
+            16,
+            1,
+            num_channels,
+            sample_rate,
+            sample_rate * num_channels * 2,
+            num_channels * 2,
+            16,
+            b"data",
+            size,
+        )
+        view = memoryview(self._buffer)
+        self._body = view[WAV_HEADER_SIZE : WAV_HEADER_SIZE + size]
+        self._payload = view[: WAV_HEADER_SIZE + size]
+        view.release()
+        self._format = (sample_rate, num_channels, size)
+
+
+class HybridAudioSerializer(FrameSerializer):
+    """混合序列化器：音频帧直接发送原始 WAV 数据，其他帧使用 Protobuf，输入接受原始 PCM
+
+    设置了 capture（capture.SessionCapture）时，收发的原始消息同时写入会话录制。
+    输出传输层可以用 serialize_pcm() 在复用的缓冲区里拼 WAV 头，不必每帧新建帧对象和字节串。
+    """
+    def __init__(self):
+        self.protobuf_serializer = ProtobufFrameSerializer()
+        self.capture = None
+        self.wav_buffer = WavFrameBuffer()
+
+    @property
+    def type(self) -> FrameSerializerType:
+        return FrameSerializerType.BINARY
+
+    async def serialize(self, frame: Frame) -> bytes | str | None:
+        # 音频帧直接返回原始音频数据（已经包含 WAV 头，因为 add_wav_header=True）
+        if isinstance(frame, OutputAudioRawFrame):
+            if self.capture:
+                self.capture.outbound(frame.audio, audio=True)
+            return frame.audio
+
+        # 发给客户端的控制消息（agent_switched 等）以 JSON 文本发送，前端直接 JSON.parse
+        if isinstance(frame, (OutputTransportMessageFrame, OutputTransportMessageUrgentFrame)):
+            message = frame.message if isinstance(frame.message, str) else json.dumps(frame.message, ensure_ascii=False)
+            if self.capture:
+                self.capture.outbound(message.encode("utf-8"), audio=False)
+            return message
+
+        # 跳过不可序列化的帧（如 InterruptionFrame），这些帧不需要发送到前端
+        try:
+            # 其他帧使用 Protobuf 序列化
+            data = await self.protobuf_serializer.serialize(frame)
+        except Exception:
+            # 如果序列化失败（如 InterruptionFrame），返回 None 跳过
+            # 这些帧通常不需要发送到客户端
+            return None
+        if data and self.capture:
+            self.capture.outbound(data, audio=False)
+        return data
+
+    def serialize_messages(self, messages: list[str]) -> str:
+        """把合批的控制消息（已编码的 JSON 文本）拼成一条：多条为 JSON 数组，一条保持原样"""
+        text = messages[0] if len(messages) == 1 else "[" + ",".join(messages) + "]"
+        if self.capture:
+            self.capture.outbound(text.encode("utf-8"), audio=False)
+        return text
+
+    def serialize_pcm(self, pcm, sample_rate: int, num_channels: int) -> memoryview:
+        """把一帧 PCM 加上 WAV 头，返回复用缓冲区上的 memoryview（下一次调用前有效）"""
+        payload = self.wav_buffer.wrap(pcm, sample_rate, num_channels)
+        if self.capture:
+            self.capture.outbound(payload, audio=True)
+        return payload
+
+    async def deserialize(self, data: bytes | str) -> Frame | None:
+        if self.capture:
+            self.capture.inbound(data)
+
+        # 文本消息（WebSocket text frame）：JSON 控制消息，如切换 Agent
+        if isinstance(data, str):
+            return self._control_message(data)
+
+        # 形似 Protobuf 帧时才尝试反序列化（处理文本消息等），原始 PCM 直接跳过
+        if _looks_like_protobuf(data):
+            try:
+                frame = await self.protobuf_serializer.deserialize(data)
+                if frame:
+                    return frame
+            except Exception:
+                # Protobuf 反序列化失败，继续尝试其他格式
+                pass
+
+        # 如果 Protobuf 反序列化失败，假设是原始 PCM 数据
+        # 检查是否是有效的 PCM 数据（至少要有一些数据）
+        if len(data) < 2:
+            return None
+
+        # 检查是否是文本消息（JSON 格式），只看首字节，避免对每个音频包整体解码
+        if data[:8].lstrip()[:1] == b'{':
+            try:
+                # 以二进制发送的 JSON 控制消息
+                return self._control_message(data.decode('utf-8'))
+            except UnicodeDecodeError:
+                # 不是文本，继续处理为 PCM
+                pass
+
+        # 假设是原始 PCM 16-bit 数据
+        # 创建 InputAudioRawFrame
+        return InputAudioRawFrame(
+            audio=data,
+            num_channels=1,
+            sample_rate=16000  # 前端发送的采样率
+        )
+
+    @staticmethod
+    def _control_message(text: str) -> Frame | None:
+        try:
+            message = json.loads(text)
+        except ValueError:
+            return None
+        if not isinstance(message, dict) or "type" not in message:
+            return None
+        return InputTransportMessageFrame(message=message)
@@ -0,0 +1,321 @@
+#
+# DataAgent 语音服务 - 本地替身服务
+# 不联网、不计费的 STT / LLM / TTS 替身，行为和真实服务一样走管线的帧协议和指标，
+# 用于批量评测、CI 和压测：延迟可配置，输出可复现
+#
+
+import asyncio
+import json
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator
+
+import numpy as np
+from aiohttp import WSMsgType, web
+
+from pipecat.frames.frames import (
+    ErrorFrame,
+    Frame,
+    LLMTextFrame,
+    TranscriptionFrame,
+    TTSAudioRawFrame,
+    TTSStartedFrame,
+    TTSStoppedFrame,
+)
+from pipecat.metrics.metrics import LLMTokenUsage
+from pipecat.services.openai.llm import OpenAILLMService
+from pipecat.services.stt_service import SegmentedSTTService
+from pipecat.services.tts_service import TTSService
+from pipecat.transcriptions.language import Language
+from pipecat.utils.time import time_now_iso8601
+
+DEFAULT_ANSWER = "好的，{question}这个问题我看了一下。销售额120万，比上周增长10%，表现不错。"
+
+
+class ScriptedSTTService(SegmentedSTTService):
+    """按 VAD 切出的每段语音依次返回预先给定的转写文本
+
+    文本用完后返回 fallback（默认按音频时长生成占位文本）。
+
+    Args:
+        transcripts: 每段语音对应的转写文本
+        latency_secs: 模拟的识别耗时
+        fallback: 文本用完后的转写，None 表示使用占位文本
+    """
+
+    def __init__(
+        self, transcripts: list[str] | None = None, latency_secs: float = 0.15, fallback: str | None = None, **kwargs
+    ):
+        super().__init__(**kwargs)
+        self._transcripts = list(transcripts or [])
+        self._latency_secs = latency_secs
+        self._fallback = fallback
+
+    def can_generate_metrics(self) -> bool:
+        return True
+
+    async def run_stt(self, audio: bytes) -> AsyncGenerator[Frame, None]:
+        await self.start_ttfb_metrics()
+        await asyncio.sleep(self._latency_secs)
+        if self._transcripts:
+            text = self._transcripts.pop(0)
+        else:
+            secs = max(len(audio) - 44, 0) / 2 / self.sample_rate
+            text = self._fallback if self._fallback is not None else f"（{secs:.1f} 秒语音）"
+        await self.stop_ttfb_metrics()
+        yield TranscriptionFrame(text, "", time_now_iso8601(), Language.ZH)
+
+
+class EchoLLMService(OpenAILLMService):
+    """流式返回固定模板回答的 LLM 替身
+
+    回答由 answer 模板和最后一条用户消息生成，按 chunk_chars 个字分片、
+    每片间隔 token_secs 推送，首片前等待 ttfb_secs；token 用量按字数估算。
+    继承 OpenAILLMService 只为复用上下文帧处理和指标，不会发出网络请求。
+
+    Args:
+        answer: 回答模板，{question} 替换为最后一条用户消息
+        ttfb_secs: 首 token 延迟
+        token_secs: 每片间隔
+        chunk_chars: 每片字数
+    """
+
+    def __init__(
+        self,
+        answer: str = DEFAULT_ANSWER,
+        ttfb_secs: float = 0.3,
+        token_secs: float = 0.02,
+        chunk_chars: int = 4,
+        **kwargs,
+    ):
+        super().__init__(api_key="local", model="echo", **kwargs)
+        self._answer = answer
+        self._ttfb_secs = ttfb_secs
+        self._token_secs = token_secs
+        self._chunk_chars = max(chunk_chars, 1)
+
+    async def _process_context(self, context):
+        messages = context.get_messages()
+        question = next(
+            (m.get("content") for m in reversed(messages) if m.get("role") == "user" and isinstance(m.get("content"), str)),
+            "",
+        )
+        answer = self._answer.format(question=question.strip())
+
+        await self.start_ttfb_metrics()
+        await asyncio.sleep(self._ttfb_secs)
+        for index in range(0, len(answer), self._chunk_chars):
+            if index:
+                await asyncio.sleep(self._token_secs)
+            else:
+                await self.stop_ttfb_metrics()
+            await self.push_frame(LLMTextFrame(answer[index : index + self._chunk_chars]))
+
+        prompt_chars = sum(len(m.get("content") or "") for m in messages if isinstance(m.get("content"), str))
+        await self.start_llm_usage_metrics(
+            LLMTokenUsage(
+                prompt_tokens=prompt_chars,
+                completion_tokens=len(answer),
+                total_tokens=prompt_chars + len(answer),
+            )
+        )
+
+
+class ToneTTSService(TTSService):
+    """把文本合成为一段轻微的正弦音的 TTS 替身
+
+    时长按 chars_per_sec 估算，音频按 chunk_secs 分片流式返回，首片前等待 ttfb_secs；
+    rtf 小于 1 时按合成速度放慢分片间隔（0 表示不限速）。
+
+    Args:
+        ttfb_secs: 首包延迟
+        chars_per_sec: 语速（每秒字数）
+        chunk_secs: 每个音频分片的时长
+        rtf: 实时率（合成耗时 / 音频时长）
+    """
+
+    def __init__(
+        self,
+        ttfb_secs: float = 0.2,
+        chars_per_sec: float = 5.0,
+        chunk_secs: float = 0.1,
+        rtf: float = 0.0,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self._ttfb_secs = ttfb_secs
+        self._chars_per_sec = chars_per_sec
+        self._chunk_secs = chunk_secs
+        self._rtf = rtf
+
+    def can_generate_metrics(self) -> bool:
+        return True
+
+    async def run_tts(self, text: str) -> AsyncGenerator[Frame, None]:
+        if not text.strip():
+            yield ErrorFrame(error="empty text")
+            return
+        await self.start_ttfb_metrics()
+        await self.start_tts_usage_metrics(text)
+        yield TTSStartedFrame()
+        await asyncio.sleep(self._ttfb_secs)
+        samples = tone(len(text) / self._chars_per_sec, self.sample_rate)
+        chunk = max(int(self._chunk_secs * self.sample_rate), 1)
+        for index in range(0, len(samples), chunk):
+            if index:
+                await asyncio.sleep(self._chunk_secs * self._rtf)
+            else:
+                await self.stop_ttfb_metrics()
+            yield TTSAudioRawFrame(samples[index : index + chunk].tobytes(), self.sample_rate, 1)
+        yield TTSStoppedFrame()
+
+
+def tone(secs: float, sample_rate: int, frequency: float = 220.0, amplitude: int = 2000) -> np.ndarray:
+    """生成一段 16-bit 单声道正弦音"""
+    t = np.arange(int(secs * sample_rate)) / sample_rate
+    return (amplitude * np.sin(2 * math.pi * frequency * t)).astype(np.int16)
+
+
+class ProviderStandinServer:
+    """本地 HTTP / WebSocket 服务，模拟服务商接口，供 probe_providers.py 在 CI 中测量
+
+    - POST /v1/chat/completions：OpenAI 兼容的流式对话（DeepSeek），回答按 chunk_chars 字分片
+    - GET /v1/listen：Deepgram 流式识别，每收到 1 秒音频返回一条中间结果，CloseStream 后返回最终结果并关闭
+    - POST /v1/speak：Deepgram HTTP TTS，按文本长度返回正弦音 PCM，按 chunk_secs 分片
+
+    首包延迟随同时进行的请求数线性增加（ttfb_secs × (1 + load_factor × (并发数 - 1))），
+    超过 capacity 个并发请求时返回 429，用来模拟服务商在压力下变慢和限流。
+
+    Args:
+        ttfb_secs: 空闲时的首包延迟
+        token_secs: LLM 每片 / TTS 每个音频分片的间隔
+        chunk_chars: LLM 每片字数
+        chunk_secs: TTS 每个音频分片的时长
+        capacity: 并发请求上限
+        load_factor: 每多一个并发请求，首包延迟增加的比例
+    """
+
+    def __init__(
+        self,
+        ttfb_secs: float = 0.05,
+        token_secs: float = 0.01,
+        chunk_chars: int = 4,
+        chunk_secs: float = 0.1,
+        capacity: int = 8,
+        load_factor: float = 0.1,
+    ):
+        self._ttfb_secs = ttfb_secs
+        self._token_secs = token_secs
+        self._chunk_chars = max(chunk_chars, 1)
+        self._chunk_secs = chunk_secs
+        self._capacity = capacity
+        self._load_factor = load_factor
+        self._active = 0
+        self._runner: web.AppRunner | None = None
+        self.port = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def start(self, port: int = 0):
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self._chat)
+        app.router.add_get("/v1/listen", self._listen)
+        app.router.add_post("/v1/speak", self._speak)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    @asynccontextmanager
+    async def _slot(self):
+        """占用一个并发名额并模拟首包延迟，满载时产出 False
+
+        名额在同一个 try/finally 里归还：客户端在首包延迟期间断开（处理函数被取消）也不会泄漏。
+        """
+        if self._active >= self._capacity:
+            yield False
+            return
+        self._active += 1
+        try:
+            await asyncio.sleep(self._ttfb_secs * (1 + self._load_factor * (self._active - 1)))
+            yield True
+        finally:
+            self._active -= 1
+
+    async def _chat(self, request: web.Request) -> web.StreamResponse:
+        async with self._slot() as admitted:
+            if not admitted:
+                return web.json_response({"error": {"message": "rate limited"}}, status=429)
+            body = await request.json()
+            question = body["messages"][-1]["content"]
+            answer = DEFAULT_ANSWER.format(question=question)[: body.get("max_tokens") or None]
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await response.prepare(request)
+            for index in range(0, len(answer), self._chunk_chars):
+                if index:
+                    await asyncio.sleep(self._token_secs)
+                delta = {"choices": [{"index": 0, "delta": {"content": answer[index : index + self._chunk_chars]}}]}
+                await response.write(f"data: {json.dumps(delta, ensure_ascii=False)}\n\n".encode("utf-8"))
+            await response.write(b"data: [DONE]\n\n")
+            await response.write_eof()
+            return response
+
+    async def _listen(self, request: web.Request) -> web.WebSocketResponse:
+        async with self._slot() as admitted:
+            if not admitted:
+                raise web.HTTPTooManyRequests()
+            sample_rate = int(request.query.get("sample_rate", "16000"))
+            ws = web.WebSocketResponse()
+            await ws.prepare(request)
+            received = 0
+            reported = 0
+            started = time.monotonic()
+            async for message in ws:
+                if message.type == WSMsgType.BINARY:
+                    received += len(message.data)
+                    if received // (2 * sample_rate) > reported:
+                        reported += 1
+                        await ws.send_json(self._results(reported, started, final=False))
+                elif message.type == WSMsgType.TEXT and json.loads(message.data).get("type") == "CloseStream":
+                    await asyncio.sleep(self._ttfb_secs)
+                    await ws.send_json(self._results(received / 2 / sample_rate, started, final=True))
+                    await ws.send_json({"type": "Metadata", "duration": received / 2 / sample_rate})
+                    break
+            await ws.close()
+            return ws
+
+    @staticmethod
+    def _results(duration: float, started: float, final: bool) -> dict:
+        return {
+            "type": "Results",
+            "duration": duration,
+            "is_final": final,
+            "speech_final": final,
+            "channel": {"alternatives": [{"transcript": "上周销售额多少" if final else "上周", "confidence": 0.9}]},
+            "elapsed": round(time.monotonic() - started, 3),
+        }
+
+    async def _speak(self, request: web.Request) -> web.StreamResponse:
+        async with self._slot() as admitted:
+            if not admitted:
+                return web.json_response({"err_msg": "rate limited"}, status=429)
+            sample_rate = int(request.query.get("sample_rate", "24000"))
+            text = (await request.json())["text"]
+            samples = tone(len(text) / 5.0, sample_rate)
+            chunk = max(int(self._chunk_secs * sample_rate), 1)
+            response = web.StreamResponse(headers={"Content-Type": "application/octet-stream"})
+            await response.prepare(request)
+            for index in range(0, len(samples), chunk):
+                if index:
+                    await asyncio.sleep(self._token_secs)
+                await response.write(samples[index : index + chunk].tobytes())
+            await response.write_eof()
+            return response
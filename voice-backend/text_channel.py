@@ -0,0 +1,177 @@
+#
+# DataAgent 语音服务 - 文字通道
+# 语音通话中打字追问不再走 server.js 代理：客户端在同一条 WebSocket 上发 {"type": "text_input", ...}，
+# 文字直接加进本会话的 LLMContext（跳过 STT），回答以文字增量流式发回，可选同时朗读。
+# 文字和语音共用同一个会话的上下文、Agent 人设、缓存前缀和服务商连接
+#
+
+import itertools
+import time
+from collections import deque
+
+from loguru import logger
+
+from pipecat.frames.frames import (
+    Frame,
+    InputTransportMessageFrame,
+    InterruptionFrame,
+    LLMConfigureOutputFrame,
+    LLMFullResponseEndFrame,
+    LLMFullResponseStartFrame,
+    LLMMessagesAppendFrame,
+    LLMTextFrame,
+    OutputTransportMessageFrame,
+)
+from pipecat.processors.frame_processor import FrameDirection, FrameProcessor
+
+TEXT_INPUT_MESSAGE_TYPE = "text_input"
+_MAX_TEXT_CHARS = 2000
+
+
+class TextChannel:
+    """一个会话的文字通道：记录等待回答的文字请求，统计首字延迟
+
+    handler() 处理客户端的 text_input 消息（须在 RTVI 之前），streamer() 放在 LLM 之后，
+    把由文字请求触发的回答以 text_delta / text_done 发回客户端。
+
+    客户端消息：{"type": "text_input", "text": "...", "id": "可选", "speak": false}
+    服务端回复：{"type": "text_delta", "id": ..., "text": "片段"}（参与控制消息合批），
+    结束时 {"type": "text_done", "id": ..., "text": "完整回答", "interrupted": false}
+    """
+
+    def __init__(self, transport):
+        self._transport = transport
+        self._ids = itertools.count(1)
+        self._pending: deque[tuple[str, float]] = deque()
+        self._active: tuple[str, float] | None = None
+        self._parts: list[str] = []
+        self._own_interruption = False
+        self.requests = 0
+        self.interrupted = 0
+        self._ttft_ms: list[float] = []
+
+    async def send(self, message: dict):
+        output_transport = self._transport.output()
+        if hasattr(output_transport, "send_message"):
+            await output_transport.send_message(OutputTransportMessageFrame(message=message))
+
+    def expect_interruption(self):
+        """文字请求先打断当前回答；这次打断不能清掉随后提交的请求"""
+        self._own_interruption = True
+
+    def submit(self, request_id: str | None) -> str:
+        request_id = request_id or f"t{next(self._ids)}"
+        self._pending.clear()
+        self._pending.append((request_id, time.monotonic()))
+        self.requests += 1
+        return request_id
+
+    async def on_response_start(self):
+        if self._active is None and self._pending:
+            self._active = self._pending.popleft()
+            self._parts = []
+
+    async def on_text(self, text: str):
+        if self._active is None:
+            return
+        request_id, started = self._active
+        if not self._parts:
+            self._ttft_ms.append((time.monotonic() - started) * 1000)
+        self._parts.append(text)
+        await self.send({"type": "text_delta", "id": request_id, "text": text})
+
+    async def on_response_end(self):
+        # 只有函数调用、没有文字的那次响应不算结束，等调用结果回来后的下一次响应
+        if self._active is not None and self._parts:
+            await self._done(interrupted=False)
+
+    async def on_interruption(self):
+        # 用户开口打断时，还没开始回答的文字请求也作废
+        if self._own_interruption:
+            self._own_interruption = False
+        else:
+            self._pending.clear()
+        if self._active is not None:
+            self.interrupted += 1
+            await self._done(interrupted=True)
+
+    async def _done(self, interrupted: bool):
+        request_id, _ = self._active
+        self._active = None
+        await self.send({"type": "text_done", "id": request_id, "text": "".join(self._parts), "interrupted": interrupted})
+        self._parts = []
+
+    def stats(self) -> dict:
+        ttft = sorted(self._ttft_ms)
+        return {
+            "requests": self.requests,
+            "interrupted": self.interrupted,
+            "ttft_p50_ms": round(ttft[len(ttft) // 2]) if ttft else None,
+        }
+
+    def handler(self) -> "TextInputHandler":
+        return TextInputHandler(self)
+
+    def streamer(self) -> "TextReplyStreamer":
+        return TextReplyStreamer(self)
+
+
+class TextInputHandler(FrameProcessor):
+    """把客户端的 text_input 变成一轮用户输入（须在 RTVI 之前）
+
+    与 RTVI 的 send-text 相同：先打断正在进行的回答，不朗读时用 LLMConfigureOutputFrame
+    让这一轮的 LLM 文本带上 skip_tts，追加用户消息并触发 LLM，再恢复朗读。
+    """
+
+    def __init__(self, channel: TextChannel):
+        super().__init__()
+        self._channel = channel
+
+    async def process_frame(self, frame: Frame, direction: FrameDirection):
+        await super().process_frame(frame, direction)
+
+        message = frame.message if isinstance(frame, InputTransportMessageFrame) else None
+        if isinstance(message, dict) and message.get("type") == TEXT_INPUT_MESSAGE_TYPE:
+            await self._handle(message)
+            return
+
+        await self.push_frame(frame, direction)
+
+    async def _handle(self, message: dict):
+        text = str(message.get("text") or "").strip()[:_MAX_TEXT_CHARS]
+        if not text:
+            logger.warning("⚠️ Empty text_input ignored")
+            return
+        self._channel.expect_interruption()
+        await self.push_interruption_task_frame_and_wait()
+        request_id = self._channel.submit(str(message["id"]) if message.get("id") else None)
+        speak = bool(message.get("speak", False))
+        logger.info(f"⌨️ Text input {request_id} ({len(text)} chars, speak={speak})")
+        if not speak:
+            await self.push_frame(LLMConfigureOutputFrame(skip_tts=True))
+        await self.push_frame(LLMMessagesAppendFrame(messages=[{"role": "user", "content": text}], run_llm=True))
+        if not speak:
+            await self.push_frame(LLMConfigureOutputFrame(skip_tts=False))
+
+
+class TextReplyStreamer(FrameProcessor):
+    """放在 LLM 之后：文字请求触发的回答逐段发回客户端"""
+
+    def __init__(self, channel: TextChannel):
+        super().__init__()
+        self._channel = channel
+
+    async def process_frame(self, frame: Frame, direction: FrameDirection):
+        await super().process_frame(frame, direction)
+
+        if isinstance(frame, InterruptionFrame):
+            await self._channel.on_interruption()
+        elif direction == FrameDirection.DOWNSTREAM:
+            if isinstance(frame, LLMFullResponseStartFrame):
+                await self._channel.on_response_start()
+            elif isinstance(frame, LLMTextFrame):
+                await self._channel.on_text(frame.text)
+            elif isinstance(frame, LLMFullResponseEndFrame):
+                await self._channel.on_response_end()
+
+        await self.push_frame(frame, direction)
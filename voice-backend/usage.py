@@ -0,0 +1,297 @@
+#
+# DataAgent 语音服务 - 用量与成本统计
+# PipelineTask 开启了 enable_usage_metrics，LLM token 数和 TTS 字符数以 MetricsFrame 流过管线后就丢了。
+# 这里把它们连同发给 STT 的音频秒数，按「会话 + Agent + 服务商」在内存里累加，
+# 定期由后台线程批量写入本地 SQLite，usage_report.py 负责查询和汇总
+#
+
+import asyncio
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable
+
+from loguru import logger
+
+from pipecat.frames.frames import CancelFrame, EndFrame, Frame, MetricsFrame, StartFrame
+from pipecat.metrics.metrics import LLMUsageMetricsData, TTSUsageMetricsData
+from pipecat.processors.frame_processor import FrameDirection, FrameProcessor
+
+from paths import data_path
+
+# 各服务商的计量项（单位）
+METRICS = {
+    "llm": ("requests", "prompt_tokens", "cache_hit_tokens", "completion_tokens"),
+    "tts": ("requests", "characters"),
+    "stt": ("audio_secs",),
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    session_id TEXT NOT NULL,
+    agent_id TEXT NOT NULL,
+    provider TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value REAL NOT NULL,
+    started REAL NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (session_id, agent_id, provider, metric)
+) WITHOUT ROWID
+"""
+
+_UPSERT = """
+INSERT INTO usage (session_id, agent_id, provider, metric, value, started, updated)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (session_id, agent_id, provider, metric)
+DO UPDATE SET value = value + excluded.value, updated = excluded.updated
+"""
+
+
+class UsageStore:
+    """本地 SQLite 用量库：每个 (会话, Agent, 服务商, 计量项) 一行，写入时累加"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        with self._connect() as db:
+            db.execute(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=5)
+
+    def write(self, rows: list[tuple]):
+        """rows: (session_id, agent_id, provider, metric, value, started, updated)"""
+        with self._lock, self._connect() as db:
+            db.executemany(_UPSERT, rows)
+
+    def query(self, group_by: list[str], since: float | None = None, until: float | None = None) -> list[dict]:
+        """按给定列汇总，每组一行：{列..., "provider", "metric", "value", "sessions"}"""
+        columns = ", ".join(group_by)
+        where, params = [], []
+        if since is not None:
+            where.append("updated >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("started < ?")
+            params.append(until)
+        sql = (
+            f"SELECT {columns + ', ' if columns else ''}provider, metric, SUM(value), COUNT(DISTINCT session_id) "
+            f"FROM usage {'WHERE ' + ' AND '.join(where) if where else ''} "
+            f"GROUP BY {columns + ', ' if columns else ''}provider, metric ORDER BY {columns + ', ' if columns else ''}provider"
+        )
+        with self._connect() as db:
+            rows = db.execute(sql, params).fetchall()
+        keys = [*group_by, "provider", "metric", "value", "sessions"]
+        return [dict(zip(keys, row)) for row in rows]
+
+
+class UsageLedger:
+    """进程内共享的用量账本
+
+    管线里只做字典累加；flush() 把累计的增量交给后台线程写库，
+    写库失败时增量放回内存，下次一起写。
+
+    Args:
+        store: 本地用量库，None 时只在内存里统计
+        flush_secs: 定期写库的间隔
+    """
+
+    def __init__(self, store: UsageStore | None = None, flush_secs: float = 30.0):
+        self.store = store
+        self.flush_secs = flush_secs
+        self._pending: dict[tuple[str, str, str, str], list[float]] = {}
+        self._totals: dict[tuple[str, str, str, str], float] = {}
+        self._flush_task: asyncio.Task | None = None
+        self._flush_lock = asyncio.Lock()
+
+    def add(self, session_id: str, agent_id: str, provider: str, metric: str, value: float):
+        if not value:
+            return
+        now = time.time()
+        key = (session_id, agent_id, provider, metric)
+        entry = self._pending.get(key)
+        if entry is None:
+            self._pending[key] = [value, now, now]
+        else:
+            entry[0] += value
+            entry[2] = now
+        self._totals[key] = self._totals.get(key, 0.0) + value
+
+    def session_summary(self, session_id: str) -> dict:
+        """本进程内某个会话的累计用量：{服务商: {计量项: 值}}"""
+        summary: dict[str, dict[str, float]] = {}
+        for (session, _, provider, metric), value in self._totals.items():
+            if session == session_id:
+                provider_usage = summary.setdefault(provider, {})
+                provider_usage[metric] = round(provider_usage.get(metric, 0.0) + value, 2)
+        return summary
+
+    def forget(self, session_id: str):
+        """会话结束后丢掉内存里的累计值（已写库的数据不受影响）"""
+        self._totals = {key: value for key, value in self._totals.items() if key[0] != session_id}
+
+    async def flush(self):
+        if not self.store or not self._pending:
+            return
+        async with self._flush_lock:
+            pending, self._pending = self._pending, {}
+            rows = [(*key, value, started, updated) for key, (value, started, updated) in pending.items()]
+            try:
+                await asyncio.to_thread(self.store.write, rows)
+            except Exception as e:
+                logger.warning(f"⚠️ Usage flush failed, will retry: {e!r}")
+                for key, (value, started, updated) in pending.items():
+                    entry = self._pending.setdefault(key, [0.0, started, updated])
+                    entry[0] += value
+                    entry[1] = min(entry[1], started)
+
+    def flush_sync(self):
+        """进程退出时同步写库"""
+        if self.store and self._pending:
+            pending, self._pending = self._pending, {}
+            self.store.write([(*key, *entry) for key, entry in pending.items()])
+
+    def start(self):
+        if self.store and not self._flush_task:
+            self._flush_task = asyncio.get_running_loop().create_task(
+                self._flush_loop(), name="UsageLedger::_flush_loop"
+            )
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_secs)
+            await self.flush()
+
+
+def usage_db_path() -> str:
+    """用量库路径（USAGE_DB，默认本目录下的 usage.db），为空表示不落库"""
+    return data_path("USAGE_DB", "usage.db")
+
+
+_LEDGER: UsageLedger | None = None
+
+
+def get_usage_ledger() -> UsageLedger:
+    """进程内唯一的用量账本（首次使用时按环境变量创建，USAGE_DB 为空时只在内存里统计）"""
+    global _LEDGER
+    if _LEDGER is None:
+        path = usage_db_path()
+        _LEDGER = UsageLedger(
+            store=UsageStore(path) if path else None,
+            flush_secs=float(os.getenv("USAGE_FLUSH_SECS", "30")),
+        )
+        atexit.register(_LEDGER.flush_sync)
+    return _LEDGER
+
+
+class UsageTracker(FrameProcessor):
+    """放在 TTS 之后，把 LLM / TTS 的用量 MetricsFrame 记到账本上，所有帧原样透传
+
+    LLM 和 TTS 的 MetricsFrame 都向下游流动，这个位置能同时看到两者。
+    STT 按发给服务商的音频时长计费，由 stt_audio_secs 提供（静音抑制后的累计秒数），
+    在切换 Agent 和会话结束时记入差值。
+
+    Args:
+        agent_id: 当前 Agent（切换 Agent 时由 AgentSwitcher 更新）
+        providers: 处理器 -> (服务商名称, 类别)，类别为 llm / tts
+        stt_provider: STT 服务商名称
+        stt_audio_secs: 返回发给 STT 的累计音频秒数的函数（可选）
+        ledger: 用量账本，默认使用进程内共享的实例
+    """
+
+    def __init__(
+        self,
+        agent_id: str,
+        providers: dict[FrameProcessor, tuple[str, str]],
+        stt_provider: str = "deepgram-stt",
+        stt_audio_secs: Callable[[], float] | None = None,
+        ledger: UsageLedger | None = None,
+    ):
+        super().__init__()
+        self._agent_id = agent_id
+        self.session_id = uuid.uuid4().hex[:12]
+        self._providers = {processor.name: provider for processor, provider in providers.items()}
+        self._stt_provider = stt_provider
+        self._stt_audio_secs = stt_audio_secs
+        self._stt_recorded = 0.0
+        self._ledger = ledger or get_usage_ledger()
+
+    @property
+    def agent_id(self) -> str:
+        return self._agent_id
+
+    @agent_id.setter
+    def agent_id(self, agent_id: str):
+        # 切换前的 STT 用量记在原来的 Agent 上
+        self._record_stt()
+        self._agent_id = agent_id
+
+    async def process_frame(self, frame: Frame, direction: FrameDirection):
+        await super().process_frame(frame, direction)
+
+        if isinstance(frame, StartFrame):
+            self._ledger.start()
+        elif isinstance(frame, MetricsFrame):
+            for data in frame.data:
+                if isinstance(data, (LLMUsageMetricsData, TTSUsageMetricsData)):
+                    self._record(data)
+        elif isinstance(frame, (EndFrame, CancelFrame)):
+            self._record_stt()
+            await self._ledger.flush()
+
+        await self.push_frame(frame, direction)
+
+    def _record(self, data: LLMUsageMetricsData | TTSUsageMetricsData):
+        kind = "llm" if isinstance(data, LLMUsageMetricsData) else "tts"
+        provider, kind = self._providers.get(data.processor, (data.processor, kind))
+        add = self._ledger.add
+        add(self.session_id, self.agent_id, provider, "requests", 1)
+        if kind == "llm":
+            usage = data.value
+            add(self.session_id, self.agent_id, provider, "prompt_tokens", usage.prompt_tokens)
+            add(self.session_id, self.agent_id, provider, "cache_hit_tokens", usage.cache_read_input_tokens or 0)
+            add(self.session_id, self.agent_id, provider, "completion_tokens", usage.completion_tokens)
+        else:
+            add(self.session_id, self.agent_id, provider, "characters", data.value)
+
+    def _record_stt(self):
+        if not self._stt_audio_secs:
+            return
+        total = self._stt_audio_secs()
+        self._ledger.add(self.session_id, self.agent_id, self._stt_provider, "audio_secs", total - self._stt_recorded)
+        self._stt_recorded = total
+
+    async def end_session(self) -> dict:
+        """客户端断开时调用：记入 STT 用量、写库，返回本会话汇总并开始新会话"""
+        self._record_stt()
+        await self._ledger.flush()
+        summary = self._ledger.session_summary(self.session_id)
+        self._ledger.forget(self.session_id)
+        self.session_id = uuid.uuid4().hex[:12]
+        return summary
+
+
+def load_prices(value: str | None = None) -> dict[str, dict[str, float]]:
+    """读取单价配置：{服务商: {计量项: 每单位价格}}，可以是 JSON 文本或 JSON 文件路径"""
+    value = value if value is not None else os.getenv("USAGE_PRICES", "")
+    if not value:
+        return {}
+    if os.path.isfile(value):
+        with open(value, encoding="utf-8") as f:
+            return json.load(f)
+    return json.loads(value)
+
+
+def estimate_cost(provider: str, usage: dict[str, float], prices: dict[str, dict[str, float]]) -> float | None:
+    """按单价估算成本；LLM 的 prompt_tokens 单价作用于未命中缓存的部分，未配置单价时返回 None"""
+    unit_prices = prices.get(provider)
+    if not unit_prices:
+        return None
+    billed = dict(usage)
+    if "cache_hit_tokens" in unit_prices and "prompt_tokens" in billed:
+        billed["prompt_tokens"] = billed["prompt_tokens"] - billed.get("cache_hit_tokens", 0)
+    return sum(billed.get(metric, 0) * price for metric, price in unit_prices.items())
@@ -0,0 +1,118 @@
+#
+# DataAgent 语音服务 - 用量报表
+# 从 usage.py 写入的本地用量库汇总 LLM token、TTS 字符数和 STT 音频秒数，
+# 按 Agent / 会话 / 服务商查看用量和估算成本
+#
+# 用法:
+#   python usage_report.py                      # 按 Agent 汇总全部用量
+#   python usage_report.py --by session --since 24h
+#   python usage_report.py --by provider --since 2026-10-01 --json usage.json
+#
+# 成本按 USAGE_PRICES（JSON 文本或文件路径，也可用 --prices 指定）中的单价估算，例如:
+#   {"deepseek-llm": {"prompt_tokens": 0.000002, "cache_hit_tokens": 0.0000005, "completion_tokens": 0.000008}}
+# 其中 prompt_tokens 单价只作用于未命中缓存的部分
+#
+
+import argparse
+import json
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from usage import METRICS, UsageStore, estimate_cost, load_prices, usage_db_path
+
+GROUPS = {"agent": ["agent_id"], "session": ["session_id", "agent_id"], "provider": []}
+
+# 表格里显示的计量项（列名, 计量项）
+COLUMNS = [
+    ("requests", "requests"),
+    ("prompt", "prompt_tokens"),
+    ("cache_hit", "cache_hit_tokens"),
+    ("completion", "completion_tokens"),
+    ("tts_chars", "characters"),
+    ("stt_secs", "audio_secs"),
+]
+
+
+def parse_since(value: str | None) -> float | None:
+    """支持 30m / 24h / 7d 这样的相对时间，或 2026-10-01 这样的日期"""
+    if not value:
+        return None
+    units = {"m": 60, "h": 3600, "d": 86400}
+    if value[-1] in units and value[:-1].replace(".", "", 1).isdigit():
+        return time.time() - float(value[:-1]) * units[value[-1]]
+    return datetime.fromisoformat(value).timestamp()
+
+
+def build_report(store: UsageStore, by: str, since: float | None, prices: dict) -> list[dict]:
+    """每组 + 服务商一行：各计量项、会话数和估算成本"""
+    group_by = GROUPS[by]
+    rows: dict[tuple, dict] = {}
+    for item in store.query(group_by, since=since):
+        key = (*(item[column] for column in group_by), item["provider"])
+        row = rows.setdefault(key, {**{column: item[column] for column in group_by}, "provider": item["provider"]})
+        row[item["metric"]] = round(item["value"], 2)
+        row["sessions"] = max(row.get("sessions", 0), item["sessions"])
+
+    known = {metric for metrics in METRICS.values() for metric in metrics}
+    for row in rows.values():
+        usage = {metric: value for metric, value in row.items() if metric in known}
+        cost = estimate_cost(row["provider"], usage, prices)
+        row["cost"] = round(cost, 4) if cost is not None else None
+    return list(rows.values())
+
+
+def print_table(report: list[dict], by: str):
+    group_columns = GROUPS[by]
+    header = "".join(f"{column:<16}" for column in group_columns) + f"{'provider':<18}{'sessions':>9}"
+    header += "".join(f"{name:>12}" for name, _ in COLUMNS) + f"{'cost':>10}"
+    print(header)
+    print("-" * len(header))
+    total_cost = 0.0
+    for row in report:
+        line = "".join(f"{str(row[column]):<16}" for column in group_columns)
+        line += f"{row['provider']:<18}{row['sessions']:>9}"
+        line += "".join(f"{_number(row.get(metric)):>12}" for _, metric in COLUMNS)
+        line += f"{row['cost']:>10.4f}" if row["cost"] is not None else f"{'-':>10}"
+        total_cost += row["cost"] or 0.0
+        print(line)
+    if any(row["cost"] is not None for row in report):
+        print(f"\n💰 Estimated cost: {total_cost:.4f}")
+
+
+def _number(value) -> str:
+    if value is None:
+        return "-"
+    return f"{value:,.0f}" if float(value).is_integer() else f"{value:,.1f}"
+
+
+def main():
+    load_dotenv(override=True)
+    parser = argparse.ArgumentParser(description="语音服务用量报表：LLM token、TTS 字符、STT 音频时长")
+    parser.add_argument("--db", default=usage_db_path(), help="用量库路径")
+    parser.add_argument("--by", choices=sorted(GROUPS), default="agent", help="汇总维度")
+    parser.add_argument("--since", help="起始时间：30m / 24h / 7d 或 2026-10-01")
+    parser.add_argument("--prices", help="单价配置（JSON 文本或文件路径），默认读取 USAGE_PRICES")
+    parser.add_argument("--json", help="把结果另存为 JSON")
+    args = parser.parse_args()
+
+    if not Path(args.db).exists():
+        print(f"❌ 用量库不存在: {args.db}（语音服务运行后自动创建）")
+        return 1
+
+    report = build_report(UsageStore(args.db), args.by, parse_since(args.since), load_prices(args.prices))
+    if not report:
+        print("📭 没有符合条件的用量记录")
+        return 0
+    print_table(report, args.by)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"\n💾 Report saved to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,6 +5,9 @@
 
 import os
 import json
+from dataclasses import dataclass
+from typing import Callable
+
 from dotenv import load_dotenv
 from loguru import logger
 
@@ -12,6 +15,7 @@ print("🚀 Starting DataAgent Voice Bot...")
 print("⏳ Loading models and imports (20 seconds, first run only)\n")
 
 logger.info("Loading Local Smart Turn Analyzer V3...")
+from pipecat.audio.turn.smart_turn.base_smart_turn import SmartTurnParams
 from pipecat.audio.turn.smart_turn.local_smart_turn_v3 import LocalSmartTurnAnalyzerV3
 
 logger.info("✅ Local Smart Turn Analyzer V3 loaded")
@@ -29,6 +33,7 @@ from pipecat.frames.frames import (
     StartFrame,
     SystemFrame
 )
+from pipecat.observers.base_observer import BaseObserver
 from pipecat.pipeline.pipeline import Pipeline
 from pipecat.pipeline.runner import PipelineRunner
 from pipecat.pipeline.task import PipelineParams, PipelineTask
@@ -37,30 +42,50 @@ from pipecat.processors.aggregators.llm_response_universal import LLMContextAggr
 from pipecat.processors.frameworks.rtvi import RTVIConfig, RTVIObserver, RTVIProcessor
 from pipecat.processors.frame_processor import FrameDirection, FrameProcessor
 from pipecat.runner.types import RunnerArguments
-from pipecat.services.deepgram.stt import DeepgramSTTService
-from pipecat.services.deepseek.llm import DeepSeekLLMService
 from pipecat.transcriptions.language import Language
 from pipecat.services.openai.tts import OpenAITTSService
+from pipecat.services.tts_service import TTSService
 # 其他 TTS 服务会在运行时按需导入
+from pipecat.services.websocket_service import WebsocketService
 from pipecat.transports.base_transport import BaseTransport, TransportParams
 from pipecat.transports.websocket.server import (
     WebsocketServerParams,
-    WebsocketServerTransport,
 )
-from pipecat.serializers.base_serializer import FrameSerializer, FrameSerializerType
-from pipecat.serializers.protobuf import ProtobufFrameSerializer
 from pipecat.frames.frames import (
     OutputTransportMessageFrame, 
-    OutputAudioRawFrame, 
     TextFrame, 
     TranscriptionFrame,
-    InputAudioRawFrame,
     Frame,
     LLMMessagesAppendFrame,
 )
 
+from ack_fillers import AckFillerPlayer
+from agent_switch import AgentSwitcher
+from archive import TurnArchiver, get_archive
+from audio_input import SilenceGate
+from capture import CaptureManager, CaptureObserver
+from drain import DrainController, inherited_socket
+from endpointing import AdaptiveEndpointing, EndpointingPolicy
+from governor import AdmissionWebsocketServerTransport, GovernedDeepgramSTTService, get_governor, govern_tts
+from loop_monitor import LoopHealthReporter, get_loop_monitor, install_loop_policy
+from memory import SessionMemory, get_memory_store
+from metrics_tools import MetricsTools, get_metrics_index
+from parallel_tts import ParallelTTSStage
+from prompt_cache import CacheAwareDeepSeekLLMService, PromptBuilder, PromptCacheMetrics
+from text_channel import TextChannel
+from serializer import HybridAudioSerializer
+from usage import UsageTracker
+from voice_logging import hot_log, setup_logging
+
 load_dotenv(override=True)
 
+# 日志：默认由后台线程格式化和写入，LOG_MODE=sync 恢复同步输出
+setup_logging(
+    mode=os.getenv("LOG_MODE", "async").lower(),
+    level=os.getenv("LOG_LEVEL", "DEBUG").upper(),
+    json_lines=os.getenv("LOG_FORMAT", "text").lower() == "json",
+)
+
 # Agent 配置映射（对应前端的 dataagent）
 # 所有 Agent 共同遵循的语音对话规则
 COMMON_VOICE_RULES = """
@@ -167,113 +192,337 @@ AGENT_PROMPTS = {
 """,
 }
 
+# 各 Agent 的预合成应答语：用户说完后 LLM 还没出声时先播放，掩盖等待
+AGENT_ACK_PHRASES = {
+    "alisa": ["好的，马上查", "收到，稍等"],
+    "nora": ["嗯嗯，我看一下", "好呀，稍等一下"],
+    "attributor": ["好，我来定位一下", "收到，马上分析"],
+    "viz-master": ["好的，我看一下", "嗯，稍等"],
+    "metrics-pro": ["好的，我确认一下口径", "嗯，稍等"],
+    "predictor": ["好，我推算一下", "嗯，稍等"],
+    "default": ["好的，我看一下", "嗯，稍等"],
+}
+
+# 提示词组装：每个 Agent 的系统前缀规范化后逐字节固定，便于命中 DeepSeek 上下文缓存
+PROMPT_BUILDER = PromptBuilder(AGENT_PROMPTS)
+
+# 各 TTS 服务使用的 API Key（限流器按服务商 + Key 统计）
+TTS_API_KEY_ENV = {
+    "deepgram": "DEEPGRAM_API_KEY",
+    "cartesia": "CARTESIA_API_KEY",
+    "elevenlabs": "ELEVENLABS_API_KEY",
+    "piper": None,
+}
+
+
+def create_tts_service(tts_service: str, http_session=None, sample_rate: int | None = None, voice: str | None = None):
+    """创建 TTS 服务
 
-async def run_voice_bot(transport: BaseTransport, runner_args: RunnerArguments, agent_id: str = "alisa"):
-    """运行语音机器人
-    
     Args:
-        transport: 传输层
-        runner_args: 运行参数
-        agent_id: Agent ID，对应前端的 dataagent
+        tts_service: TTS 服务名称（deepgram, cartesia, elevenlabs, piper, openai）
+        http_session: 传入 aiohttp 会话时返回基于 HTTP 请求的实现（同一音色），
+            用于启动时预合成等不在管线里运行的场景；不传则返回管线使用的流式实现
+        sample_rate: 输出采样率，None 表示由管线 StartFrame 决定
+        voice: 音色 ID，None 表示使用 .env 中的配置（Piper 忽略）
     """
-    logger.info(f"Starting voice bot for agent: {agent_id}")
-
-    # STT: Deepgram (配置为中文)
-    try:
-        from deepgram import LiveOptions
-        stt = DeepgramSTTService(
-            api_key=os.getenv("DEEPGRAM_API_KEY"),
-            live_options=LiveOptions(
-                language="zh-CN",  # 使用简体中文
-                model="nova-2",  # 使用支持中文的模型
-                interim_results=True,
-                punctuate=True,
-                smart_format=True,
-            )
-        )
-        logger.info("✅ Deepgram STT 已配置为中文（zh-CN），模型：nova-2")
-    except ImportError:
-        # 如果无法导入 LiveOptions，使用默认配置
-        logger.warning("无法导入 LiveOptions，使用默认 STT 配置（英文）")
-        stt = DeepgramSTTService(api_key=os.getenv("DEEPGRAM_API_KEY"))
-    except Exception as e:
-        logger.error(f"配置 Deepgram STT 时出错: {e}，使用默认配置")
-        stt = DeepgramSTTService(api_key=os.getenv("DEEPGRAM_API_KEY"))
+    http_mode = http_session is not None
+    voice_kwargs = {"voice": voice} if voice else {}
 
-    # TTS: 优先使用 Deepgram（与 STT 共用 API Key），如果没有配置其他服务则使用 Deepgram
-    tts_service = os.getenv("TTS_SERVICE", "deepgram").lower()
-    
     if tts_service == "deepgram":
         # 使用 Deepgram TTS（与 STT 共用 API Key）
         # 注意：Deepgram TTS 主要支持英文语音模型，中文发音可能不够自然
+        if http_mode:
+            from pipecat.services.deepgram.tts import DeepgramHttpTTSService
+            return DeepgramHttpTTSService(
+                api_key=os.getenv("DEEPGRAM_API_KEY"),
+                aiohttp_session=http_session,
+                sample_rate=sample_rate,
+                **voice_kwargs,
+            )
         from pipecat.services.deepgram.tts import DeepgramTTSService
-        tts = DeepgramTTSService(api_key=os.getenv("DEEPGRAM_API_KEY"))
+        tts = DeepgramTTSService(api_key=os.getenv("DEEPGRAM_API_KEY"), sample_rate=sample_rate, **voice_kwargs)
         logger.info("✅ 使用 Deepgram TTS（与 STT 共用 API Key）")
         logger.warning("⚠️ 注意：Deepgram TTS 主要支持英文语音模型，中文发音可能不够自然。如需更自然的中文发音，建议使用 Cartesia TTS。")
+        return tts
     elif tts_service == "cartesia":
         # 使用 Cartesia TTS（高质量，免费额度）
-        from pipecat.services.cartesia.tts import CartesiaTTSService, GenerationConfig
-        from pipecat.transcriptions.language import Language
+        from pipecat.services.cartesia.tts import (
+            CartesiaHttpTTSService,
+            CartesiaTTSService,
+            GenerationConfig,
+        )
+        service_cls = CartesiaHttpTTSService if http_mode else CartesiaTTSService
         # 配置中文语言支持和优化参数（Sonic-3 模型）
         generation_config = GenerationConfig(
             speed=1.0,  # 正常语速（范围: 0.6-1.5，可调整）
             volume=1.0,  # 正常音量（范围: 0.5-2.0，可调整）
         )
-        params = CartesiaTTSService.InputParams(
+        params = service_cls.InputParams(
             language=Language.ZH,  # 中文语言
             generation_config=generation_config,  # 使用 Sonic-3 优化参数
         )
-        tts = CartesiaTTSService(
+        tts = service_cls(
             api_key=os.getenv("CARTESIA_API_KEY"),
-            voice_id=os.getenv("CARTESIA_VOICE_ID", "71a7ad14-091c-4e8e-a314-022ece01c121"),
+            voice_id=voice or os.getenv("CARTESIA_VOICE_ID", "71a7ad14-091c-4e8e-a314-022ece01c121"),
             model="sonic-3",  # 使用最新的 Sonic-3 模型（更好的质量和更低延迟）
+            sample_rate=sample_rate,
             params=params,
         )
-        logger.info("✅ 使用 Cartesia TTS（已优化：Sonic-3 模型 + 中文语言 + 优化参数）")
+        if not http_mode:
+            logger.info("✅ 使用 Cartesia TTS（已优化：Sonic-3 模型 + 中文语言 + 优化参数）")
+        return tts
     elif tts_service == "elevenlabs":
         # 使用 ElevenLabs TTS（自然语音）
+        voice_id = voice or os.getenv("ELEVENLABS_VOICE_ID", "21m00Tcm4TlvDq8ikWAM")
+        if http_mode:
+            from pipecat.services.elevenlabs.tts import ElevenLabsHttpTTSService
+            return ElevenLabsHttpTTSService(
+                api_key=os.getenv("ELEVENLABS_API_KEY"),
+                voice_id=voice_id,
+                aiohttp_session=http_session,
+                sample_rate=sample_rate,
+            )
         from pipecat.services.elevenlabs.tts import ElevenLabsTTSService
         tts = ElevenLabsTTSService(
             api_key=os.getenv("ELEVENLABS_API_KEY"),
-            voice_id=os.getenv("ELEVENLABS_VOICE_ID", "21m00Tcm4TlvDq8ikWAM"),
+            voice_id=voice_id,
+            sample_rate=sample_rate,
         )
         logger.info("✅ 使用 ElevenLabs TTS")
+        return tts
     elif tts_service == "piper":
-        # 使用 Piper TTS（完全免费，本地运行）
-        from pipecat.services.piper.tts import PiperTTSService
-        tts = PiperTTSService()
-        logger.info("✅ 使用 Piper TTS（本地免费）")
+        # 使用 Piper TTS（完全免费，本地运行）：所有会话共用进程内常驻模型的工作进程池
+        from piper_pool import PiperPoolTTSService, get_piper_engine
+        tts = PiperPoolTTSService(get_piper_engine(), sample_rate=sample_rate)
+        if not http_mode:
+            logger.info("✅ 使用 Piper TTS（本地免费）")
+        return tts
     else:
-        # 默认使用 OpenAI TTS
+        # 默认使用 OpenAI TTS（本身就是 HTTP 实现）
         # 推荐中文语音: nova (清晰自然), shimmer (温暖), alloy (平衡), echo (清晰)
-        voice = os.getenv("OPENAI_TTS_VOICE", "nova")  # 默认使用 nova，适合中文
+        voice = voice or os.getenv("OPENAI_TTS_VOICE", "nova")  # 默认使用 nova，适合中文
         tts = OpenAITTSService(
             api_key=os.getenv("OPENAI_API_KEY"),
             voice=voice,  # 可选: nova (推荐中文), alloy, echo, fable, onyx, shimmer
+            sample_rate=sample_rate,
         )
-        logger.info(f"✅ 使用 OpenAI TTS，语音: {voice} (推荐中文: nova)")
+        if not http_mode:
+            logger.info(f"✅ 使用 OpenAI TTS，语音: {voice} (推荐中文: nova)")
+        return tts
+
+
+def loop_monitor_enabled() -> bool:
+    return os.getenv("LOOP_MONITOR", "1") != "0"
+
+
+@dataclass
+class VoiceServices:
+    """一个会话使用的 STT / LLM / TTS 服务（批量评测、CI 可以换成本地替身）"""
+
+    stt: FrameProcessor
+    llm: FrameProcessor
+    tts: TTSService
+    tts_name: str  # TTS 服务名称，用于区分应答语缓存和用量统计
+    llm_provider: str = "deepseek-llm"  # 用量统计里的服务商名称
+    stt_provider: str = "deepgram-stt"
+    # (aiohttp 会话, 采样率, 音色) -> HTTP 版 TTS，用于预合成应答语（可选）
+    ack_tts_factory: Callable | None = None
+
+    @property
+    def tts_provider(self) -> str:
+        return f"{self.tts_name}-tts"
+
 
-    # LLM: DeepSeek (使用项目已有的 DeepSeek API)
-    llm = DeepSeekLLMService(
+def create_voice_services() -> VoiceServices:
+    """按 .env 配置创建真实的 STT / LLM / TTS 服务（都经过进程内共享的限流器）"""
+    # STT: Deepgram (配置为中文)
+    try:
+        from deepgram import LiveOptions
+        stt = GovernedDeepgramSTTService(
+            api_key=os.getenv("DEEPGRAM_API_KEY"),
+            live_options=LiveOptions(
+                language="zh-CN",  # 使用简体中文
+                model="nova-2",  # 使用支持中文的模型
+                interim_results=True,
+                punctuate=True,
+                smart_format=True,
+            )
+        )
+        logger.info("✅ Deepgram STT 已配置为中文（zh-CN），模型：nova-2")
+    except ImportError:
+        # 如果无法导入 LiveOptions，使用默认配置
+        logger.warning("无法导入 LiveOptions，使用默认 STT 配置（英文）")
+        stt = GovernedDeepgramSTTService(api_key=os.getenv("DEEPGRAM_API_KEY"))
+    except Exception as e:
+        logger.error(f"配置 Deepgram STT 时出错: {e}，使用默认配置")
+        stt = GovernedDeepgramSTTService(api_key=os.getenv("DEEPGRAM_API_KEY"))
+
+    # TTS: 优先使用 Deepgram（与 STT 共用 API Key），如果没有配置其他服务则使用 Deepgram
+    tts_service = os.getenv("TTS_SERVICE", "deepgram").lower()
+    tts_key_env = TTS_API_KEY_ENV.get(tts_service, "OPENAI_API_KEY")
+    tts_api_key = os.getenv(tts_key_env) if tts_key_env else None
+    # 每次合成都经过进程内共享的限流器（令牌桶 + 并发上限）；本地 Piper 由引擎自己的队列调度
+    def governed(tts: TTSService) -> TTSService:
+        return tts if tts_service == "piper" else govern_tts(tts, tts_service, tts_api_key)
+
+    tts = governed(create_tts_service(tts_service))
+
+    # LLM: DeepSeek (使用项目已有的 DeepSeek API)，并上报上下文缓存命中 token
+    llm = CacheAwareDeepSeekLLMService(
         api_key=os.getenv("DEEPSEEK_API_KEY", os.getenv("VITE_DEEPSEEK_API_KEY")),
         model="deepseek-chat",
+        governor=get_governor(),
+    )
+
+    return VoiceServices(
+        stt=stt,
+        llm=llm,
+        tts=tts,
+        tts_name=tts_service,
+        ack_tts_factory=lambda session, rate, voice=None: governed(
+            create_tts_service(tts_service, session, rate, voice)
+        ),
     )
 
-    # 获取 Agent 的系统提示词
-    system_prompt = AGENT_PROMPTS.get(agent_id, AGENT_PROMPTS["default"])
 
-    messages = [
-        {
-            "role": "system",
-            "content": system_prompt,
-        },
-    ]
+def create_turn_analyzers() -> tuple[SileroVADAnalyzer, LocalSmartTurnAnalyzerV3]:
+    """创建一个会话的 VAD 和 Smart Turn 分析器（都有状态，不能在会话之间共享）"""
+    vad_analyzer = SileroVADAnalyzer(params=VADParams(stop_secs=float(os.getenv("VAD_STOP_SECS", "0.2"))))
+    turn_analyzer = LocalSmartTurnAnalyzerV3(
+        params=SmartTurnParams(stop_secs=float(os.getenv("SMART_TURN_STOP_SECS", "3")))
+    )
+    return vad_analyzer, turn_analyzer
+
+
+async def run_voice_bot(
+    transport: BaseTransport,
+    runner_args: RunnerArguments,
+    agent_id: str = "alisa",
+    services: VoiceServices | None = None,
+    observers: list[BaseObserver] | None = None,
+    drain: DrainController | None = None,
+):
+    """运行语音机器人
+    
+    Args:
+        transport: 传输层
+        runner_args: 运行参数
+        agent_id: Agent ID，对应前端的 dataagent
+        services: STT / LLM / TTS 服务，None 表示按 .env 创建真实服务
+        observers: 额外的管线观察者（批量评测用来记录各阶段耗时）
+        drain: 排空与平滑重启控制器（WebSocket 服务器使用），负责就绪报告、SIGTERM 和会话恢复
+    """
+    logger.info(f"Starting voice bot for agent: {agent_id}")
+
+    services = services or create_voice_services()
+    stt, llm, tts = services.stt, services.llm, services.tts
+
+    # 句子级并行合成：HTTP 类 TTS 默认一句一句串行请求，这里提前并发合成后面几句
+    parallel_tts = None
+    parallel_sentences = int(os.getenv("TTS_PARALLEL_SENTENCES", "3"))
+    if parallel_sentences > 1 and not isinstance(tts, WebsocketService):
+        parallel_tts = ParallelTTSStage(tts, max_inflight=parallel_sentences)
+        logger.info(f"✅ TTS 句子级并行合成已启用（每会话 {parallel_sentences} 句）")
+
+    # 预合成应答语：启动时合成一次，之后每轮零额外调用
+    ack_filler = None
+    if os.getenv("ACK_FILLERS", "1") != "0":
+        ack_filler = AckFillerPlayer(
+            agent_id,
+            AGENT_ACK_PHRASES.get(agent_id, AGENT_ACK_PHRASES["default"]),
+            voice_key=services.tts_name,
+            http_tts_factory=services.ack_tts_factory,
+            delay_secs=float(os.getenv("ACK_FILLER_DELAY_SECS", "0.8")),
+        )
+
+    # 指标查询（METRICS_INDEX）：LLM 通过函数调用查本地预聚合的指标，数据目录放在动态内容里
+    metrics_index = get_metrics_index()
+    metrics_tools = MetricsTools(metrics_index) if metrics_index else None
+    memory_store = get_memory_store()
+    memory = None
+
+    def prompt_sections() -> dict[str, str]:
+        sections = metrics_tools.prompt_sections() if metrics_tools else {}
+        if memory:
+            sections.update(memory.sections())
+        return sections
+
+    # 获取 Agent 的系统提示词：静态前缀（可缓存）在前，会话时间等动态内容在后
+    messages = PROMPT_BUILDER.build_messages(agent_id, prompt_sections())
+    prefix_hash = PROMPT_BUILDER.prefix_hash(agent_id)
+    logger.info(f"Prompt prefix for {agent_id}: {prefix_hash} ({len(messages[0]['content'])} chars)")
+    prompt_cache_metrics = PromptCacheMetrics(agent_id, prefix_hash)
 
     context = LLMContext(messages)
+    if metrics_tools:
+        context.set_tools(metrics_tools.tools_schema())
+        metrics_tools.register(llm)
     context_aggregator = LLMContextAggregatorPair(context)
 
+    # 用户长期记忆（MEMORY）：客户端 identify 后载入该用户的记忆，每轮检索相关的插在用户这句话前面
+    if memory_store:
+        memory = SessionMemory(
+            memory_store, context, PROMPT_BUILDER, agent_id=lambda: agent_switcher.agent_id, sections=prompt_sections
+        )
+
+    # 文字通道：同一条 WebSocket 上的打字输入直接进本会话上下文，回答以文字增量发回（可选朗读）
+    text_channel = TextChannel(transport) if os.getenv("TEXT_CHANNEL", "1") != "0" else None
+
     rtvi = RTVIProcessor(config=RTVIConfig(config=[]))
 
+    # 用量统计：LLM token、TTS 字符数、发给 STT 的音频秒数，按会话 / Agent / 服务商累加并定期写入本地库
+    usage_tracker = UsageTracker(
+        agent_id,
+        providers={llm: (services.llm_provider, "llm"), tts: (services.tts_provider, "tts")},
+        stt_provider=services.stt_provider,
+        stt_audio_secs=lambda: silence_gate.stats()["sent_secs"],
+    )
+
+    # 会话内切换 Agent：替换系统提示词（可选切换音色），保留对话历史
+    agent_switcher = AgentSwitcher(
+        agent_id,
+        context,
+        PROMPT_BUILDER,
+        transport,
+        voices=json.loads(os.getenv("AGENT_TTS_VOICES", "{}") or "{}"),
+        ack_phrases=AGENT_ACK_PHRASES,
+        prompt_cache_metrics=prompt_cache_metrics,
+        ack_filler=ack_filler,
+        usage_tracker=usage_tracker,
+        sections=prompt_sections,
+    )
+
+    # 对话归档（ARCHIVE=1）：每轮结束时放进无阻塞队列，由后台线程压缩写盘
+    archive = get_archive()
+    turn_archiver = (
+        TurnArchiver(
+            archive,
+            session_id=lambda: usage_tracker.session_id,
+            agent_id=lambda: agent_switcher.agent_id,
+            processors={llm.name: "llm", tts.name: "tts"},
+        )
+        if archive
+        else None
+    )
+
+    # STT 前整形：统一切成 20ms 帧，用户没说话时不把静音发给 Deepgram
+    silence_gate = SilenceGate(
+        mode=os.getenv("STT_SILENCE_MODE", "gate").lower(),
+        preroll_secs=float(os.getenv("STT_PREROLL_SECS", "0.5")),
+        hangover_secs=float(os.getenv("STT_HANGOVER_SECS", "0.3")),
+    )
+
+    # 断句参数：fixed 使用固定值，adaptive 按本会话的停顿统计动态调整
+    endpointing = AdaptiveEndpointing(
+        vad_analyzer=transport.input().vad_analyzer,
+        turn_analyzer=transport.input().turn_analyzer,
+        policy=EndpointingPolicy(
+            vad_stop_secs=float(os.getenv("VAD_STOP_SECS", "0.2")),
+            turn_stop_secs=float(os.getenv("SMART_TURN_STOP_SECS", "3")),
+        ),
+        mode=os.getenv("ENDPOINTING_MODE", "fixed").lower(),
+    )
+
     # 创建转录结果处理器，将转录文本发送给客户端
     class TranscriptSender(FrameProcessor):
         """将转录结果通过 WebSocket 发送给客户端"""
@@ -312,42 +561,79 @@ async def run_voice_bot(transport: BaseTransport, runner_args: RunnerArguments,
                 # 通过 WebSocket 发送转录结果
                 try:
                     # 使用 transport 的 send_message 方法发送文本消息
-                    message_data = json.dumps({
+                    # 中间转写（final=false）参与控制消息合批，最终转写立即发送
+                    message_data = {
                         'type': 'transcript',
-                        'text': text
-                    })
+                        'text': text,
+                        'final': not isinstance(frame, InterimTranscriptionFrame),
+                    }
                     message_frame = OutputTransportMessageFrame(message=message_data)
                     # 通过 transport 的 output 发送消息
                     output_transport = self.transport.output()
                     if hasattr(output_transport, 'send_message'):
                         await output_transport.send_message(message_frame)
-                        logger.info(f"✅ Sent transcript to client: {text}")
+                        # 高频事件：采样 + 限速，文本作为字段记录
+                        if isinstance(frame, InterimTranscriptionFrame):
+                            interim_log("✅ Sent interim transcript", chars=len(text))
+                        else:
+                            final_log("✅ Sent transcript to client", text=text)
                     else:
                         # 备用方案：直接通过 WebSocket 发送
                         logger.warning("Transport output doesn't have send_message, using fallback")
                 except Exception as e:
-                    logger.error(f"❌ Failed to send transcript: {e}")
-                    import traceback
-                    logger.error(traceback.format_exc())
+                    # traceback 由后台日志线程格式化
+                    error_log.error("❌ Failed to send transcript", error=repr(e), exc=e)
             
             # 继续传递 frame
             await self.push_frame(frame, direction)
 
+    interim_log = hot_log("transcript.interim")
+    final_log = hot_log("transcript.final", level="INFO")
+    error_log = hot_log("transport.error")
     transcript_sender = TranscriptSender(transport)
 
-    pipeline = Pipeline(
-        [
-            transport.input(),  # 接收用户音频输入
-            rtvi,  # RTVI 处理器
-            stt,  # 语音转文字
-            transcript_sender,  # 发送转录结果给客户端
-            context_aggregator.user(),  # 用户消息
-            llm,  # DeepSeek LLM
-            tts,  # 文字转语音
-            transport.output(),  # 输出音频
-            context_aggregator.assistant(),  # 助手回复
-        ]
-    )
+    processors = [
+        transport.input(),  # 接收用户音频输入
+    ]
+    if loop_monitor_enabled():
+        # 事件循环延迟和阻塞来源，随其他指标以 MetricsFrame 输出
+        processors.append(LoopHealthReporter(report_secs=float(os.getenv("LOOP_REPORT_SECS", "10"))))
+    if drain:
+        processors.append(drain.resumer(context, agent_switcher))  # 平滑重启后恢复会话（须在 RTVI 之前）
+    if memory:
+        processors.append(memory.handler())  # 处理 identify 消息，载入用户记忆（须在 RTVI 之前）
+    if text_channel:
+        processors.append(text_channel.handler())  # 文字输入跳过 STT 直接进上下文（须在 RTVI 之前）
+    processors += [
+        agent_switcher,  # 处理切换 Agent 的控制消息（须在 RTVI 之前）
+        endpointing,  # 自适应断句（按会话调整 VAD / Smart Turn 参数）
+        rtvi,  # RTVI 处理器
+        silence_gate,  # 切成 20ms 帧并拦截静音
+        stt,  # 语音转文字
+        transcript_sender,  # 发送转录结果给客户端
+        context_aggregator.user(),  # 用户消息
+    ]
+    if memory:
+        processors.append(memory.injector())  # 检索并插入与这句话相关的用户记忆
+    processors += [
+        llm,  # DeepSeek LLM
+        prompt_cache_metrics,  # 记录每轮上下文缓存命中情况
+    ]
+    if text_channel:
+        processors.append(text_channel.streamer())  # 文字请求的回答逐段发回客户端
+    if parallel_tts:
+        processors.append(parallel_tts)  # 并行合成后面几句，按顺序输出
+    processors += [
+        tts,  # 文字转语音
+        usage_tracker,  # 记录 LLM / TTS 用量
+    ]
+    if ack_filler:
+        processors.append(ack_filler)  # LLM 迟迟未出声时播放预合成应答语
+    processors += [
+        transport.output(),  # 输出音频
+        context_aggregator.assistant(),  # 助手回复
+    ]
+    pipeline = Pipeline(processors)
 
     task = PipelineTask(
         pipeline,
@@ -355,10 +641,17 @@ async def run_voice_bot(transport: BaseTransport, runner_args: RunnerArguments,
             enable_metrics=True,
             enable_usage_metrics=True,
         ),
-        observers=[RTVIObserver(rtvi)],
+        observers=[
+            RTVIObserver(rtvi),
+            *(observers or []),
+            *([drain.activity] if drain else []),
+            *([turn_archiver] if turn_archiver else []),
+        ],
         idle_timeout_secs=None,  # 禁用 idle timeout，保持服务持续运行
         cancel_on_idle_timeout=False,  # 不在 idle 时自动取消
     )
+    if drain:
+        drain.attach(task, context, agent_switcher, llm)
 
     @transport.event_handler("on_client_connected")
     async def on_client_connected(transport, client):
@@ -368,7 +661,32 @@ async def run_voice_bot(transport: BaseTransport, runner_args: RunnerArguments,
 
     @transport.event_handler("on_client_disconnected")
     async def on_client_disconnected(transport, client):
-        logger.info(f"Client disconnected for agent: {agent_id}")
+        logger.info(f"Client disconnected for agent: {agent_switcher.agent_id}")
+        logger.info(f"Prompt cache summary: {prompt_cache_metrics.summary()}")
+        logger.info(f"STT audio summary: {silence_gate.stats()}")
+        logger.info(f"Endpointing: {endpointing.current}")
+        if metrics_tools:
+            logger.info(f"Metrics tools: {metrics_tools.stats()}")
+        await endpointing.reset()
+        logger.info(f"Provider governor: {get_governor().stats()}")
+        if text_channel:
+            logger.info(f"Text channel: {text_channel.stats()}")
+        if memory:
+            logger.info(f"User memory: {memory.stats()}")
+            await memory.end_session()
+        # 管线在多个连接间复用：清空按会话的工具结果缓存，指标文件更新过就换上新索引
+        # （在记忆会话结束之后，重建的系统消息不会带上一位用户的记忆）
+        if metrics_tools and metrics_tools.reset(get_metrics_index()):
+            context.set_tools(metrics_tools.tools_schema())
+            context.set_messages(
+                PROMPT_BUILDER.rebuild_messages(context.get_messages(), agent_switcher.agent_id, prompt_sections())
+            )
+            logger.info("Metrics index changed, tools and data catalog refreshed for the next session")
+        if turn_archiver:
+            turn_archiver.end_session()
+            logger.info(f"Archive: {archive.stats()}")
+        session_id = usage_tracker.session_id
+        logger.info(f"Usage for session {session_id}: {await usage_tracker.end_session()}")
         # 不清除任务，允许新客户端连接
         # await task.cancel()  # 注释掉，保持服务运行
 
@@ -383,71 +701,17 @@ async def bot(runner_args: RunnerArguments, agent_id: str = "alisa"):
         runner_args: 运行参数
         agent_id: Agent ID
     """
+    # 事件循环监控：计时任务工厂要在创建传输层和管线之前安装，才能覆盖所有处理器的任务
+    if loop_monitor_enabled():
+        get_loop_monitor().install()
+
     # WebSocket 服务器配置
     host = os.getenv("WS_HOST", "localhost")
     port = int(os.getenv("WS_PORT", "8765"))
 
     # VAD 和 Turn Analyzer 配置
-    vad_analyzer = SileroVADAnalyzer(params=VADParams(stop_secs=0.2))
-    turn_analyzer = LocalSmartTurnAnalyzerV3()
-
-    # 创建一个混合 serializer：音频帧直接发送原始 WAV 数据，其他帧使用 Protobuf
-    class HybridAudioSerializer(FrameSerializer):
-        """混合序列化器：音频帧直接发送原始 WAV 数据，其他帧使用 Protobuf，输入接受原始 PCM"""
-        def __init__(self):
-            self.protobuf_serializer = ProtobufFrameSerializer()
-        
-        @property
-        def type(self) -> FrameSerializerType:
-            return FrameSerializerType.BINARY
-        
-        async def serialize(self, frame: Frame) -> bytes | None:
-            # 音频帧直接返回原始音频数据（已经包含 WAV 头，因为 add_wav_header=True）
-            if isinstance(frame, OutputAudioRawFrame):
-                return frame.audio
-            
-            # 跳过不可序列化的帧（如 InterruptionFrame），这些帧不需要发送到前端
-            try:
-                # 其他帧使用 Protobuf 序列化
-                return await self.protobuf_serializer.serialize(frame)
-            except Exception:
-                # 如果序列化失败（如 InterruptionFrame），返回 None 跳过
-                # 这些帧通常不需要发送到客户端
-                return None
-        
-        async def deserialize(self, data: bytes) -> Frame | None:
-            # 先尝试 Protobuf 反序列化（处理文本消息等）
-            try:
-                frame = await self.protobuf_serializer.deserialize(data)
-                if frame:
-                    return frame
-            except Exception:
-                # Protobuf 反序列化失败，继续尝试其他格式
-                pass
-            
-            # 如果 Protobuf 反序列化失败，假设是原始 PCM 数据
-            # 检查是否是有效的 PCM 数据（至少要有一些数据）
-            if len(data) < 2:
-                return None
-            
-            # 检查是否是文本消息（JSON 格式）
-            try:
-                text = data.decode('utf-8')
-                if text.strip().startswith('{'):
-                    # JSON 消息，尝试让 Protobuf 处理（可能已在上面的 try 中失败）
-                    return None
-            except:
-                # 不是文本，继续处理为 PCM
-                pass
-            
-            # 假设是原始 PCM 16-bit 数据
-            # 创建 InputAudioRawFrame
-            return InputAudioRawFrame(
-                audio=data,
-                num_channels=1,
-                sample_rate=16000  # 前端发送的采样率
-            )
-    
+    vad_analyzer, turn_analyzer = create_turn_analyzers()
+
     # WebSocket 传输参数
     # 使用混合序列化器：输出 Protobuf+WAV，输入接受原始 PCM
     serializer = HybridAudioSerializer()
@@ -460,27 +724,44 @@ async def bot(runner_args: RunnerArguments, agent_id: str = "alisa"):
         add_wav_header=True,  # 添加 WAV 头，方便前端直接解码
     )
 
-    # 创建 WebSocket 传输
-    transport = WebsocketServerTransport(
+    # 创建 WebSocket 传输：已有用户在通话或服务商容量耗尽时，新连接收到 busy 提示后关闭
+    transport = AdmissionWebsocketServerTransport(
         params=transport_params,
         host=host,
         port=port,
+        # 控制消息合批窗口：RTVI 事件、指标、中间转写按 tick 合成一条发送（0 表示逐条发送）
+        control_tick_secs=float(os.getenv("CONTROL_BATCH_MS", "30")) / 1000,
     )
 
+    # 会话录制（CAPTURE=1）：收发的原始消息和关键帧时间点写入内存映射环形文件，供 replay_capture.py 回放
+    captures = CaptureManager.from_env()
+
     # 注册事件处理器
     @transport.event_handler("on_client_connected")
     async def on_client_connected(transport, ws):
         logger.info(f"Client connected: {ws.remote_address}")
+        if captures:
+            serializer.capture = captures.start(agent_id)
 
     @transport.event_handler("on_client_disconnected")
     async def on_client_disconnected(transport, ws):
         logger.info(f"Client disconnected: {ws.remote_address}")
+        if transport.output().control:
+            logger.info(f"Control messages: {transport.output().control.stats()}")
+        if captures:
+            serializer.capture = None
+            captures.stop()
 
     @transport.event_handler("on_websocket_ready")
     async def on_websocket_ready(transport):
         logger.info(f"WebSocket server ready on ws://{host}:{port}")
 
-    await run_voice_bot(transport, runner_args, agent_id)
+    # 平滑重启：SIGTERM 时排空，并把监听 socket 交给预热好的新进程；由上一个进程拉起时沿用它的监听 socket
+    transport.input().listen_socket = inherited_socket()
+    drain = DrainController.from_env(transport)
+
+    observers = [CaptureObserver(lambda: captures.current)] if captures else None
+    await run_voice_bot(transport, runner_args, agent_id, observers=observers, drain=drain)
 
 
 if __name__ == "__main__":
@@ -496,6 +777,9 @@ if __name__ == "__main__":
     runner_args = RunnerArguments()
     runner_args.handle_sigint = True
 
+    # 事件循环：LOOP_POLICY=uvloop 时使用 uvloop（需 pip install uvloop，Windows 不支持）
+    install_loop_policy(os.getenv("LOOP_POLICY", "asyncio").lower())
+
     # 运行 bot
     asyncio.run(bot(runner_args, agent_id))
 
@@ -0,0 +1,194 @@
+#
+# DataAgent 语音服务 - 热路径日志
+# loguru 默认在调用方线程里格式化并同步写 stderr，process_frame 里每条日志都在和音频帧抢事件循环。
+# 这里把格式化和写入挪到后台线程，并对高频事件做采样和限速，字段以结构化方式记录
+#
+
+import atexit
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+
+from loguru import logger
+from loguru._recattrs import RecordException
+
+# 高频事件的默认采样（每 N 条取 1 条）和每秒上限；未列出的类别不采样，只限速
+HOT_PATH_DEFAULTS = {
+    "transcript.interim": (10, 2.0),
+    "transcript.final": (1, 5.0),
+    "transport.error": (1, 1.0),
+}
+
+
+class BackgroundSink:
+    """loguru 的 sink：调用方只把 record 放进队列，格式化和写入都在后台线程完成
+
+    异常不通过 logger.exception 记录（loguru 会在调用方线程格式化整段 traceback），
+    而是作为 exc 字段传入，由后台线程格式化。
+
+    Args:
+        stream: 输出流
+        json_lines: 每条日志输出为一行 JSON（字段平铺）
+        batch_size: 后台线程每次最多合并写入的条数
+    """
+
+    def __init__(self, stream=None, json_lines: bool = False, batch_size: int = 256):
+        self._stream = stream or sys.stderr
+        self._json_lines = json_lines
+        self._batch_size = batch_size
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def __call__(self, message):
+        self._queue.put(message.record)
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join(timeout=2)
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                return
+            lines = [self._format(record)]
+            while len(lines) < self._batch_size:
+                try:
+                    record = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is None:
+                    self._write(lines)
+                    return
+                lines.append(self._format(record))
+            self._write(lines)
+
+    def _write(self, lines: list[str]):
+        try:
+            self._stream.write("".join(lines))
+            self._stream.flush()
+        except Exception:
+            pass
+
+    def _format(self, record: dict) -> str:
+        fields = dict(record["extra"])
+        exc = fields.pop("exc", None)
+        error = "".join(traceback.format_exception(exc)) if isinstance(exc, BaseException) else ""
+        # logger.exception() / opt(exception=...) 带的异常在 record["exception"] 里
+        if not error and record["exception"] is not None:
+            kind, value, tb = record["exception"]
+            error = "".join(traceback.format_exception(kind, value, tb))
+        if self._json_lines:
+            entry = {
+                "time": record["time"].isoformat(timespec="milliseconds"),
+                "level": record["level"].name,
+                "name": record["name"],
+                "function": record["function"],
+                "message": record["message"],
+                **fields,
+            }
+            if error:
+                entry["traceback"] = error
+            return json.dumps(entry, ensure_ascii=False, default=str) + "\n"
+        extra = "".join(f" {key}={value!r}" for key, value in fields.items())
+        line = (
+            f"{record['time']:%H:%M:%S.%f}"[:-3]
+            + f" | {record['level'].name:<8} | {record['name']}:{record['function']}:{record['line']}"
+            + f" - {record['message']}{extra}\n"
+        )
+        return line + error
+
+
+class HotPathLog:
+    """高频事件日志：先采样（每 sample_every 条取 1 条），再按 max_per_sec 限速
+
+    被丢弃的条数会附在下一条输出的 suppressed 字段里。消息应为固定文本，
+    变化的内容全部放进字段，格式化推迟到后台线程。
+    """
+
+    def __init__(self, category: str, level: str = "DEBUG", sample_every: int = 1, max_per_sec: float = 5.0):
+        self.category = category
+        self._level = level
+        self._sample_every = max(sample_every, 1)
+        self._max_per_sec = max_per_sec
+        self._tokens = max_per_sec
+        self._updated = time.monotonic()
+        self._seen = 0
+        self._suppressed = 0
+
+    def _allow(self) -> bool:
+        self._seen += 1
+        if self._seen % self._sample_every:
+            self._suppressed += 1
+            return False
+        now = time.monotonic()
+        self._tokens = min(self._max_per_sec, self._tokens + (now - self._updated) * self._max_per_sec)
+        self._updated = now
+        if self._tokens < 1:
+            self._suppressed += 1
+            return False
+        self._tokens -= 1
+        return True
+
+    def _emit(self, message: str, level: str, fields: dict):
+        if not self._allow():
+            return
+        if self._suppressed:
+            fields["suppressed"] = self._suppressed
+            self._suppressed = 0
+        # 字段走 bind 而不是关键字参数，消息不会经过 str.format；
+        # depth=2：记录真正调用 __call__ / error 的位置
+        logger.bind(category=self.category, **fields).opt(depth=2).log(level, message)
+
+    def __call__(self, message: str, **fields):
+        self._emit(message, self._level, fields)
+
+    def error(self, message: str, **fields):
+        self._emit(message, "ERROR", fields)
+
+
+_HOT_LOGS: dict[str, HotPathLog] = {}
+
+
+def hot_log(category: str, level: str = "DEBUG") -> HotPathLog:
+    """按类别获取高频日志（进程内共享同一套采样 / 限速状态）"""
+    log = _HOT_LOGS.get(category)
+    if log is None:
+        sample_every, max_per_sec = HOT_PATH_DEFAULTS.get(category, (1, 5.0))
+        rate = os.getenv("LOG_HOT_PATH_RATE")
+        log = HotPathLog(category, level, sample_every, float(rate) if rate else max_per_sec)
+        _HOT_LOGS[category] = log
+    return log
+
+
+def _attach_exc(record: dict):
+    """同步模式下把 exc 字段转成 loguru 自己的异常信息，默认格式才会带上 traceback"""
+    exc = record["extra"].get("exc")
+    if record["exception"] is None and isinstance(exc, BaseException):
+        record["exception"] = RecordException(type(exc), exc, exc.__traceback__)
+
+
+def setup_logging(
+    mode: str = "async", level: str = "DEBUG", json_lines: bool = False, stream=None
+) -> BackgroundSink | None:
+    """配置全局 loguru
+
+    mode="async" 使用 BackgroundSink；mode="sync" 保持 loguru 默认的同步输出
+    （只调整级别，exc 字段照样输出 traceback），用于排查日志丢失等问题。stream 默认为 stderr。
+    """
+    logger.remove()
+    stream = stream or sys.stderr
+    if mode != "async":
+        logger.configure(patcher=_attach_exc)
+        logger.add(stream, level=level, serialize=json_lines)
+        return None
+    logger.configure(patcher=None)
+    sink = BackgroundSink(stream, json_lines=json_lines)
+    logger.add(sink, level=level, format="{message}", backtrace=False, diagnose=False)
+    atexit.register(sink.stop)
+    return sink